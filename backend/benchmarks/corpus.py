@@ -0,0 +1,177 @@
+"""
+Synthetic document corpus for the benchmarks.
+
+Documents are generated from a fixed vocabulary with a seeded random
+generator, so the same seed and sizes always give byte-identical files.
+PDFs are written directly (one Helvetica text stream per page) so no PDF
+library is needed; DOCX files are written with python-docx.
+
+    python -m benchmarks.corpus --output corpus/ --sizes small,medium
+"""
+import io
+import os
+import random
+import argparse
+from typing import Dict, List
+from docx import Document
+
+# Words per document for each size label
+SIZES: Dict[str, int] = {
+    "small": 2_000,
+    "medium": 20_000,
+    "large": 100_000,
+}
+
+FILE_TYPES = ("pdf", "docx", "txt")
+
+VOCABULARY = (
+    "analysis annual approach assessment budget capacity committee compliance contract cost "
+    "customer data decision delivery department design development document efficiency energy "
+    "environment evaluation evidence framework funding governance growth health impact "
+    "implementation improvement income industry information infrastructure innovation investment "
+    "management market measure method model network objective operation outcome performance "
+    "planning policy population practice priority process product program project quality "
+    "recommendation regulation report requirement research resource response result revenue "
+    "review risk safety sector service strategy structure supply support system target "
+    "technology training transport value workforce the a of and to in for with on by from "
+    "is are was were will should could this that these those our their its which while"
+).split()
+
+PDF_LINES_PER_PAGE = 60
+PDF_LINE_CHARS = 95
+
+
+def generate_text(words: int, seed: int = 0) -> str:
+    """Generate deterministic prose of about the given number of words, in paragraphs"""
+    rng = random.Random(seed)
+    paragraphs = []
+    remaining = words
+    while remaining > 0:
+        sentences = []
+        for _ in range(rng.randint(3, 7)):
+            length = min(remaining, rng.randint(8, 24))
+            if length <= 0:
+                break
+            sentence = " ".join(rng.choice(VOCABULARY) for _ in range(length))
+            sentences.append(sentence[0].upper() + sentence[1:] + ".")
+            remaining -= length
+        paragraphs.append(" ".join(sentences))
+    return "\n\n".join(paragraphs)
+
+
+def make_txt(text: str) -> bytes:
+    return text.encode("utf-8")
+
+
+def make_docx(text: str) -> bytes:
+    document = Document()
+    for paragraph in text.split("\n\n"):
+        document.add_paragraph(paragraph)
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+def _wrap(text: str, width: int) -> List[str]:
+    lines = []
+    for paragraph in text.split("\n\n"):
+        line = ""
+        for word in paragraph.split():
+            if line and len(line) + 1 + len(word) > width:
+                lines.append(line)
+                line = word
+            else:
+                line = f"{line} {word}" if line else word
+        lines.append(line)
+        lines.append("")
+    return lines
+
+
+def make_pdf(text: str) -> bytes:
+    """Write a minimal PDF with the text wrapped onto Letter-size pages"""
+    lines = _wrap(text, PDF_LINE_CHARS)
+    pages = [lines[i:i + PDF_LINES_PER_PAGE] for i in range(0, len(lines), PDF_LINES_PER_PAGE)] or [[]]
+
+    # Objects 1-3 are the catalog, page tree and font; each page adds a page and a content object
+    objects = [None, None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for page in pages:
+        escaped = [line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") for line in page]
+        stream = "BT /F1 10 Tf 12 TL 50 760 Td " + " ".join(f"({line}) '" for line in escaped) + " ET"
+        stream = stream.encode("latin-1", errors="replace")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        page_ids.append(len(objects))
+    objects[0] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        output += b"%010d 00000 n \n" % offset
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(output)
+
+
+WRITERS = {"pdf": make_pdf, "docx": make_docx, "txt": make_txt}
+
+
+class SyntheticDocument:
+    """One generated file with the text it was generated from"""
+
+    def __init__(self, name: str, file_type: str, size: str, text: str, data: bytes):
+        self.name = name
+        self.file_type = file_type
+        self.size = size
+        self.text = text
+        self.data = data
+
+
+def generate_corpus(sizes: List[str] = None, file_types: List[str] = None, seed: int = 0) -> List[SyntheticDocument]:
+    """
+    Generate one document per size and file type.
+
+    Args:
+        sizes: Size labels from SIZES
+        file_types: Any of "pdf", "docx" and "txt"
+        seed: Seed of the text generator
+
+    Returns:
+        The generated documents
+    """
+    documents = []
+    for size in sizes or list(SIZES):
+        text = generate_text(SIZES[size], seed=seed * 1_000_003 + SIZES[size])
+        for file_type in file_types or FILE_TYPES:
+            documents.append(SyntheticDocument(
+                f"{size}.{file_type}", file_type, size, text, WRITERS[file_type](text)
+            ))
+    return documents
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic benchmark corpus")
+    parser.add_argument("--output", required=True, help="Directory to write the files to")
+    parser.add_argument("--sizes", default="small,medium", help=f"Comma-separated sizes: {', '.join(SIZES)}")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    for document in generate_corpus(args.sizes.split(","), seed=args.seed):
+        with open(os.path.join(args.output, document.name), "wb") as file:
+            file.write(document.data)
+        print(f"{document.name}: {len(document.data)} bytes")
+
+
+if __name__ == "__main__":
+    main()
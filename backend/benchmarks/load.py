@@ -0,0 +1,328 @@
+"""
+Concurrent load generator for the API.
+
+Drives a mix of uploads, searches, summaries and document listings with
+a fixed number of concurrent clients, and reports throughput, latency
+percentiles and error rates per endpoint.
+
+By default the app runs in process against scratch stores with the same
+offline stand-ins as the benchmarks; pass --url to load a running server.
+
+    cd backend
+    python -m benchmarks.load --concurrency 16 --duration 30
+    python -m benchmarks.load --url http://localhost:8000 --rate 50 --mix search=6,list=2,summary=1,upload=1
+
+Without --rate each client sends its next request as soon as the last one
+finished (closed loop). With --rate requests arrive at that average rate
+as a Poisson process, whether or not earlier ones have finished (open
+loop); latency is then measured from the arrival time, so time spent
+waiting for a free client counts.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import datetime
+import tempfile
+from typing import Dict, Any, List, Optional, Tuple
+
+from benchmarks.corpus import SIZES, FILE_TYPES, WRITERS, generate_text
+from benchmarks.stubs import offline_environment, install_stubs
+from benchmarks.suites import SEARCH_QUERIES
+
+DEFAULT_MIX = "search=5,list=2,summary=2,upload=1"
+PERCENTILES = (50, 95, 99)
+
+
+class LoadState:
+    """What the clients share: the HTTP client, upload files and known document ids"""
+
+    def __init__(self, client, uploads: List[Tuple[str, bytes]], rng: random.Random):
+        self.client = client
+        self.uploads = uploads
+        self.rng = rng
+        self.document_ids: List[str] = []
+        self._next_upload = 0
+
+    def next_upload(self) -> Tuple[str, bytes]:
+        upload = self.uploads[self._next_upload % len(self.uploads)]
+        self._next_upload += 1
+        return upload
+
+    def document_id(self) -> Optional[str]:
+        return self.rng.choice(self.document_ids) if self.document_ids else None
+
+
+async def upload(state: LoadState):
+    name, data = state.next_upload()
+    response = await state.client.post("/upload", files={"file": (name, data)}, data={"title": name})
+    if response.status_code == 200:
+        state.document_ids.append(response.json()["id"])
+    return response
+
+
+async def search(state: LoadState):
+    return await state.client.post("/search", json={"query": state.rng.choice(SEARCH_QUERIES), "limit": 5})
+
+
+async def summary(state: LoadState):
+    document_id = state.document_id()
+    if document_id is None:
+        return await list_documents(state)
+    return await state.client.get(f"/documents/{document_id}/summary", params={"engine": "extractive"})
+
+
+async def list_documents(state: LoadState):
+    return await state.client.get("/documents", params={"limit": 50})
+
+
+OPERATIONS = {
+    "upload": upload,
+    "search": search,
+    "summary": summary,
+    "list": list_documents,
+}
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    """Parse "search=5,list=2" into relative operation weights"""
+    weights = {}
+    for entry in mix.split(","):
+        name, _, weight = entry.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation: {name}")
+        weights[name] = float(weight or 1)
+    if not any(weights.values()):
+        raise ValueError("The mix needs at least one operation with a positive weight")
+    return weights
+
+
+def make_uploads(count: int, size: str, seed: int) -> List[Tuple[str, bytes]]:
+    """
+    Distinct files to upload, cycling through the file types. Every file
+    has different text so uploads are not deduplicated by the server.
+    """
+    uploads = []
+    for i in range(count):
+        file_type = FILE_TYPES[i % len(FILE_TYPES)]
+        text = generate_text(SIZES[size], seed=seed * 1_000_003 + i)
+        uploads.append((f"load-{seed}-{i}.{file_type}", WRITERS[file_type](text)))
+    return uploads
+
+
+class Recorder:
+    """Latency, status and error samples of each operation"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.statuses: Dict[str, Dict[str, int]] = {}
+        self.errors: Dict[str, int] = {}
+
+    def record(self, operation: str, seconds: float, status: str, failed: bool):
+        self.latencies.setdefault(operation, []).append(seconds)
+        statuses = self.statuses.setdefault(operation, {})
+        statuses[status] = statuses.get(status, 0) + 1
+        self.errors[operation] = self.errors.get(operation, 0) + failed
+
+    def report(self, elapsed: float) -> Dict[str, Dict[str, Any]]:
+        operations = {
+            name: _stats(latencies, self.errors[name], elapsed, self.statuses[name])
+            for name, latencies in sorted(self.latencies.items())
+        }
+        statuses: Dict[str, int] = {}
+        for counts in self.statuses.values():
+            for status, count in counts.items():
+                statuses[status] = statuses.get(status, 0) + count
+        everything = [seconds for latencies in self.latencies.values() for seconds in latencies]
+        if everything:
+            operations["total"] = _stats(everything, sum(self.errors.values()), elapsed, statuses)
+        return operations
+
+
+def _percentile(ordered: List[float], percent: float) -> float:
+    """Nearest-rank percentile of sorted samples"""
+    rank = max(1, -(-len(ordered) * percent // 100))
+    return ordered[int(rank) - 1]
+
+
+def _stats(latencies: List[float], errors: int, elapsed: float, statuses: Dict[str, int]) -> Dict[str, Any]:
+    ordered = sorted(latencies)
+    stats = {
+        "requests": len(ordered),
+        "errors": errors,
+        "error_rate": round(errors / len(ordered), 4),
+        "throughput_rps": round(len(ordered) / elapsed, 2),
+    }
+    for percent in PERCENTILES:
+        stats[f"p{percent}_ms"] = round(_percentile(ordered, percent) * 1000, 2)
+    stats["max_ms"] = round(ordered[-1] * 1000, 2)
+    stats["statuses"] = dict(sorted(statuses.items()))
+    return stats
+
+
+async def _send(state: LoadState, recorder: Recorder, operation: str, started_at: float):
+    try:
+        response = await OPERATIONS[operation](state)
+        status, failed = str(response.status_code), response.status_code >= 400
+    except Exception as e:
+        status, failed = type(e).__name__, True
+    recorder.record(operation, time.perf_counter() - started_at, status, failed)
+
+
+async def run_load(state: LoadState, weights: Dict[str, float], concurrency: int, duration: float = None,
+                   requests: int = None, rate: float = None) -> Tuple[Recorder, float]:
+    """
+    Send requests until duration seconds have passed or requests have been sent.
+
+    Args:
+        state: Shared client state
+        weights: Relative weight of each operation
+        concurrency: Requests in flight at most
+        duration: Seconds to run for
+        requests: Requests to send in total
+        rate: Average arrivals per second (open loop); None keeps every client busy (closed loop)
+
+    Returns:
+        The recorded samples and the elapsed seconds
+    """
+    recorder = Recorder()
+    names, relative = list(weights), list(weights.values())
+    started_at = time.perf_counter()
+    deadline = started_at + duration if duration else None
+    sent = 0
+
+    def next_operation() -> Optional[str]:
+        nonlocal sent
+        if (requests is not None and sent >= requests) or (deadline is not None and time.perf_counter() >= deadline):
+            return None
+        sent += 1
+        return state.rng.choices(names, weights=relative)[0]
+
+    if not rate:
+        async def client():
+            while (operation := next_operation()) is not None:
+                await _send(state, recorder, operation, time.perf_counter())
+
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+    else:
+        slots = asyncio.Semaphore(concurrency)
+        in_flight = set()
+        arrival = started_at
+
+        async def send_when_free(operation: str, arrived_at: float):
+            async with slots:
+                await _send(state, recorder, operation, arrived_at)
+
+        while (operation := next_operation()) is not None:
+            arrival += state.rng.expovariate(rate)
+            await asyncio.sleep(max(0.0, arrival - time.perf_counter()))
+            task = asyncio.create_task(send_when_free(operation, arrival))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+        await asyncio.gather(*in_flight)
+
+    return recorder, time.perf_counter() - started_at
+
+
+def print_report(results: Dict[str, Dict[str, Any]]):
+    header = f"{'operation':<10} {'requests':>9} {'errors':>7} {'rps':>8}" + "".join(
+        f" {f'p{percent} ms':>10}" for percent in PERCENTILES
+    ) + f" {'max ms':>10}"
+    print(header)
+    for name, stats in results.items():
+        print(
+            f"{name:<10} {stats['requests']:>9} {stats['error_rate']:>7.1%} {stats['throughput_rps']:>8.1f}"
+            + "".join(f" {stats[f'p{percent}_ms']:>10.1f}" for percent in PERCENTILES)
+            + f" {stats['max_ms']:>10.1f}"
+        )
+
+
+async def _run(options, weights: Dict[str, float]) -> Dict[str, Any]:
+    import httpx
+
+    if options.url:
+        transport, base_url = None, options.url.rstrip("/")
+    else:
+        import main as api
+        transport, base_url = httpx.ASGITransport(app=api.app), "http://load"
+
+    rng = random.Random(options.seed)
+    uploads = make_uploads(options.upload_files, options.upload_size, options.seed)
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=options.timeout) as client:
+        state = LoadState(client, uploads, rng)
+        # Summaries need documents to exist before the load starts
+        for _ in range(options.preload):
+            response = await upload(state)
+            response.raise_for_status()
+
+        recorder, elapsed = await run_load(
+            state, weights, options.concurrency, options.duration, options.requests, options.rate
+        )
+
+    if not options.url:
+        await api.llm_gateway.aclose()
+    return {"elapsed_seconds": round(elapsed, 3), "operations": recorder.report(elapsed)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive the API with concurrent requests")
+    parser.add_argument("--url", default=None, help="Server to load (default: the app in process, offline)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight at most")
+    parser.add_argument("--rate", type=float, default=None, help="Average arrivals per second (default: closed loop)")
+    parser.add_argument("--duration", type=float, default=None, help="Seconds to run for (default: 10)")
+    parser.add_argument("--requests", type=int, default=None, help="Requests to send in total")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Relative operation weights (default: {DEFAULT_MIX})")
+    parser.add_argument("--preload", type=int, default=3, help="Documents uploaded before the load starts")
+    parser.add_argument("--upload-size", default="small", choices=list(SIZES), help="Size of uploaded documents")
+    parser.add_argument("--upload-files", type=int, default=20, help="Distinct files uploads cycle through")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="JSON file to write the results to")
+    options = parser.parse_args()
+
+    try:
+        weights = parse_mix(options.mix)
+    except ValueError as e:
+        parser.error(str(e))
+    if options.duration is None and options.requests is None:
+        options.duration = 10.0
+
+    scratch = None
+    if not options.url:
+        # Must happen before any backend module reads config
+        scratch = tempfile.mkdtemp(prefix="load-")
+        os.environ.update(offline_environment(scratch))
+        install_stubs()
+    try:
+        results = asyncio.run(_run(options, weights))
+    finally:
+        if scratch:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    print_report(results["operations"])
+    if options.output:
+        report = {
+            "created_at": datetime.datetime.now().isoformat(),
+            "target": options.url or "in-process",
+            "options": {
+                "concurrency": options.concurrency, "rate": options.rate, "duration": options.duration,
+                "requests": options.requests, "mix": weights, "upload_size": options.upload_size,
+                "seed": options.seed
+            },
+            **results,
+        }
+        with open(options.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+
+    errors = results["operations"].get("total", {}).get("errors", 0)
+    if errors:
+        print(f"\n{errors} request(s) failed", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Run the offline benchmark suite and write the results as JSON.
+
+Everything runs in process against scratch stores: embeddings come from
+a deterministic stub, LLM calls from local_llm and document records from
+an in-memory store, so no network or credentials are needed.
+
+    cd backend
+    python -m benchmarks.run --sizes small,medium --output results.json
+    python -m benchmarks.run --compare results.json --threshold 0.15
+
+With --compare, medians are checked against a previous results file and
+the exit status is 1 if any benchmark got slower than the threshold.
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import platform
+import datetime
+import tempfile
+import subprocess
+from typing import Dict, Any, List
+
+from benchmarks.corpus import SIZES, generate_corpus
+from benchmarks.stubs import offline_environment, install_stubs
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], threshold: float,
+            min_delta_ms: float = 0.0) -> List[str]:
+    """
+    Print the change of each benchmark's median against a baseline.
+
+    Returns:
+        Names of the benchmarks slower than the baseline by more than
+        threshold and by more than min_delta_ms, which keeps timer noise on
+        sub-millisecond benchmarks from counting
+    """
+    regressions = []
+    print(f"\n{'benchmark':<40} {'baseline ms':>12} {'current ms':>12} {'change':>8}")
+    for name, stats in results.items():
+        if name not in baseline:
+            continue
+        before, after = baseline[name]["median_ms"], stats["median_ms"]
+        change = (after - before) / before if before else 0.0
+        flag = ""
+        if change > threshold and after - before > min_delta_ms:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<40} {before:>12.3f} {after:>12.3f} {change:>+8.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the offline benchmark suite")
+    parser.add_argument("--sizes", default="small,medium", help=f"Comma-separated corpus sizes: {', '.join(SIZES)}")
+    parser.add_argument("--suites", default=None, help="Comma-separated suites to run (default: all)")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per benchmark")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed runs before timing")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic corpus")
+    parser.add_argument("--output", default=None, help="JSON file to write the results to")
+    parser.add_argument("--compare", default=None, help="Previous results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Median slowdown counted as a regression")
+    parser.add_argument("--min-delta-ms", type=float, default=0.5, help="Smallest median slowdown that counts, in ms")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch directory")
+    options = parser.parse_args()
+
+    # Must happen before any backend module reads config
+    scratch = tempfile.mkdtemp(prefix="benchmarks-")
+    os.environ.update(offline_environment(scratch))
+    install_stubs()
+    from benchmarks.suites import SUITES
+
+    suites = options.suites.split(",") if options.suites else list(SUITES)
+    unknown = [suite for suite in suites if suite not in SUITES]
+    if unknown:
+        parser.error(f"Unknown suites: {', '.join(unknown)}")
+
+    corpus = generate_corpus(options.sizes.split(","), seed=options.seed)
+    results: Dict[str, Dict[str, Any]] = {}
+    try:
+        for suite in suites:
+            print(f"Running {suite}...", file=sys.stderr)
+            for name, stats in SUITES[suite](corpus, options).items():
+                results[name] = stats
+                print(f"  {name:<40} median {stats['median_ms']:>10.3f} ms  p95 {stats['p95_ms']:>10.3f} ms",
+                      file=sys.stderr)
+    finally:
+        if not options.keep:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    report = {
+        "created_at": datetime.datetime.now().isoformat(),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "options": {
+            "sizes": options.sizes, "suites": suites, "repeat": options.repeat,
+            "warmup": options.warmup, "seed": options.seed
+        },
+        "corpus": {document.name: len(document.data) for document in corpus},
+        "results": results,
+    }
+    if options.output:
+        with open(options.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+
+    if options.compare:
+        with open(options.compare, "r", encoding="utf-8") as file:
+            baseline = json.load(file)["results"]
+        regressions = compare(results, baseline, options.threshold, options.min_delta_ms)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) above {options.threshold:.0%}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
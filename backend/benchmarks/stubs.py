@@ -0,0 +1,160 @@
+"""
+Offline stand-ins used by the benchmarks: a deterministic embedder, an
+in-memory document store and the environment that points every on-disk
+store at a scratch directory and the LLM at local_llm.
+"""
+import os
+import hashlib
+import datetime
+from typing import Dict, Any, List, Optional, Iterator, BinaryIO
+import numpy as np
+
+EMBEDDING_DIMENSIONS = 384
+
+
+class StubEmbedder:
+    """
+    Deterministic replacement for SentenceTransformer: each token is hashed
+    into one of the dimensions with a sign, and the vector is normalized.
+    Texts sharing words get similar vectors, so search results are
+    meaningful, and encoding costs only tokenization.
+    """
+
+    def __init__(self, model_name: str = "stub", *args, **kwargs):
+        self.model_name = model_name
+
+    def encode(self, sentences, batch_size: int = 32, **kwargs) -> np.ndarray:
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        vectors = np.zeros((len(texts), EMBEDDING_DIMENSIONS), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in text.lower().split():
+                digest = hashlib.blake2b(token.encode("utf-8"), digest_size=4).digest()
+                value = int.from_bytes(digest, "little")
+                vectors[row, value % EMBEDDING_DIMENSIONS] += 1.0 if value & 0x80000000 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.where(norms == 0, 1.0, norms)
+        return vectors[0] if single else vectors
+
+
+def offline_environment(directory: str) -> Dict[str, str]:
+    """
+    Environment variables keeping every store under a scratch directory,
+    answering LLM calls locally and disabling the periodic jobs. They must
+    be set before config is first imported.
+    """
+    def path(name: str) -> str:
+        return os.path.join(directory, name)
+
+    return {
+        "LLM_PROVIDER": "local",
+        "NARRATION_ENGINE": "local",
+        "BLOB_STORE": "local",
+        "BLOB_DIRECTORY": path("blobs"),
+        "CHROMA_PERSIST_DIRECTORY": path("chroma"),
+        "INDEX_VERSIONS_PATH": path("chroma/index_versions.json"),
+        "TOMBSTONE_PATH": path("chroma/tombstones.sqlite3"),
+        "SNAPSHOT_DIRECTORY": path("chroma/snapshots"),
+        "CONTENT_STORE_DIRECTORY": path("content_store"),
+        "LLM_CACHE_PATH": path("cache/llm_cache.sqlite3"),
+        "SUMMARY_TREE_DIRECTORY": path("cache/summary_trees"),
+        "INSIGHTS_IDF_PATH": path("cache/corpus_idf.sqlite3"),
+        "NARRATION_CACHE_DIRECTORY": path("cache/narration"),
+        "STATS_RECONCILE_INTERVAL": "0",
+        "COMPACTION_INTERVAL": "0",
+    }
+
+
+def make_memory_document_store(base):
+    """
+    Build an in-memory DocumentStore subclass of base (the real class) that
+    keeps document records in a dict and files in a blob store, so the API
+    runs without Firebase.
+    """
+
+    class MemoryDocumentStore(base):
+        def __init__(self, use_mock: bool = False, blob_store=None):
+            from blob_store import LocalBlobStore
+            super().__init__(use_mock=True)
+            self.use_mock = False
+            self.blob_store = blob_store or LocalBlobStore()
+            self.documents: Dict[str, Dict[str, Any]] = {}
+
+        async def store_document(self, file_path: Optional[str], metadata: Dict[str, Any], user_id: str,
+                                 file_obj: Optional[BinaryIO] = None, source: Dict[str, Any] = None) -> Dict[str, Any]:
+            document_id = hashlib.sha1(os.urandom(16)).hexdigest()
+            blob_path = f"documents/{document_id}/{metadata['filename']}"
+            stored = await self.blob_store.put(blob_path, file_obj, metadata.get("file_size", 0))
+            record = {
+                "id": document_id,
+                "title": metadata.get("title", "Untitled"),
+                "fileUrl": stored["url"],
+                "fileType": metadata.get("file_type", "unknown"),
+                "fileName": metadata.get("filename", ""),
+                "fileSize": metadata.get("file_size", 0),
+                "chunkCount": metadata.get("chunk_count", 0),
+                "indexVersion": metadata.get("index_version"),
+                "blobPath": blob_path,
+                "contentHash": metadata.get("content_hash"),
+                "uploadedBy": user_id,
+                "uploadedAt": datetime.datetime.now(),
+                "metadata": metadata,
+                "tags": []
+            }
+            self.documents[document_id] = record
+            return dict(record)
+
+        def get_documents(self, user_id: str = None, limit: int = 50, cursor: str = None) -> List[Dict[str, Any]]:
+            documents = sorted(self.documents.values(), key=lambda d: (d["uploadedAt"], d["id"]), reverse=True)
+            if user_id:
+                documents = [d for d in documents if d["uploadedBy"] == user_id]
+            return [dict(d) for d in documents[:limit]]
+
+        def iter_documents(self, user_id: str = None, page_size: int = 500) -> Iterator[Dict[str, Any]]:
+            yield from self.get_documents(user_id, limit=len(self.documents))
+
+        def get_document(self, document_id: str) -> Optional[Dict[str, Any]]:
+            document = self.documents.get(document_id)
+            return dict(document) if document else None
+
+        async def delete_document(self, document_id: str, document: Dict[str, Any] = None) -> bool:
+            record = self.documents.pop(document_id, None)
+            if record is None:
+                return False
+            await self.blob_store.delete(record["blobPath"])
+            return True
+
+        def find_by_fingerprint(self, fingerprint: str) -> Optional[Dict[str, Any]]:
+            return None
+
+        def update_document_tags(self, document_id: str, tags: List[str]):
+            self.documents[document_id]["tags"] = tags
+
+        def update_document_insights(self, document_id: str, insights: Dict[str, Any]):
+            if document_id in self.documents:
+                self.documents[document_id]["insights"] = insights
+
+        def storage_stats(self) -> Dict[str, Any]:
+            return {"blobs": self.blob_store.stats(), "metadata": {}}
+
+    return MemoryDocumentStore
+
+
+def install_stubs():
+    """
+    Swap the embedding model, Firebase document store and stats store for
+    the offline stand-ins. Call after setting offline_environment and
+    before importing main.
+    """
+    import vector_store
+    import document_store
+    import stats_store
+
+    vector_store.SentenceTransformer = StubEmbedder
+    document_store.DocumentStore = make_memory_document_store(document_store.DocumentStore)
+
+    class MemoryStatsStore(stats_store.StatsStore):
+        def __init__(self, use_mock: bool = False):
+            super().__init__(use_mock=True)
+
+    stats_store.StatsStore = MemoryStatsStore
@@ -0,0 +1,195 @@
+"""
+Benchmark suites. Each suite takes the corpus and the run options and
+returns {benchmark name: timing stats}. Backend modules are imported
+inside the suites, after run.py has set up the offline environment.
+"""
+import io
+import time
+import asyncio
+import statistics
+from typing import Dict, Any, List, Callable, Awaitable
+
+SEARCH_QUERIES = [
+    "budget risk assessment",
+    "infrastructure investment strategy",
+    "customer service quality improvement",
+    "regulation compliance review",
+    "energy efficiency program outcome",
+]
+
+QUESTIONS = [
+    "What are the main risks?",
+    "What does the report recommend for infrastructure?",
+]
+
+
+def summarize(samples: List[float]) -> Dict[str, Any]:
+    """Timing statistics of a list of durations in seconds, in milliseconds"""
+    ordered = sorted(samples)
+    return {
+        "runs": len(samples),
+        "min_ms": round(ordered[0] * 1000, 3),
+        "median_ms": round(statistics.median(ordered) * 1000, 3),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+def measure(func: Callable[[], Any], repeat: int, warmup: int) -> Dict[str, Any]:
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started_at)
+    return summarize(samples)
+
+
+async def ameasure(func: Callable[[], Awaitable[Any]], repeat: int, warmup: int) -> Dict[str, Any]:
+    for _ in range(warmup):
+        await func()
+    samples = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        await func()
+        samples.append(time.perf_counter() - started_at)
+    return summarize(samples)
+
+
+def extraction(corpus, options) -> Dict[str, Dict[str, Any]]:
+    """Parse each file type once into text, chunks and spans"""
+    from document_processor import DocumentProcessor
+
+    processor = DocumentProcessor()
+    return {
+        f"extract.{document.file_type}.{document.size}": measure(
+            lambda document=document: processor.process_stream(
+                io.BytesIO(document.data), document.file_type, len(document.data)
+            ),
+            options.repeat, options.warmup
+        )
+        for document in corpus
+    }
+
+
+def chunking(corpus, options) -> Dict[str, Dict[str, Any]]:
+    """Split extracted text into overlapping chunks"""
+    from document_processor import DocumentProcessor
+
+    processor = DocumentProcessor()
+    texts = {document.size: document.text for document in corpus}
+    return {
+        f"chunk.{size}": measure(lambda text=text: processor._create_chunks(text), options.repeat, options.warmup)
+        for size, text in texts.items()
+    }
+
+
+def vector_store(corpus, options) -> Dict[str, Dict[str, Any]]:
+    """Index chunks and run filtered and unfiltered searches with the stub embedder"""
+    from document_processor import DocumentProcessor
+    from vector_store import VectorStore
+
+    processor = DocumentProcessor()
+    store = VectorStore(collection_name="benchmark")
+    results = {}
+    texts = {document.size: document.text for document in corpus}
+    counter = iter(range(1_000_000))
+
+    for size, text in texts.items():
+        chunks = processor._create_chunks(text)
+        results[f"vector.add.{size}"] = measure(
+            lambda chunks=chunks, size=size: store.add_document(
+                f"{size}-{next(counter)}", chunks, {"title": size, "file_type": "txt", "uploaded_by": "bench"}
+            ),
+            options.repeat, options.warmup
+        )
+
+    queries = iter(SEARCH_QUERIES * (options.repeat + options.warmup))
+    results["vector.search"] = measure(lambda: store.search(next(queries), limit=5), options.repeat, options.warmup)
+    queries = iter(SEARCH_QUERIES * (options.repeat + options.warmup))
+    results["vector.search.filtered"] = measure(
+        lambda: store.search(next(queries), limit=5, filters={"file_type": "txt", "uploaded_by": "bench"}),
+        options.repeat, options.warmup
+    )
+    return results
+
+
+def split_text(corpus, options) -> Dict[str, Dict[str, Any]]:
+    """Token-aware splitting of whole documents for map-reduce summaries"""
+    from llm_cache import LLMCache
+    from llm_gateway import LLMGateway
+    from summarizer import DocumentSummarizer
+
+    summarizer = DocumentSummarizer(cache=LLMCache(), gateway=LLMGateway(local=True))
+    texts = {document.size: document.text for document in corpus}
+    return {
+        f"split_text.{size}": measure(lambda text=text: summarizer._split_text(text), options.repeat, options.warmup)
+        for size, text in texts.items()
+    }
+
+
+def api(corpus, options) -> Dict[str, Dict[str, Any]]:
+    """Main endpoints through an in-process ASGI client (uploads include their background tasks)"""
+    return asyncio.run(_api(corpus, options))
+
+
+async def _api(corpus, options) -> Dict[str, Dict[str, Any]]:
+    import httpx
+    import main
+
+    results = {}
+    uploaded: List[str] = []
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+
+        async def upload(document):
+            response = await client.post(
+                "/upload",
+                files={"file": (document.name, document.data)},
+                data={"title": document.name}
+            )
+            response.raise_for_status()
+            uploaded.append(response.json()["id"])
+
+        for document in corpus:
+            results[f"api.upload.{document.file_type}.{document.size}"] = await ameasure(
+                lambda document=document: upload(document), options.repeat, options.warmup
+            )
+
+        async def get(url: str, **params):
+            response = await client.get(url, params=params)
+            response.raise_for_status()
+
+        async def post(url: str, body: Dict[str, Any]):
+            response = await client.post(url, json=body)
+            response.raise_for_status()
+
+        document_id = uploaded[0]
+        queries = iter(SEARCH_QUERIES * (options.repeat + options.warmup))
+        questions = iter(QUESTIONS * (options.repeat + options.warmup))
+        results["api.documents.list"] = await ameasure(lambda: get("/documents", limit=50), options.repeat, options.warmup)
+        results["api.search"] = await ameasure(
+            lambda: post("/search", {"query": next(queries), "limit": 5}), options.repeat, options.warmup
+        )
+        results["api.summary.extractive"] = await ameasure(
+            lambda: get(f"/documents/{document_id}/summary", engine="extractive"), options.repeat, options.warmup
+        )
+        results["api.ask"] = await ameasure(
+            lambda: post(f"/documents/{document_id}/ask", {"question": next(questions)}), options.repeat, options.warmup
+        )
+        results["api.insights"] = await ameasure(
+            lambda: get(f"/documents/{document_id}/insights"), options.repeat, options.warmup
+        )
+    await main.llm_gateway.aclose()
+    return results
+
+
+SUITES = {
+    "extraction": extraction,
+    "chunking": chunking,
+    "vector_store": vector_store,
+    "split_text": split_text,
+    "api": api,
+}
@@ -0,0 +1,300 @@
+import os
+import time
+import shutil
+import asyncio
+import hashlib
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Dict, Any, BinaryIO, Optional
+from config import settings
+from instrumentation import stage
+
+COPY_CHUNK_BYTES = 1024 * 1024
+# Google Cloud Storage composes at most 32 objects at once
+MAX_COMPOSE_PARTS = 32
+
+
+class StorageMetrics:
+    """Count, errors, bytes and latency of each kind of storage operation"""
+
+    def __init__(self):
+        self._operations: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def measure(self, operation: str, size: int = 0):
+        started_at = time.perf_counter()
+        failed = False
+        try:
+            with stage(f"storage.{operation}"):
+                yield
+        except Exception:
+            failed = True
+            raise
+        finally:
+            seconds = time.perf_counter() - started_at
+            with self._lock:
+                entry = self._operations.setdefault(
+                    operation, {"count": 0, "errors": 0, "bytes": 0, "seconds": 0.0, "max_seconds": 0.0}
+                )
+                entry["count"] += 1
+                entry["errors"] += failed
+                entry["bytes"] += size
+                entry["seconds"] += seconds
+                entry["max_seconds"] = max(entry["max_seconds"], seconds)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                operation: {
+                    "count": entry["count"],
+                    "errors": entry["errors"],
+                    "bytes": entry["bytes"],
+                    "avg_ms": round(entry["seconds"] / entry["count"] * 1000, 2),
+                    "max_ms": round(entry["max_seconds"] * 1000, 2)
+                }
+                for operation, entry in self._operations.items()
+            }
+
+
+class BlobStore(ABC):
+    """
+    Where uploaded files are kept. Keys are paths such as
+    "documents/<id>/<filename>"; every method is async and runs the
+    blocking I/O in worker threads, at most max_concurrency at a time.
+    """
+
+    name = "base"
+
+    def __init__(self, max_concurrency: int = None, metrics: StorageMetrics = None):
+        self.max_concurrency = max_concurrency or settings.BLOB_MAX_CONCURRENCY
+        self.metrics = metrics or StorageMetrics()
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def _run(self, func, *args):
+        async with self._semaphore:
+            return await asyncio.to_thread(func, *args)
+
+    @abstractmethod
+    async def put(self, key: str, file_obj: BinaryIO, size: int, content_type: str = None) -> Dict[str, Any]:
+        """
+        Store a file under a key.
+
+        Args:
+            key: Path of the blob
+            file_obj: Seekable file object with the content, read from the start
+            size: Size of the content in bytes
+            content_type: MIME type served with the file
+
+        Returns:
+            Dict with the blob "path", its public "url" and whether it was "deduplicated"
+        """
+
+    @abstractmethod
+    async def delete(self, key: str):
+        """Delete a blob; missing blobs are ignored"""
+
+    def stats(self) -> Dict[str, Any]:
+        return {"store": self.name, "max_concurrency": self.max_concurrency, "operations": self.metrics.to_dict()}
+
+
+class LocalBlobStore(BlobStore):
+    """
+    Content-addressed blob store on the local filesystem.
+
+    Content is written once to objects/<aa>/<bb>/<sha256>, sharded by hash
+    prefix so no directory grows too large. Each key is a hard link to its
+    object, so identical uploads share one copy on disk; an object is
+    removed when its last key is deleted. Files are served by the API
+    under public_url.
+    """
+
+    name = "local"
+
+    def __init__(self, directory: str = None, public_url: str = None, **kwargs):
+        """
+        Args:
+            directory: Root directory of the store
+            public_url: URL prefix the keys are served under
+        """
+        super().__init__(**kwargs)
+        self.directory = os.path.abspath(directory or settings.BLOB_DIRECTORY)
+        self.public_url = (public_url or settings.BLOB_PUBLIC_URL).rstrip("/")
+        self.objects_directory = os.path.join(self.directory, "objects")
+        self.keys_directory = os.path.join(self.directory, "keys")
+        os.makedirs(self.objects_directory, exist_ok=True)
+        os.makedirs(self.keys_directory, exist_ok=True)
+        # Guards linking a key to an existing object against removing that object
+        self._lock = threading.Lock()
+
+    def _object_path(self, sha256: str) -> str:
+        return os.path.join(self.objects_directory, sha256[:2], sha256[2:4], sha256)
+
+    def key_path(self, key: str) -> Optional[str]:
+        """Get the file of a key, or None if the key points outside the store"""
+        path = os.path.abspath(os.path.join(self.keys_directory, key))
+        if not path.startswith(self.keys_directory + os.sep):
+            return None
+        return path
+
+    async def put(self, key: str, file_obj: BinaryIO, size: int, content_type: str = None) -> Dict[str, Any]:
+        with self.metrics.measure("put", size):
+            return await self._run(self._put, key, file_obj)
+
+    def _put(self, key: str, file_obj: BinaryIO) -> Dict[str, Any]:
+        target = self.key_path(key)
+        if target is None:
+            raise ValueError(f"Invalid blob key: {key}")
+
+        # Hash while copying into a temp file next to the objects
+        digest = hashlib.sha256()
+        file_obj.seek(0)
+        with tempfile.NamedTemporaryFile(dir=self.objects_directory, suffix=".tmp", delete=False) as temp:
+            while True:
+                chunk = file_obj.read(COPY_CHUNK_BYTES)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                temp.write(chunk)
+            temp_path = temp.name
+        object_path = self._object_path(digest.hexdigest())
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+
+        with self._lock:
+            deduplicated = os.path.exists(object_path)
+            if deduplicated:
+                os.remove(temp_path)
+            else:
+                os.replace(temp_path, object_path)
+            # Replacing a key drops its old object if nothing else links to it
+            if os.path.exists(target) and not os.path.samefile(target, object_path):
+                self._unlink(target, keep=object_path)
+            if not os.path.exists(target):
+                try:
+                    os.link(object_path, target)
+                except OSError:
+                    # No hard links on this filesystem
+                    shutil.copyfile(object_path, target)
+        return {"path": key, "url": f"{self.public_url}/{key}", "deduplicated": deduplicated}
+
+    async def delete(self, key: str):
+        with self.metrics.measure("delete"):
+            await self._run(self._delete, key)
+
+    def _delete(self, key: str):
+        target = self.key_path(key)
+        if target is None:
+            return
+        with self._lock:
+            self._unlink(target)
+
+    def _unlink(self, target: str, keep: str = None):
+        """
+        Remove a key's file, and its object once no other key uses it.
+        Called under the lock; the object at keep is never removed.
+        """
+        try:
+            sha256 = self._hash_of(target)
+            os.remove(target)
+        except FileNotFoundError:
+            return
+        # The object's own entry is the last link once no key uses it
+        object_path = self._object_path(sha256)
+        if object_path == keep:
+            return
+        try:
+            if os.stat(object_path).st_nlink <= 1:
+                os.remove(object_path)
+        except FileNotFoundError:
+            pass
+
+    def _hash_of(self, path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(COPY_CHUNK_BYTES), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+
+class FirebaseBlobStore(BlobStore):
+    """
+    Blob store on the Firebase Storage bucket.
+
+    Files larger than multipart_threshold are uploaded as parts in
+    parallel, which the bucket then composes into the final object.
+    """
+
+    name = "firebase"
+
+    def __init__(self, bucket, part_size: int = None, multipart_threshold: int = None, **kwargs):
+        """
+        Args:
+            bucket: Google Cloud Storage bucket
+            part_size: Bytes per part of a multipart upload
+            multipart_threshold: Files larger than this are uploaded in parts
+        """
+        super().__init__(**kwargs)
+        self.bucket = bucket
+        self.part_size = part_size or settings.BLOB_PART_SIZE
+        self.multipart_threshold = multipart_threshold or settings.BLOB_MULTIPART_THRESHOLD
+
+    async def put(self, key: str, file_obj: BinaryIO, size: int, content_type: str = None) -> Dict[str, Any]:
+        with self.metrics.measure("put", size):
+            blob = self.bucket.blob(key)
+            if size <= self.multipart_threshold:
+                await self._run(self._upload, blob, file_obj, size, content_type)
+            else:
+                await self._upload_parts(blob, file_obj, size, content_type)
+            await self._run(blob.make_public)
+        return {"path": key, "url": blob.public_url, "deduplicated": False}
+
+    @staticmethod
+    def _upload(blob, file_obj: BinaryIO, size: int, content_type: Optional[str]):
+        blob.upload_from_file(file_obj, rewind=True, size=size, content_type=content_type)
+
+    async def _upload_parts(self, blob, file_obj: BinaryIO, size: int, content_type: Optional[str]):
+        part_size = max(self.part_size, -(-size // MAX_COMPOSE_PARTS))
+        offsets = range(0, size, part_size)
+        parts = [self.bucket.blob(f"{blob.name}.part{i}") for i in range(len(offsets))]
+        read_lock = threading.Lock()
+
+        def upload_part(part, offset: int):
+            # Parts are read from the shared file one at a time, then uploaded concurrently
+            with read_lock:
+                file_obj.seek(offset)
+                data = file_obj.read(part_size)
+            with self.metrics.measure("put_part", len(data)):
+                part.upload_from_string(data, content_type=content_type)
+
+        try:
+            await asyncio.gather(*(self._run(upload_part, part, offset) for part, offset in zip(parts, offsets)))
+            blob.content_type = content_type
+            with self.metrics.measure("compose"):
+                await self._run(blob.compose, parts)
+        finally:
+            await asyncio.gather(*(self._run(self._delete, part) for part in parts), return_exceptions=True)
+
+    async def delete(self, key: str):
+        with self.metrics.measure("delete"):
+            await self._run(self._delete, self.bucket.blob(key))
+
+    @staticmethod
+    def _delete(blob):
+        try:
+            blob.delete()
+        except Exception as e:
+            if getattr(e, "code", None) != 404:
+                raise
+
+
+def create_blob_store(name: str = None, bucket=None, metrics: StorageMetrics = None) -> BlobStore:
+    """Create the blob store configured by BLOB_STORE"""
+    name = name or settings.BLOB_STORE
+    if name == "local":
+        return LocalBlobStore(metrics=metrics)
+    if name == "firebase":
+        return FirebaseBlobStore(bucket, metrics=metrics)
+    raise ValueError(f"Unknown blob store: {name}")
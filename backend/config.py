@@ -1,4 +1,5 @@
 import os
+import json
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -16,6 +17,25 @@ class Settings:
     # OpenAI
     OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY")
     
+    # Base URL of an OpenAI-compatible API, e.g. the fake server in local_llm.py
+    OPENAI_API_BASE: str = os.getenv("OPENAI_API_BASE")
+    
+    # LLM provider: "openai", or "local" for the offline stand-in in local_llm.py
+    LLM_PROVIDER: str = os.getenv("LLM_PROVIDER", "openai")
+    
+    # LLM gateway (llm_gateway.py)
+    LLM_COMPLETION_MODEL: str = os.getenv("LLM_COMPLETION_MODEL", "gpt-3.5-turbo")
+    LLM_IMAGE_MODEL: str = os.getenv("LLM_IMAGE_MODEL", "dall-e-2")
+    LLM_MAX_CONNECTIONS: int = int(os.getenv("LLM_MAX_CONNECTIONS", 20))  # pooled HTTP connections
+    LLM_REQUEST_TIMEOUT: float = float(os.getenv("LLM_REQUEST_TIMEOUT", 60.0))  # seconds
+    LLM_MAX_CONCURRENCY: int = int(os.getenv("LLM_MAX_CONCURRENCY", 8))  # calls in flight per model
+    # Per-model overrides, e.g. {"gpt-4": {"max_concurrency": 2, "tokens_per_minute": 40000}}
+    LLM_MODEL_LIMITS: dict = json.loads(os.getenv("LLM_MODEL_LIMITS", "{}"))
+    
+    # LLM response cache
+    LLM_CACHE_PATH: str = os.getenv("LLM_CACHE_PATH", "cache/llm_cache.sqlite3")
+    LLM_CACHE_MAX_BYTES: int = int(os.getenv("LLM_CACHE_MAX_BYTES", 256 * 1024 * 1024))  # 256MB
+    
     # Firebase
     FIREBASE_PROJECT_ID: str = os.getenv("FIREBASE_PROJECT_ID")
     FIREBASE_PRIVATE_KEY: str = os.getenv("FIREBASE_PRIVATE_KEY")
@@ -24,10 +44,95 @@ class Settings:
     # Vector Database
     CHROMA_PERSIST_DIRECTORY: str = os.getenv("CHROMA_PERSIST_DIRECTORY", "chroma_db")
     
+    # Index versions and background re-indexing (index_versions.py)
+    INDEX_VERSIONS_PATH: str = os.getenv("INDEX_VERSIONS_PATH", "chroma_db/index_versions.json")
+    REINDEX_CPU_SHARE: float = float(os.getenv("REINDEX_CPU_SHARE", 0.5))  # fraction of wall time spent embedding
+    REINDEX_BATCH_SIZE: int = int(os.getenv("REINDEX_BATCH_SIZE", 32))  # chunks embedded per batch
+    REINDEX_CHECKPOINT_INTERVAL: int = 20  # documents indexed between checkpoints
+    
+    # Deletes: tombstoned at once, chunks removed by background compaction
+    TOMBSTONE_PATH: str = os.getenv("TOMBSTONE_PATH", "chroma_db/tombstones.sqlite3")
+    TOMBSTONE_MAX_OVERFETCH: int = 100  # extra search hits fetched to replace tombstoned ones
+    COMPACTION_INTERVAL: int = int(os.getenv("COMPACTION_INTERVAL", 30))  # seconds, 0 disables
+    COMPACTION_BATCH_SIZE: int = int(os.getenv("COMPACTION_BATCH_SIZE", 200))  # documents per batch
+    BULK_DELETE_MAX: int = 500  # documents per bulk delete request
+    
+    # Uploaded files (blob_store.py): "firebase" or "local"
+    BLOB_STORE: str = os.getenv("BLOB_STORE", "firebase")
+    BLOB_DIRECTORY: str = os.getenv("BLOB_DIRECTORY", "blobs")  # local store root
+    BLOB_PUBLIC_URL: str = os.getenv("BLOB_PUBLIC_URL", "http://localhost:8000/blobs")  # local store URL prefix
+    BLOB_MAX_CONCURRENCY: int = int(os.getenv("BLOB_MAX_CONCURRENCY", 8))  # transfers in flight
+    BLOB_PART_SIZE: int = 4 * 1024 * 1024  # bytes per part of a multipart upload
+    BLOB_MULTIPART_THRESHOLD: int = 8 * 1024 * 1024  # larger files are uploaded in parallel parts
+    
+    # Memory-mapped snapshots of the active index version (index_snapshot.py),
+    # searched instead of Chroma so a restarted server serves in seconds
+    SNAPSHOT_ENABLED: bool = os.getenv("SNAPSHOT_ENABLED", "true").lower() == "true"
+    SNAPSHOT_DIRECTORY: str = os.getenv("SNAPSHOT_DIRECTORY", "chroma_db/snapshots")
+    SNAPSHOT_LOG_MAX_BYTES: int = int(os.getenv("SNAPSHOT_LOG_MAX_BYTES", 64 * 1024 * 1024))  # merged into a new snapshot beyond this
+    SNAPSHOT_VERIFY: bool = os.getenv("SNAPSHOT_VERIFY", "true").lower() == "true"  # checksum in the background at startup
+    # Snapshots are sharded by tenant (uploader); larger tenants are split by document hash
+    SHARD_MAX_CHUNKS: int = int(os.getenv("SHARD_MAX_CHUNKS", 50000))  # chunks per shard before a tenant is split
+    SHARD_SEARCH_THREADS: int = int(os.getenv("SHARD_SEARCH_THREADS", min(8, os.cpu_count() or 1)))  # fan-out threads per process
+    SHARD_MIN_SEARCH_CHUNKS: int = 20000  # smaller ranges are searched on one thread
+    
+    # Preforked serving (serve.py): workers search a memory-mapped copy of the
+    # index that a single writer process republishes after changes
+    VECTOR_STORE_MODE: str = os.getenv("VECTOR_STORE_MODE", "local")  # "shared" in serve.py workers
+    SHARED_INDEX_DIRECTORY: str = os.getenv("SHARED_INDEX_DIRECTORY", "shared_index")
+    SHARED_INDEX_WRITER_ADDRESS: str = os.getenv("SHARED_INDEX_WRITER_ADDRESS", "shared_index/writer.sock")
+    SHARED_INDEX_PUBLISH_DELAY: float = float(os.getenv("SHARED_INDEX_PUBLISH_DELAY", 0.5))  # seconds to batch changes
+    SHARED_INDEX_REFRESH_INTERVAL: float = 1.0  # seconds between workers' checks for a new generation
+    SHARED_INDEX_KEEP_GENERATIONS: int = 2
+    
+    # Per-stage latency histograms on /metrics and Server-Timing headers (instrumentation.py)
+    METRICS_ENABLED: bool = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    
+    # Upload deduplication: also match re-uploads whose extracted text is the
+    # same up to case and whitespace (costs an extraction before the lookup)
+    DEDUP_TEXT_FINGERPRINT: bool = os.getenv("DEDUP_TEXT_FINGERPRINT", "false").lower() == "true"
+    
+    # Extracted document text (content_store.py)
+    CONTENT_STORE_DIRECTORY: str = os.getenv("CONTENT_STORE_DIRECTORY", "content_store")
+    CONTENT_BLOCK_SIZE: int = 64 * 1024  # uncompressed bytes per compressed block
+    CONTENT_COMPRESSION: str = os.getenv("CONTENT_COMPRESSION", "zstd")  # falls back to zlib without zstandard
+    
     # Document Processing
     MAX_FILE_SIZE: int = 10 * 1024 * 1024  # 10MB
     ALLOWED_FILE_TYPES: list = ["pdf", "docx", "txt"]
     
+    # Summarization
+    SUMMARY_CHUNK_TOKENS: int = int(os.getenv("SUMMARY_CHUNK_TOKENS", 12000))  # map chunk size for the 16k-context model
+    SUMMARY_CONTEXT_TOKENS: int = int(os.getenv("SUMMARY_CONTEXT_TOKENS", 12000))  # max prompt size of a combine call
+    LLM_TOKENS_PER_MINUTE: int = int(os.getenv("LLM_TOKENS_PER_MINUTE", 160000))  # per model, 0 disables rate limiting
+    LLM_MAX_RETRIES: int = int(os.getenv("LLM_MAX_RETRIES", 5))
+    LLM_RETRY_BASE_DELAY: float = float(os.getenv("LLM_RETRY_BASE_DELAY", 1.0))  # seconds
+    
+    SUMMARY_PRESHRINK_TOKENS: int = int(os.getenv("SUMMARY_PRESHRINK_TOKENS", 60000))  # extractive cut before the LLM, 0 disables
+    SUMMARY_TREE_DIRECTORY: str = os.getenv("SUMMARY_TREE_DIRECTORY", "cache/summary_trees")
+    SUMMARY_SECTION_SIZE: int = 8  # chunk summaries combined into one section summary
+    
+    # Question answering
+    QA_TOP_K: int = int(os.getenv("QA_TOP_K", 8))  # chunks retrieved per question
+    QA_CONTEXT_TOKENS: int = int(os.getenv("QA_CONTEXT_TOKENS", 3000))  # token budget of the packed context
+    
+    # Document insights
+    INSIGHTS_IDF_PATH: str = os.getenv("INSIGHTS_IDF_PATH", "cache/corpus_idf.sqlite3")
+    INSIGHTS_KEYWORD_COUNT: int = 10
+    INSIGHTS_TOPIC_COUNT: int = 4  # maximum k-means clusters over a document's chunks
+    
+    # Voice narration
+    NARRATION_ENGINE: str = os.getenv("NARRATION_ENGINE", "gtts")  # "gtts", or "local" for offline silent audio
+    NARRATION_LANGUAGE: str = os.getenv("NARRATION_LANGUAGE", "en")
+    NARRATION_CACHE_DIRECTORY: str = os.getenv("NARRATION_CACHE_DIRECTORY", "cache/narration")
+    NARRATION_CACHE_MAX_BYTES: int = int(os.getenv("NARRATION_CACHE_MAX_BYTES", 512 * 1024 * 1024))  # 512MB
+    NARRATION_SEGMENT_TOKENS: int = 200  # sentence-aligned segment size
+    NARRATION_MAX_CONCURRENCY: int = int(os.getenv("NARRATION_MAX_CONCURRENCY", 4))  # segments synthesized ahead
+    
+    # Statistics
+    STATS_RECONCILE_INTERVAL: int = int(os.getenv("STATS_RECONCILE_INTERVAL", 6 * 60 * 60))  # seconds, 0 disables
+    STATS_RECONCILE_PAGE_SIZE: int = 500
+    
     # CORS
     BACKEND_CORS_ORIGINS: list = [
         "http://localhost:3000",  # React development server
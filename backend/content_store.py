@@ -0,0 +1,286 @@
+import os
+import json
+import mmap
+import zlib
+import shutil
+import struct
+import uuid
+import tempfile
+from typing import Dict, Any, List, Optional
+from config import settings
+
+try:
+    import zstandard
+except ImportError:  # Fall back to zlib without the zstd bindings
+    zstandard = None
+
+MAGIC = b"DCS1"
+# magic, codec, block size, text bytes, block count, span table bytes
+HEADER = struct.Struct("<4sBIQII")
+# offset and compressed length of one block
+INDEX_ENTRY = struct.Struct("<QI")
+
+CODEC_ZLIB = 0
+CODEC_ZSTD = 1
+
+
+def _compress(codec: int, data: bytes) -> bytes:
+    if codec == CODEC_ZSTD:
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return zlib.compress(data, 6)
+
+
+def _decompress(codec: int, data: bytes) -> bytes:
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise Exception("Content was compressed with zstd but zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def _byte_offsets(text: str, offsets: List[int]) -> Dict[int, int]:
+    """Map character offsets in text to UTF-8 byte offsets in one pass"""
+    result = {}
+    position = byte_position = 0
+    for offset in sorted(set(offsets)):
+        byte_position += len(text[position:offset].encode("utf-8"))
+        position = offset
+        result[offset] = byte_position
+    return result
+
+
+class ContentStore:
+    """
+    Keeps the extracted text of each document once, compressed.
+
+    A document is stored as one file: a header, a table of named spans
+    (chunk and page byte ranges), a block index and the text's UTF-8 bytes
+    compressed in fixed-size blocks. Reading a range only decompresses the
+    blocks it overlaps, and files are read through mmap.
+    """
+
+    def __init__(self, directory: str = None, block_size: int = None, compression: str = None):
+        """
+        Args:
+            directory: Directory holding one file per document
+            block_size: Uncompressed bytes per block
+            compression: "zstd" (if installed) or "zlib"
+        """
+        self.directory = directory or settings.CONTENT_STORE_DIRECTORY
+        self.block_size = block_size or settings.CONTENT_BLOCK_SIZE
+        compression = compression or settings.CONTENT_COMPRESSION
+        self.codec = CODEC_ZSTD if compression == "zstd" and zstandard is not None else CODEC_ZLIB
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, document_id: str) -> str:
+        return os.path.join(self.directory, f"{document_id}.dcs")
+
+    def exists(self, document_id: str) -> bool:
+        return os.path.exists(self._path(document_id))
+
+    def put(self, document_id: str, text: str, spans: Dict[str, List[tuple]] = None) -> Dict[str, Any]:
+        """
+        Store the text of a document, replacing any previous version.
+
+        Args:
+            document_id: The ID of the document
+            text: Extracted document text
+            spans: Named lists of (start, end) character offsets into the
+                text, e.g. {"chunks": [...], "pages": [...]}
+
+        Returns:
+            Dict with the stored size in bytes before and after compression
+        """
+        data = text.encode("utf-8")
+        spans = spans or {}
+        offsets = _byte_offsets(text, [offset for ranges in spans.values() for span in ranges for offset in span])
+        span_table = json.dumps({
+            name: [[offsets[start], offsets[end]] for start, end in ranges] for name, ranges in spans.items()
+        }).encode("utf-8")
+
+        blocks = [
+            _compress(self.codec, data[start:start + self.block_size])
+            for start in range(0, len(data), self.block_size)
+        ]
+        offset = HEADER.size + len(span_table) + INDEX_ENTRY.size * len(blocks)
+        index = bytearray()
+        for block in blocks:
+            index += INDEX_ENTRY.pack(offset, len(block))
+            offset += len(block)
+
+        # Written to a unique temp file and renamed so readers never see a partial file
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix=".tmp", delete=False) as file:
+            file.write(HEADER.pack(MAGIC, self.codec, self.block_size, len(data), len(blocks), len(span_table)))
+            file.write(span_table)
+            file.write(index)
+            for block in blocks:
+                file.write(block)
+            temp_path = file.name
+        os.replace(temp_path, self._path(document_id))
+        return {"text_bytes": len(data), "stored_bytes": offset, "blocks": len(blocks)}
+
+    def set_spans(self, document_id: str, name: str, spans: List[tuple]) -> bool:
+        """
+        Add or replace one kind of span of a stored document, e.g. the chunks
+        of another index version. The compressed blocks are copied as is.
+
+        Args:
+            document_id: The ID of the document
+            name: Kind of span
+            spans: (start, end) character offsets into the document text
+
+        Returns:
+            False if the document is not stored
+        """
+        with self._open(document_id) as view:
+            if view is None:
+                return False
+            text = self._read(view, 0, None)
+            codec, block_size, text_bytes, block_count, span_bytes = self._header(view)
+            offsets = _byte_offsets(text, [offset for span in spans for offset in span])
+            table = self._spans(view)
+            table[name] = [[offsets[start], offsets[end]] for start, end in spans]
+            span_table = json.dumps(table).encode("utf-8")
+
+            index_start = HEADER.size + span_bytes
+            blocks_start = index_start + INDEX_ENTRY.size * block_count
+            shift = len(span_table) - span_bytes
+            index = bytearray()
+            for block in range(block_count):
+                offset, length = INDEX_ENTRY.unpack_from(view, index_start + block * INDEX_ENTRY.size)
+                index += INDEX_ENTRY.pack(offset + shift, length)
+
+            with tempfile.NamedTemporaryFile(dir=self.directory, suffix=".tmp", delete=False) as file:
+                file.write(HEADER.pack(MAGIC, codec, block_size, text_bytes, block_count, len(span_table)))
+                file.write(span_table)
+                file.write(index)
+                file.write(view[blocks_start:])
+                temp_path = file.name
+        os.replace(temp_path, self._path(document_id))
+        return True
+
+    def copy(self, source_id: str, target_id: str) -> bool:
+        """
+        Store a document's text under another id. Files are replaced, never
+        modified in place, so a hard link is safe where the filesystem allows.
+
+        Returns:
+            False if the source is not stored
+        """
+        source = self._path(source_id)
+        if not os.path.exists(source):
+            return False
+        temp_path = f"{self._path(target_id)}.{uuid.uuid4().hex}.tmp"
+        try:
+            os.link(source, temp_path)
+        except OSError:
+            shutil.copyfile(source, temp_path)
+        os.replace(temp_path, self._path(target_id))
+        return True
+
+    def delete(self, document_id: str):
+        """Delete the stored text of a document"""
+        try:
+            os.remove(self._path(document_id))
+        except FileNotFoundError:
+            pass
+
+    def get_text(self, document_id: str) -> Optional[str]:
+        """Get the full text of a document, or None if it is not stored"""
+        return self.get_range(document_id, 0, None)
+
+    def get_range(self, document_id: str, start: int, end: Optional[int]) -> Optional[str]:
+        """
+        Get the text between two UTF-8 byte offsets, decompressing only the
+        blocks the range overlaps.
+
+        Returns:
+            The text, or None if the document is not stored
+        """
+        with self._open(document_id) as view:
+            if view is None:
+                return None
+            return self._read(view, start, end)
+
+    def get_spans(self, document_id: str, name: str, first: int, last: int = None) -> Optional[str]:
+        """
+        Get the text covering spans first..last (inclusive) of a kind,
+        e.g. chunks 3 to 5 or a page range.
+
+        Returns:
+            The text, or None if the document or the spans are not stored
+        """
+        last = first if last is None else last
+        with self._open(document_id) as view:
+            if view is None:
+                return None
+            ranges = self._spans(view).get(name, [])
+            if not 0 <= first <= last < len(ranges):
+                return None
+            return self._read(view, ranges[first][0], ranges[last][1])
+
+    def get_span_texts(self, document_id: str, name: str) -> Optional[List[str]]:
+        """Get the text of every span of a kind, e.g. all chunks, in order"""
+        with self._open(document_id) as view:
+            if view is None:
+                return None
+            ranges = self._spans(view).get(name)
+            if ranges is None:
+                return None
+            return [self._read(view, start, end) for start, end in ranges]
+
+    def _open(self, document_id: str):
+        return _MappedFile(self._path(document_id))
+
+    @staticmethod
+    def _header(view) -> tuple:
+        magic, codec, block_size, text_bytes, block_count, span_bytes = HEADER.unpack_from(view, 0)
+        if magic != MAGIC:
+            raise Exception("Invalid content store file")
+        return codec, block_size, text_bytes, block_count, span_bytes
+
+    def _spans(self, view) -> Dict[str, List[List[int]]]:
+        span_bytes = self._header(view)[4]
+        return json.loads(bytes(view[HEADER.size:HEADER.size + span_bytes]))
+
+    def _read(self, view, start: int, end: Optional[int]) -> str:
+        codec, block_size, text_bytes, block_count, span_bytes = self._header(view)
+        end = text_bytes if end is None else min(end, text_bytes)
+        if start >= end:
+            return ""
+
+        index_start = HEADER.size + span_bytes
+        first, last = start // block_size, (end - 1) // block_size
+        data = bytearray()
+        for block in range(first, last + 1):
+            offset, length = INDEX_ENTRY.unpack_from(view, index_start + block * INDEX_ENTRY.size)
+            data += _decompress(codec, bytes(view[offset:offset + length]))
+        base = first * block_size
+        return bytes(data[start - base:end - base]).decode("utf-8", errors="replace")
+
+
+class _MappedFile:
+    """Context manager mapping a file read-only, yielding None if it does not exist"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = None
+        self.view = None
+
+    def __enter__(self):
+        try:
+            self.file = open(self.path, "rb")
+        except FileNotFoundError:
+            return None
+        try:
+            self.view = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            # mmap is unavailable for this file (e.g. some network filesystems)
+            self.view = self.file.read()
+        return self.view
+
+    def __exit__(self, *exc_info):
+        if isinstance(self.view, mmap.mmap):
+            self.view.close()
+        if self.file is not None:
+            self.file.close()
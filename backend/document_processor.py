@@ -1,61 +1,81 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, BinaryIO
 import PyPDF2
 from docx import Document
 import os
 from bs4 import BeautifulSoup
 import numpy as np
 from config import settings
+from instrumentation import timed
+
+DEFAULT_CHUNK_SIZE = 1000  # characters per chunk
+DEFAULT_CHUNK_OVERLAP = 200  # character overlap between chunks
 
 class DocumentProcessor:
-    def __init__(self):
-        self.chunk_size = 1000  # characters per chunk
-        self.chunk_overlap = 200  # character overlap between chunks
+    def __init__(self, chunk_size: int = DEFAULT_CHUNK_SIZE, chunk_overlap: int = DEFAULT_CHUNK_OVERLAP):
+        self.chunk_size = chunk_size  # characters per chunk
+        self.chunk_overlap = chunk_overlap  # character overlap between chunks
         
     def process_document(self, file_path: str, file_type: str) -> Dict[str, Any]:
-        """Process a document and return its text content and metadata"""
-        text = self._extract_text(file_path, file_type)
-        chunks = self._create_chunks(text)
-        metadata = self._extract_metadata(file_path, file_type)
-        
-        return {
-            "text": text,
-            "chunks": chunks,
-            "metadata": metadata
-        }
+        """Process a document file on disk; see process_stream"""
+        with open(file_path, "rb") as file:
+            processed = self.process_stream(file, file_type, os.path.getsize(file_path))
+        file_stats = os.stat(file_path)
+        processed["metadata"].update({
+            "created_at": file_stats.st_ctime,
+            "modified_at": file_stats.st_mtime
+        })
+        return processed
         
-    def _extract_text(self, file_path: str, file_type: str) -> str:
-        """Extract text from different file types"""
+    @timed("document_processor.extract")
+    def process_stream(self, stream: BinaryIO, file_type: str, file_size: int) -> Dict[str, Any]:
+        """
+        Process a document read from a file object, parsing it only once.
+        Returns its text content and metadata, with the (start, end)
+        character offsets of every chunk and, for PDFs, every page in the text
+        """
+        metadata = {"file_type": file_type, "file_size": file_size}
+        page_spans = []
         if file_type == "pdf":
-            return self._extract_from_pdf(file_path)
+            pdf_reader = PyPDF2.PdfReader(stream)
+            pages = [page.extract_text() for page in pdf_reader.pages]
+            text = "".join(page + "\n" for page in pages)
+            start = 0
+            for page in pages:
+                page_spans.append((start, start + len(page)))
+                start += len(page) + 1
+            metadata.update({
+                "page_count": len(pages),
+                "pdf_info": pdf_reader.metadata if pdf_reader.metadata else {}
+            })
         elif file_type == "docx":
-            return self._extract_from_docx(file_path)
+            doc = Document(stream)
+            text = "\n".join([paragraph.text for paragraph in doc.paragraphs])
+            metadata.update({
+                "paragraph_count": len(doc.paragraphs),
+                "word_count": sum(len(p.text.split()) for p in doc.paragraphs)
+            })
         elif file_type == "txt":
-            return self._extract_from_txt(file_path)
+            text = stream.read().decode("utf-8")
         else:
             raise ValueError(f"Unsupported file type: {file_type}")
-            
-    def _extract_from_pdf(self, file_path: str) -> str:
-        """Extract text from PDF files"""
-        text = ""
-        with open(file_path, "rb") as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-        return text
-        
-    def _extract_from_docx(self, file_path: str) -> str:
-        """Extract text from DOCX files"""
-        doc = Document(file_path)
-        return "\n".join([paragraph.text for paragraph in doc.paragraphs])
+        chunk_spans = self._create_chunk_spans(text)
         
-    def _extract_from_txt(self, file_path: str) -> str:
-        """Extract text from TXT files"""
-        with open(file_path, "r", encoding="utf-8") as file:
-            return file.read()
+        return {
+            "text": text,
+            "chunks": [text[start:end] for start, end in chunk_spans],
+            "chunk_spans": chunk_spans,
+            "page_spans": page_spans,
+            "metadata": metadata
+        }
             
     def _create_chunks(self, text: str) -> List[str]:
         """Split text into overlapping chunks"""
-        chunks = []
+        return [text[start:end] for start, end in self._create_chunk_spans(text)]
+        
+    @timed("document_processor.chunk")
+    def _create_chunk_spans(self, text: str) -> List[tuple]:
+        """Get the (start, end) offsets of overlapping chunks, whitespace trimmed"""
+        spans = []
         start = 0
         
         while start < len(text):
@@ -70,7 +90,8 @@ class DocumentProcessor:
                     chunk = chunk[:last_period + 1]
                     end = start + last_period + 1
             
-            chunks.append(chunk.strip())
+            leading = len(chunk) - len(chunk.lstrip())
+            spans.append((start + leading, start + max(leading, len(chunk.rstrip()))))
             
             # Move start position considering overlap
             start = end - self.chunk_overlap
@@ -79,35 +100,7 @@ class DocumentProcessor:
             if start >= len(text) - self.chunk_overlap:
                 break
         
-        return chunks
-        
-    def _extract_metadata(self, file_path: str, file_type: str) -> Dict[str, Any]:
-        """Extract metadata from the document"""
-        file_stats = os.stat(file_path)
-        
-        metadata = {
-            "file_type": file_type,
-            "file_size": file_stats.st_size,
-            "created_at": file_stats.st_ctime,
-            "modified_at": file_stats.st_mtime
-        }
-        
-        # Add file-type specific metadata
-        if file_type == "pdf":
-            with open(file_path, "rb") as file:
-                pdf = PyPDF2.PdfReader(file)
-                metadata.update({
-                    "page_count": len(pdf.pages),
-                    "pdf_info": pdf.metadata if pdf.metadata else {}
-                })
-        elif file_type == "docx":
-            doc = Document(file_path)
-            metadata.update({
-                "paragraph_count": len(doc.paragraphs),
-                "word_count": sum(len(p.text.split()) for p in doc.paragraphs)
-            })
-            
-        return metadata
+        return spans
         
     def validate_file_type(self, filename: str) -> bool:
         """Check if the file type is supported"""
@@ -1,25 +1,88 @@
 import os
 import uuid
 import json
+import base64
+import asyncio
+import hashlib
 import datetime
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Iterator, BinaryIO
 import firebase_admin
 from firebase_admin import credentials, firestore, storage
 from config import settings
+from blob_store import BlobStore, StorageMetrics, create_blob_store
+from instrumentation import timed
+
+CONTENT_TYPES = {
+    "pdf": "application/pdf",
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "txt": "text/plain; charset=utf-8"
+}
+
+def encode_cursor(document: Dict[str, Any]) -> str:
+    """
+    Build an opaque pagination cursor pointing just after a document.
+
+    Args:
+        document: The last document of the current page
+
+    Returns:
+        URL-safe cursor string
+    """
+    uploaded_at = document.get("uploadedAt")
+    if isinstance(uploaded_at, datetime.datetime):
+        uploaded_at = uploaded_at.isoformat()
+    payload = json.dumps({"t": uploaded_at, "id": document["id"]}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Dict[str, Any]:
+    """
+    Decode a cursor produced by encode_cursor into the keyset values.
+
+    Args:
+        cursor: Opaque cursor string
+
+    Returns:
+        Dict with the uploadedAt and id of the last seen document
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        uploaded_at = payload["t"]
+        if uploaded_at is not None:
+            uploaded_at = datetime.datetime.fromisoformat(uploaded_at)
+        return {"uploadedAt": uploaded_at, "id": payload["id"]}
+    except Exception:
+        raise ValueError("Invalid pagination cursor")
+
+
+def content_fingerprint(sha256: str) -> str:
+    """Fingerprint of a file's raw bytes, from their SHA-256 hex digest"""
+    return f"sha256:{sha256}"
+
+def text_fingerprint(text: str) -> str:
+    """Fingerprint of extracted text, insensitive to case and whitespace"""
+    normalized = " ".join(text.lower().split())
+    return f"text:{hashlib.sha256(normalized.encode('utf-8')).hexdigest()}"
 
 class DocumentStore:
     """
     Manages document storage and metadata using Firebase.
     """
     
-    def __init__(self, use_mock: bool = False):
+    def __init__(self, use_mock: bool = False, blob_store: BlobStore = None):
         """
         Initialize the document store with Firebase credentials or use mock implementation.
         
         Args:
             use_mock: If True, use a mock implementation instead of Firebase
+            blob_store: Where files are stored, created from BLOB_STORE if not given
         """
         self.use_mock = use_mock
+        self.metrics = StorageMetrics()
         
         if not use_mock:
             # Initialize Firebase if not already initialized
@@ -35,7 +98,9 @@ class DocumentStore:
                 })
             
             self.db = firestore.client()
-            self.bucket = storage.bucket()
+            self.blob_store = blob_store or create_blob_store(
+                bucket=storage.bucket() if settings.BLOB_STORE == "firebase" else None
+            )
         else:
             self._initialize_mock_storage()
     
@@ -45,14 +110,20 @@ class DocumentStore:
         self.mock_files = {}
         print("Using mock implementation of DocumentStore")
     
-    def store_document(self, file_path: str, metadata: Dict[str, Any], user_id: str) -> Dict[str, Any]:
+    @timed("document_store.store")
+    async def store_document(self, file_path: Optional[str], metadata: Dict[str, Any], user_id: str,
+                             file_obj: Optional[BinaryIO] = None, source: Dict[str, Any] = None) -> Dict[str, Any]:
         """
-        Store a document in Firebase Storage and save metadata in Firestore.
+        Store a document in the blob store and save metadata in Firestore.
         
         Args:
-            file_path: Path to the document file
-            metadata: Additional metadata
+            file_path: Path to the document file, or None when file_obj is given
+            metadata: Additional metadata; content_hash and text_hash are
+                registered in the fingerprint index
             user_id: ID of the user uploading the document
+            file_obj: Seekable file object to upload instead of a file on disk
+            source: Existing document with the same content_hash whose
+                stored file is referenced instead of uploading another copy
             
         Returns:
             Document metadata
@@ -63,14 +134,33 @@ class DocumentStore:
         try:
             # Generate unique ID
             doc_id = str(uuid.uuid4())
+            content_hash = metadata.get("content_hash")
+            batch = self.db.batch()
             
-            # Upload file to Firebase Storage
-            blob = self.bucket.blob(f"documents/{doc_id}/{metadata['filename']}")
-            blob.upload_from_filename(file_path)
+            # Reference the source's file while it is still in the index (it
+            # may have been deleted since it was looked up), else upload
+            if source is not None and await asyncio.to_thread(
+                self.add_fingerprint, content_fingerprint(content_hash), doc_id, require_existing=True
+            ):
+                blob_path = source.get("blobPath") or f"documents/{source['id']}/{source['fileName']}"
+                file_url = source["fileUrl"]
+            else:
+                blob_path = f"documents/{doc_id}/{metadata['filename']}"
+                if file_obj is None:
+                    with open(file_path, "rb") as file:
+                        stored = await self.blob_store.put(
+                            blob_path, file, os.path.getsize(file_path), CONTENT_TYPES.get(metadata.get("file_type"))
+                        )
+                else:
+                    stored = await self.blob_store.put(
+                        blob_path, file_obj, metadata.get("file_size"), CONTENT_TYPES.get(metadata.get("file_type"))
+                    )
+                file_url = stored["url"]
+                if content_hash:
+                    self._add_fingerprint_to_batch(batch, content_fingerprint(content_hash), doc_id, blob_path)
             
-            # Make file publicly accessible and get URL
-            blob.make_public()
-            file_url = blob.public_url
+            if metadata.get("text_hash"):
+                self._add_fingerprint_to_batch(batch, metadata["text_hash"], doc_id)
             
             # Store metadata in Firestore
             doc_data = {
@@ -80,29 +170,44 @@ class DocumentStore:
                 "fileType": metadata.get("file_type", "unknown"),
                 "fileName": metadata.get("filename", ""),
                 "fileSize": metadata.get("file_size", 0),
+                "chunkCount": metadata.get("chunk_count", 0),
+                "indexVersion": metadata.get("index_version"),
+                "blobPath": blob_path,
+                "contentHash": content_hash,
+                "textHash": metadata.get("text_hash"),
                 "uploadedBy": user_id,
                 "uploadedAt": datetime.datetime.now(),
                 "metadata": metadata,
                 "tags": []
             }
+            batch.set(self.db.collection("documents").document(doc_id), doc_data)
             
-            self.db.collection("documents").document(doc_id).set(doc_data)
+            # The document and its fingerprints are written in one round trip
+            with self.metrics.measure("metadata_write"):
+                await asyncio.to_thread(batch.commit)
             return doc_data
             
         except Exception as e:
             raise Exception(f"Failed to store document: {str(e)}")
     
-    def get_documents(self, user_id: str = None, limit: int = 50) -> List[Dict[str, Any]]:
+    @timed("document_store.list")
+    def get_documents(self, user_id: str = None, limit: int = 50, cursor: str = None) -> List[Dict[str, Any]]:
         """
-        Get a list of documents.
+        Get a page of documents, newest first.
+        
+        Documents are ordered by (uploadedAt, id) descending so pages can be
+        fetched with keyset pagination instead of offsets.
         
         Args:
             user_id: If provided, filter documents by user ID
             limit: Maximum number of documents to return
+            cursor: Cursor from encode_cursor for the last document of the previous page
             
         Returns:
             List of document metadata
         """
+        after = decode_cursor(cursor) if cursor else None
+        
         if self.use_mock:
             return []
             
@@ -112,12 +217,37 @@ class DocumentStore:
             if user_id:
                 query = query.where("uploadedBy", "==", user_id)
             
+            query = query.order_by("uploadedAt", direction=firestore.Query.DESCENDING)
+            query = query.order_by("id", direction=firestore.Query.DESCENDING)
+            if after:
+                query = query.start_after(after)
+            
             docs = query.limit(limit).get()
             return [doc.to_dict() for doc in docs]
             
         except Exception as e:
             raise Exception(f"Failed to get documents: {str(e)}")
     
+    def iter_documents(self, user_id: str = None, page_size: int = 500) -> Iterator[Dict[str, Any]]:
+        """
+        Iterate over all documents page by page, holding one page in memory.
+        
+        Args:
+            user_id: If provided, filter documents by user ID
+            page_size: Number of documents fetched per query
+            
+        Yields:
+            Document metadata
+        """
+        cursor = None
+        while True:
+            page = self.get_documents(user_id=user_id, limit=page_size, cursor=cursor)
+            yield from page
+            if len(page) < page_size:
+                return
+            cursor = encode_cursor(page[-1])
+    
+    @timed("document_store.get")
     def get_document(self, document_id: str) -> Optional[Dict[str, Any]]:
         """
         Get document metadata from Firestore.
@@ -138,35 +268,150 @@ class DocumentStore:
         except Exception as e:
             raise Exception(f"Failed to get document: {str(e)}")
     
-    def delete_document(self, document_id: str):
+    @timed("document_store.delete")
+    async def delete_document(self, document_id: str, document: Dict[str, Any] = None) -> bool:
         """
-        Delete a document from Firebase Storage and Firestore.
+        Delete a document from the blob store and Firestore.
         
         Args:
             document_id: The ID of the document to delete
+            document: Its metadata if already read, to avoid reading it again
+            
+        Returns:
+            True if the document existed and was deleted
         """
         if self.use_mock:
-            return
+            return True
             
         try:
-            # Get document data
-            doc = self.db.collection("documents").document(document_id).get()
-            if not doc.exists:
-                return
-                
-            doc_data = doc.to_dict()
+            doc_data = document
+            if doc_data is None:
+                # Get document data
+                with self.metrics.measure("metadata_read"):
+                    doc = await asyncio.to_thread(self.db.collection("documents").document(document_id).get)
+                if not doc.exists:
+                    return False
+                doc_data = doc.to_dict()
+            
+            # Drop this document's references; the stored file may be shared
+            # with other uploads of the same content
+            def release() -> bool:
+                shared = False
+                if doc_data.get("contentHash"):
+                    shared = self._release_fingerprint(content_fingerprint(doc_data["contentHash"]), document_id) > 0
+                if doc_data.get("textHash"):
+                    self._release_fingerprint(doc_data["textHash"], document_id)
+                return shared
+            
+            with self.metrics.measure("metadata_write"):
+                shared = await asyncio.to_thread(release)
             
-            # Delete file from storage
-            if "fileName" in doc_data:
-                blob = self.bucket.blob(f"documents/{document_id}/{doc_data['fileName']}")
-                blob.delete()
+            # Delete file from storage once nothing references it
+            if "fileName" in doc_data and not shared:
+                await self.blob_store.delete(doc_data.get("blobPath") or f"documents/{document_id}/{doc_data['fileName']}")
                 
             # Delete document metadata
-            self.db.collection("documents").document(document_id).delete()
+            with self.metrics.measure("metadata_write"):
+                await asyncio.to_thread(self.db.collection("documents").document(document_id).delete)
+            return True
             
         except Exception as e:
             raise Exception(f"Failed to delete document: {str(e)}")
     
+    @timed("document_store.find_by_fingerprint")
+    def find_by_fingerprint(self, fingerprint: str) -> Optional[Dict[str, Any]]:
+        """
+        Find a stored document with the given content fingerprint.
+        
+        Args:
+            fingerprint: Value of content_fingerprint or text_fingerprint
+            
+        Returns:
+            Document metadata of one of the documents with that content, or None
+        """
+        if self.use_mock:
+            return None
+            
+        try:
+            entry = self.db.collection("content_index").document(fingerprint).get()
+            document_ids = entry.to_dict().get("documentIds", []) if entry.exists else []
+            return self.get_document(document_ids[0]) if document_ids else None
+            
+        except Exception as e:
+            raise Exception(f"Failed to look up document fingerprint: {str(e)}")
+    
+    def add_fingerprint(self, fingerprint: str, document_id: str, blob_path: str = None,
+                        require_existing: bool = False) -> bool:
+        """
+        Add a document's reference to a fingerprint index entry.
+        
+        Args:
+            fingerprint: Value of content_fingerprint or text_fingerprint
+            document_id: The ID of the referencing document
+            blob_path: Storage path of the file with this content, for new entries
+            require_existing: Only add to an entry that still has references
+            
+        Returns:
+            True if the reference was added
+        """
+        if self.use_mock:
+            return False
+            
+        entry_ref = self.db.collection("content_index").document(fingerprint)
+        
+        @firestore.transactional
+        def add(transaction) -> bool:
+            snapshot = entry_ref.get(transaction=transaction)
+            entry = snapshot.to_dict() if snapshot.exists else {}
+            document_ids = entry.get("documentIds", [])
+            if require_existing and not document_ids:
+                return False
+            if document_id not in document_ids:
+                document_ids.append(document_id)
+            transaction.set(entry_ref, {
+                "documentIds": document_ids,
+                "refCount": len(document_ids),
+                "blobPath": entry.get("blobPath") or blob_path
+            })
+            return True
+        
+        try:
+            return add(self.db.transaction())
+        except Exception as e:
+            raise Exception(f"Failed to add document fingerprint: {str(e)}")
+    
+    def _add_fingerprint_to_batch(self, batch, fingerprint: str, document_id: str, blob_path: str = None):
+        """Add a document's reference to a fingerprint entry as part of a write batch, without reading it"""
+        entry = {"documentIds": firestore.ArrayUnion([document_id]), "refCount": firestore.Increment(1)}
+        if blob_path:
+            entry["blobPath"] = blob_path
+        batch.set(self.db.collection("content_index").document(fingerprint), entry, merge=True)
+    
+    def storage_stats(self) -> Dict[str, Any]:
+        """Get the latency of blob transfers and metadata reads and writes"""
+        if self.use_mock:
+            return {}
+        return {"blobs": self.blob_store.stats(), "metadata": self.metrics.to_dict()}
+    
+    def _release_fingerprint(self, fingerprint: str, document_id: str) -> int:
+        """Remove a document's reference to a fingerprint and return how many remain"""
+        entry_ref = self.db.collection("content_index").document(fingerprint)
+        
+        @firestore.transactional
+        def release(transaction) -> int:
+            snapshot = entry_ref.get(transaction=transaction)
+            if not snapshot.exists:
+                return 0
+            entry = snapshot.to_dict()
+            document_ids = [i for i in entry.get("documentIds", []) if i != document_id]
+            if document_ids:
+                transaction.update(entry_ref, {"documentIds": document_ids, "refCount": len(document_ids)})
+            else:
+                transaction.delete(entry_ref)
+            return len(document_ids)
+        
+        return release(self.db.transaction())
+    
     def update_document_tags(self, document_id: str, tags: List[str]):
         """
         Update document tags in Firestore.
@@ -185,6 +430,24 @@ class DocumentStore:
         except Exception as e:
             raise Exception(f"Failed to update document tags: {str(e)}")
     
+    def update_document_insights(self, document_id: str, insights: Dict[str, Any]):
+        """
+        Store the computed insights of a document in Firestore.
+        
+        Args:
+            document_id: The ID of the document to update
+            insights: Insights computed by InsightsBuilder
+        """
+        if self.use_mock:
+            return
+            
+        try:
+            self.db.collection("documents").document(document_id).update({
+                "insights": insights
+            })
+        except Exception as e:
+            raise Exception(f"Failed to update document insights: {str(e)}")
+    
     def get_documents_by_tag(self, tag_id: str) -> List[Dict[str, Any]]:
         """
         Get all documents with a specific tag.
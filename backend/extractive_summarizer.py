@@ -0,0 +1,141 @@
+import re
+from typing import List
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+from tokens import count_tokens
+
+SENTENCE_PATTERN = re.compile(r"[^.!?\n]+(?:[.!?]+|$)", re.MULTILINE)
+
+
+class ExtractiveSummarizer:
+    """
+    Local summarizer that selects the most central sentences of a document
+    instead of generating text. Sentences are embedded as TF-IDF vectors,
+    ranked with TextRank over their cosine similarity graph, and picked with
+    maximal marginal relevance so the selection is not redundant. Runs in
+    milliseconds without network access.
+    """
+
+    def __init__(self, damping: float = 0.85, iterations: int = 30, diversity: float = 0.3,
+                 max_graph_sentences: int = 2000):
+        """
+        Args:
+            damping: TextRank damping factor
+            iterations: Power iterations used to rank sentences
+            diversity: MMR weight of the redundancy penalty (0 disables it)
+            max_graph_sentences: Above this many sentences the quadratic
+                similarity graph is replaced by similarity to the centroid
+        """
+        self.damping = damping
+        self.iterations = iterations
+        self.diversity = diversity
+        self.max_graph_sentences = max_graph_sentences
+
+    def split_sentences(self, text: str) -> List[str]:
+        """Split text into sentences, dropping fragments and exact duplicates"""
+        seen = set()
+        sentences = []
+        for match in SENTENCE_PATTERN.finditer(text):
+            sentence = " ".join(match.group().split())
+            if len(sentence) > 20 and sentence not in seen:
+                seen.add(sentence)
+                sentences.append(sentence)
+        return sentences
+
+    def rank(self, sentences: List[str]) -> tuple:
+        """
+        Score sentences by centrality.
+
+        Returns:
+            (scores, matrix) where matrix holds the L2-normalized TF-IDF rows
+        """
+        try:
+            matrix = TfidfVectorizer(stop_words="english", sublinear_tf=True).fit_transform(sentences)
+        except ValueError:
+            # Empty vocabulary, e.g. only stop words: fall back to document order
+            return np.linspace(1.0, 0.0, len(sentences)), None
+
+        if len(sentences) > self.max_graph_sentences:
+            centroid = np.asarray(matrix.mean(axis=0)).ravel()
+            return matrix @ centroid, matrix
+
+        similarity = (matrix @ matrix.T).toarray()
+        np.fill_diagonal(similarity, 0.0)
+        row_sums = similarity.sum(axis=1, keepdims=True)
+        row_sums[row_sums == 0] = 1.0
+        transition = similarity / row_sums
+
+        n = len(sentences)
+        scores = np.full(n, 1.0 / n)
+        for _ in range(self.iterations):
+            scores = (1 - self.damping) / n + self.damping * (transition.T @ scores)
+        return scores, matrix
+
+    def select(self, sentences: List[str], count: int) -> List[int]:
+        """
+        Pick up to count sentence indices by MMR, returned in document order.
+        """
+        if len(sentences) <= count:
+            return list(range(len(sentences)))
+
+        scores, matrix = self.rank(sentences)
+        if matrix is None or self.diversity <= 0:
+            return sorted(np.argsort(-scores)[:count].tolist())
+
+        scores = scores / (scores.max() or 1.0)
+        selected = []
+        redundancy = np.zeros(len(sentences))
+        candidates = np.ones(len(sentences), dtype=bool)
+        for _ in range(count):
+            mmr = np.where(candidates, (1 - self.diversity) * scores - self.diversity * redundancy, -np.inf)
+            best = int(np.argmax(mmr))
+            selected.append(best)
+            candidates[best] = False
+            similarity = (matrix @ matrix[best].T).toarray().ravel()
+            redundancy = np.maximum(redundancy, similarity)
+        return sorted(selected)
+
+    def summarize(self, text: str, summary_type: str = "general", max_sentences: int = 7) -> str:
+        """
+        Summarize text by extraction.
+
+        Args:
+            text: Document text
+            summary_type: "bullet_points" for a list, anything else for prose
+            max_sentences: Number of sentences to select
+
+        Returns:
+            The summary
+        """
+        if summary_type == "detailed":
+            max_sentences *= 2
+        sentences = self.split_sentences(text)
+        chosen = [sentences[i] for i in self.select(sentences, max_sentences)]
+        if summary_type == "bullet_points":
+            return "\n".join(f"• {sentence}" for sentence in chosen)
+        return " ".join(chosen)
+
+    def key_points(self, text: str, count: int = 5) -> List[str]:
+        """Get the count most central, mutually distinct sentences"""
+        sentences = self.split_sentences(text)
+        return [sentences[i] for i in self.select(sentences, count)]
+
+    def shrink(self, text: str, max_tokens: int) -> str:
+        """
+        Reduce text to roughly max_tokens by keeping its highest ranked
+        sentences in document order. Used to cut the input of LLM calls.
+        """
+        if count_tokens(text) <= max_tokens:
+            return text
+        sentences = self.split_sentences(text)
+        if not sentences:
+            return text
+        scores, _ = self.rank(sentences)
+
+        kept, budget = [], max_tokens
+        for i in np.argsort(-scores):
+            tokens = count_tokens(sentences[i])
+            if tokens <= budget:
+                kept.append(i)
+                budget -= tokens
+        return " ".join(sentences[i] for i in sorted(kept))
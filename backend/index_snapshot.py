@@ -0,0 +1,997 @@
+import os
+import json
+import zlib
+import heapq
+import shutil
+import struct
+import hashlib
+import bisect
+import datetime
+import tempfile
+import threading
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Iterator, Tuple, Callable
+import numpy as np
+from config import settings
+from vector_store import TAG_KEY_PREFIX, _to_timestamp
+
+MAGIC = b"VSNAP002"
+ALIGNMENT = 64
+# Footer length and magic, the last 16 bytes of a snapshot
+FOOTER = struct.Struct("<Q8s")
+# Header and payload length of an append log record
+LOG_RECORD = struct.Struct("<II")
+SNAPSHOT_FILE = "snapshot.bin"
+LOG_FILE = "append.log"
+COPY_CHUNK_BYTES = 1024 * 1024
+EXPORT_PAGE_SIZE = 1000
+
+# One document as stored in a snapshot: id, metadata, chunk texts, embeddings
+SnapshotDocument = Tuple[str, Dict[str, Any], List[str], np.ndarray]
+
+# Sections written after the embeddings: name, dtype, whether it is an offsets
+# table (starting with 0, one end offset per entry)
+SECTIONS = (
+    ("squared_norms", "<f4", False),
+    ("chunk_documents", "<i4", False),
+    ("text_offsets", "<u8", True),
+    ("texts", "u1", False),
+    ("document_starts", "<i8", True),
+    ("document_id_offsets", "<u8", True),
+    ("document_ids", "u1", False),
+    ("metadata_offsets", "<u8", True),
+    ("metadata", "u1", False),
+    ("file_types", "<i4", False),
+    ("uploaded_by", "<i4", False),
+    ("uploaded_at", "<f8", False),
+    ("id_order", "<i4", False),
+)
+
+_search_pool: Optional[ThreadPoolExecutor] = None
+_search_pool_lock = threading.Lock()
+
+
+def _values(value) -> list:
+    return list(value) if isinstance(value, (list, tuple, set)) else [value]
+
+
+def _fan_out(func: Callable, items: list) -> list:
+    """Call func on every item, concurrently on the shard search threads when there is more than one"""
+    global _search_pool
+    if len(items) <= 1 or settings.SHARD_SEARCH_THREADS <= 1:
+        return [func(item) for item in items]
+    with _search_pool_lock:
+        # Created on first use, so preforked workers each start their own
+        if _search_pool is None:
+            _search_pool = ThreadPoolExecutor(settings.SHARD_SEARCH_THREADS, thread_name_prefix="shard-search")
+    return list(_search_pool.map(func, items))
+
+
+class ShardMap:
+    """
+    How documents are grouped into shards: one per tenant (the uploader),
+    and for tenants with more chunks than SHARD_MAX_CHUNKS several, chosen
+    by a hash of the document id. Snapshots store documents in shard order,
+    so every shard and every tenant is one contiguous range of rows.
+    """
+
+    def __init__(self, splits: Dict[str, int] = None):
+        """
+        Args:
+            splits: Number of hash shards of each tenant that has more than one
+        """
+        self.splits = dict(splits or {})
+
+    @classmethod
+    def plan(cls, tenant_chunks: Dict[str, int], max_chunks: int = None) -> "ShardMap":
+        """Split every tenant into as many shards as it needs to keep them under max_chunks"""
+        max_chunks = max_chunks or settings.SHARD_MAX_CHUNKS
+        return cls({tenant: -(-chunks // max_chunks) for tenant, chunks in tenant_chunks.items() if chunks > max_chunks})
+
+    def shard(self, tenant: str, document_id: str) -> int:
+        count = self.splits.get(tenant, 1)
+        return zlib.crc32(document_id.encode("utf-8")) % count if count > 1 else 0
+
+    def key(self, tenant: str, document_id: str) -> Tuple[str, int, str]:
+        """Sort key of a document: its tenant, its shard within the tenant, then its id"""
+        return tenant, self.shard(tenant, document_id), document_id
+
+    def document_key(self, document: SnapshotDocument) -> Tuple[str, int, str]:
+        return self.key(document[1].get("uploaded_by", ""), document[0])
+
+
+def matches_filters(document_id: str, metadata: Dict[str, Any], filters: Optional[Dict[str, Any]]) -> bool:
+    """Whether a document's chunk metadata matches search filters, with the semantics of vector_store.build_where"""
+    if not filters:
+        return True
+    values = {"document_id": document_id, **metadata}
+    for field in ("document_id", "file_type", "uploaded_by"):
+        value = filters.get(field)
+        if value and values.get(field) not in (value if isinstance(value, (list, tuple, set)) else [value]):
+            return False
+    for tag_id in filters.get("tags") or []:
+        if metadata.get(f"{TAG_KEY_PREFIX}{tag_id}") is not True:
+            return False
+    uploaded_at = metadata.get("uploaded_at")
+    uploaded_after = _to_timestamp(filters.get("uploaded_after"))
+    if uploaded_after is not None and (uploaded_at is None or uploaded_at < uploaded_after):
+        return False
+    uploaded_before = _to_timestamp(filters.get("uploaded_before"))
+    if uploaded_before is not None and (uploaded_at is None or uploaded_at > uploaded_before):
+        return False
+    return True
+
+
+def _chunk_result(document_id: str, metadata: Dict[str, Any], chunk_index: int, text: str,
+                  distance: float) -> Dict[str, Any]:
+    return {
+        "document_id": document_id,
+        "chunk_id": f"{document_id}_{chunk_index}",
+        "chunk_text": text,
+        "similarity_score": float(distance),
+        "metadata": {**metadata, "document_id": document_id, "chunk_index": chunk_index}
+    }
+
+
+def _squared_distances(embeddings: np.ndarray, squared_norms: np.ndarray, query: np.ndarray) -> np.ndarray:
+    # Squared L2, the metric of the Chroma collections
+    return squared_norms - 2 * (embeddings @ query) + query @ query
+
+
+def _nearest(distances: np.ndarray, limit: int) -> np.ndarray:
+    k = min(limit, len(distances))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    nearest = np.argpartition(distances, k - 1)[:k]
+    return nearest[np.argsort(distances[nearest])]
+
+
+class SnapshotWriter:
+    """
+    Streams documents, in the shard order of shard_map, into a new snapshot file.
+
+    The embedding matrix is written straight to the file; the other
+    sections are spooled to temporary files and appended after it. The
+    file only appears under its name once finish() has written the footer.
+    """
+
+    def __init__(self, path: str, version: Dict[str, Any], shard_map: ShardMap = None):
+        self.path = path
+        self.version = version
+        self.shard_map = shard_map or ShardMap()
+        self.temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        self.chunks = 0
+        self.documents = 0
+        self.dimensions = 0
+        self._file = open(self.temp_path, "wb")
+        self._digest = hashlib.sha256()
+        self._write(MAGIC)
+        self._pad()
+        self._embeddings_offset = self._file.tell()
+        self._spools = {name: tempfile.TemporaryFile() for name, _, _ in SECTIONS}
+        self._ends: Dict[str, int] = {}
+        for name, dtype, is_offsets in SECTIONS:
+            if is_offsets:
+                self._ends[name] = 0
+                self._spool(name, [0], dtype)
+        self._strings: Dict[str, Dict[str, int]] = {"file_types": {}, "uploaded_by": {}}
+        self._tags: Dict[str, List[int]] = {}
+        self._ids: List[str] = []
+        self._shards: List[Dict[str, Any]] = []
+        self._last_key = None
+
+    def _write(self, data: bytes):
+        self._file.write(data)
+        self._digest.update(data)
+
+    def _pad(self):
+        padding = -self._file.tell() % ALIGNMENT
+        if padding:
+            self._write(b"\0" * padding)
+
+    def _spool(self, name: str, values, dtype: str):
+        self._spools[name].write(np.asarray(values, dtype=dtype).tobytes())
+
+    def _spool_offset(self, name: str, length: int, dtype: str):
+        self._ends[name] += length
+        self._spool(name, [self._ends[name]], dtype)
+
+    def _code(self, field: str, value: str) -> int:
+        return self._strings[field].setdefault(value, len(self._strings[field]))
+
+    def add(self, document_id: str, metadata: Dict[str, Any], texts: List[str], embeddings: np.ndarray):
+        """Append a document; documents must come in shard order (ShardMap.key)"""
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if not texts:
+            return
+        fields = {key: value for key, value in metadata.items() if key not in ("document_id", "chunk_index")}
+        key = self.shard_map.key(fields.get("uploaded_by", ""), document_id)
+        if self._last_key is not None and key <= self._last_key:
+            raise ValueError(f"Document {document_id} is out of shard order")
+        self._last_key = key
+        if not self.dimensions:
+            self.dimensions = embeddings.shape[1]
+        row = self.documents
+        if not self._shards or self._shards[-1]["key"] != list(key[:2]):
+            self._shards.append({"key": list(key[:2]), "documents": [row, row], "chunks": [self.chunks, self.chunks]})
+        self._shards[-1]["documents"][1] = row + 1
+        self._shards[-1]["chunks"][1] = self.chunks + len(texts)
+        self._ids.append(document_id)
+        self._write(embeddings.tobytes())
+        self._spool("squared_norms", np.einsum("ij,ij->i", embeddings, embeddings), "<f4")
+        self._spool("chunk_documents", np.full(len(texts), row), "<i4")
+        for text in texts:
+            encoded = text.encode("utf-8")
+            self._spools["texts"].write(encoded)
+            self._spool_offset("text_offsets", len(encoded), "<u8")
+        self._spool_offset("document_starts", len(texts), "<i8")
+
+        encoded = document_id.encode("utf-8")
+        self._spools["document_ids"].write(encoded)
+        self._spool_offset("document_id_offsets", len(encoded), "<u8")
+        encoded = json.dumps(fields).encode("utf-8")
+        self._spools["metadata"].write(encoded)
+        self._spool_offset("metadata_offsets", len(encoded), "<u8")
+
+        self._spool("file_types", [self._code("file_types", fields.get("file_type", ""))], "<i4")
+        self._spool("uploaded_by", [self._code("uploaded_by", fields.get("uploaded_by", ""))], "<i4")
+        self._spool("uploaded_at", [fields.get("uploaded_at", np.nan)], "<f8")
+        for key, value in fields.items():
+            if key.startswith(TAG_KEY_PREFIX) and value is True:
+                self._tags.setdefault(key[len(TAG_KEY_PREFIX):], []).append(row)
+
+        self.chunks += len(texts)
+        self.documents += 1
+
+    def finish(self) -> str:
+        """Write the remaining sections and the footer, and move the file into place"""
+        # Rows ordered by document id, for lookups by id
+        self._spool("id_order", sorted(range(self.documents), key=self._ids.__getitem__), "<i4")
+        sections = {
+            "embeddings": {"offset": self._embeddings_offset, "dtype": "<f4", "shape": [self.chunks, self.dimensions]}
+        }
+        for name, dtype, _ in SECTIONS:
+            self._pad()
+            spool = self._spools[name]
+            sections[name] = {"offset": self._file.tell(), "dtype": dtype,
+                              "shape": [spool.tell() // np.dtype(dtype).itemsize]}
+            spool.seek(0)
+            for chunk in iter(lambda: spool.read(COPY_CHUNK_BYTES), b""):
+                self._write(chunk)
+            spool.close()
+
+        footer = json.dumps({
+            "version": self.version,
+            "created_at": datetime.datetime.now().isoformat(),
+            "chunks": self.chunks,
+            "documents": self.documents,
+            "dimensions": self.dimensions,
+            "sections": sections,
+            "strings": {field: list(codes) for field, codes in self._strings.items()},
+            "tags": self._tags,
+            "splits": self.shard_map.splits,
+            "shards": self._shards,
+            "sha256": self._digest.hexdigest(),
+        }).encode("utf-8")
+        self._file.write(footer)
+        self._file.write(FOOTER.pack(len(footer), MAGIC))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self.temp_path, self.path)
+        return self.path
+
+    def abort(self):
+        for spool in self._spools.values():
+            spool.close()
+        self._file.close()
+        try:
+            os.remove(self.temp_path)
+        except FileNotFoundError:
+            pass
+
+
+def write_snapshot(path: str, version: Dict[str, Any], documents: Iterator[SnapshotDocument],
+                   shard_map: ShardMap = None) -> str:
+    """Write documents, in shard order, to a snapshot file"""
+    writer = SnapshotWriter(path, version, shard_map)
+    try:
+        for document in documents:
+            writer.add(*document)
+        return writer.finish()
+    except BaseException:
+        writer.abort()
+        raise
+
+
+def export_collection(collection, exclude: Callable[[str], bool] = None) -> Tuple[ShardMap, Iterator[SnapshotDocument]]:
+    """
+    Plan the shards of a Chroma collection from its metadata.
+
+    Returns:
+        The shard map, and an iterator reading every document in shard
+        order with its chunks in chunk order
+    """
+    listing = collection.get(include=["metadatas"])
+    rows = []
+    tenant_chunks: Dict[str, int] = {}
+    for chunk_id, metadata in zip(listing["ids"], listing["metadatas"]):
+        document_id = metadata.get("document_id") or chunk_id.rsplit("_", 1)[0]
+        if exclude is None or not exclude(document_id):
+            rows.append((document_id, metadata.get("chunk_index", 0), chunk_id, metadata))
+            tenant = metadata.get("uploaded_by", "")
+            tenant_chunks[tenant] = tenant_chunks.get(tenant, 0) + 1
+    shard_map = ShardMap.plan(tenant_chunks)
+    rows.sort(key=lambda row: (shard_map.key(row[3].get("uploaded_by", ""), row[0]), row[1]))
+    return shard_map, _read_documents(collection, rows)
+
+
+def _read_documents(collection, rows: list) -> Iterator[SnapshotDocument]:
+    # A document whose chunks compaction removed after the listing is left
+    # out as a whole; it was already deleted
+    document_id, metadata, texts, embeddings, complete = None, None, [], [], True
+    for start in range(0, len(rows), EXPORT_PAGE_SIZE):
+        page = rows[start:start + EXPORT_PAGE_SIZE]
+        results = collection.get(ids=[row[2] for row in page], include=["embeddings", "documents"])
+        by_id = {chunk_id: i for i, chunk_id in enumerate(results["ids"])}
+        for row in page:
+            if row[0] != document_id:
+                if texts and complete:
+                    yield document_id, metadata, texts, np.vstack(embeddings)
+                document_id, metadata, texts, embeddings, complete = row[0], row[3], [], [], True
+            i = by_id.get(row[2])
+            if i is None:
+                complete = False
+                continue
+            texts.append(results["documents"][i] or "")
+            embeddings.append(np.asarray(results["embeddings"][i], dtype=np.float32))
+    if texts and complete:
+        yield document_id, metadata, texts, np.vstack(embeddings)
+
+
+class Snapshot:
+    """
+    A snapshot file opened read-only. Every section is a view of one
+    memory map, so opening only reads the footer and pages are faulted in
+    as searches touch them; processes opening the same file share them in
+    the page cache.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.name = os.path.basename(path)
+        size = os.path.getsize(path)
+        with open(path, "rb") as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"Not a vector index snapshot: {path}")
+            file.seek(size - FOOTER.size)
+            length, magic = FOOTER.unpack(file.read(FOOTER.size))
+            if magic != MAGIC:
+                raise ValueError(f"Incomplete vector index snapshot: {path}")
+            file.seek(size - FOOTER.size - length)
+            footer = json.loads(file.read(length))
+        self._data_end = size - FOOTER.size - length
+        self._sha256 = footer["sha256"]
+        self._map = np.memmap(path, dtype=np.uint8, mode="r")
+        self._sections = footer["sections"]
+
+        self.version = footer["version"]
+        self.created_at = footer["created_at"]
+        self.chunk_count = footer["chunks"]
+        self.document_count = footer["documents"]
+        self.embeddings = self._section("embeddings")
+        self.squared_norms = self._section("squared_norms")
+        self.chunk_documents = self._section("chunk_documents")
+        self.text_offsets = self._section("text_offsets")
+        self.texts = self._section("texts")
+        self.document_starts = self._section("document_starts")
+        self.document_id_offsets = self._section("document_id_offsets")
+        self.document_ids = self._section("document_ids")
+        self.metadata_offsets = self._section("metadata_offsets")
+        self.metadata_bytes = self._section("metadata")
+        self.file_types = self._section("file_types")
+        self.uploaded_by = self._section("uploaded_by")
+        self.uploaded_at = self._section("uploaded_at")
+        self.strings: Dict[str, List[str]] = footer["strings"]
+        self.tags: Dict[str, List[int]] = footer["tags"]
+        self.id_order = self._section("id_order")
+        self._lengths = None
+        self._tag_rows: Dict[str, np.ndarray] = {}
+
+        self.shard_map = ShardMap(footer["splits"])
+        self.shards: List[Dict[str, Any]] = footer["shards"]
+        # Documents of a tenant are contiguous: its first to its last shard
+        self.tenants: Dict[str, Tuple[int, int]] = {}
+        for shard in self.shards:
+            tenant = shard["key"][0]
+            start = self.tenants.get(tenant, shard["documents"])[0]
+            self.tenants[tenant] = (start, shard["documents"][1])
+        self._shard_starts = np.array([shard["documents"][0] for shard in self.shards], dtype=np.int64)
+
+    def _section(self, name: str) -> np.ndarray:
+        spec = self._sections[name]
+        dtype = np.dtype(spec["dtype"])
+        size = int(np.prod(spec["shape"])) * dtype.itemsize
+        return self._map[spec["offset"]:spec["offset"] + size].view(dtype).reshape(spec["shape"])
+
+    def verify(self) -> bool:
+        """Check the file against the checksum in its footer; reads the whole file"""
+        digest = hashlib.sha256()
+        with open(self.path, "rb") as file:
+            remaining = self._data_end
+            while remaining:
+                chunk = file.read(min(COPY_CHUNK_BYTES, remaining))
+                if not chunk:
+                    return False
+                digest.update(chunk)
+                remaining -= len(chunk)
+        return digest.hexdigest() == self._sha256
+
+    @property
+    def lengths(self) -> np.ndarray:
+        """Number of chunks of each document"""
+        if self._lengths is None:
+            self._lengths = np.diff(self.document_starts)
+        return self._lengths
+
+    def document_id(self, row: int) -> str:
+        return bytes(self.document_ids[self.document_id_offsets[row]:self.document_id_offsets[row + 1]]).decode("utf-8")
+
+    def tenant(self, row: int) -> str:
+        return self.strings["uploaded_by"][self.uploaded_by[row]]
+
+    def tenant_chunks(self) -> Dict[str, int]:
+        """Number of chunks of each tenant"""
+        counts: Dict[str, int] = {}
+        for shard in self.shards:
+            tenant = shard["key"][0]
+            counts[tenant] = counts.get(tenant, 0) + shard["chunks"][1] - shard["chunks"][0]
+        return counts
+
+    def find_document(self, document_id: str) -> Optional[int]:
+        """Find a document's row by binary search over the rows in id order"""
+        i = bisect.bisect_left(range(self.document_count), document_id, key=lambda i: self.document_id(self.id_order[i]))
+        if i < self.document_count and self.document_id(self.id_order[i]) == document_id:
+            return int(self.id_order[i])
+        return None
+
+    def metadata(self, row: int) -> Dict[str, Any]:
+        return json.loads(bytes(self.metadata_bytes[self.metadata_offsets[row]:self.metadata_offsets[row + 1]]))
+
+    def text(self, chunk: int) -> str:
+        return bytes(self.texts[self.text_offsets[chunk]:self.text_offsets[chunk + 1]]).decode("utf-8")
+
+    def document(self, row: int) -> SnapshotDocument:
+        start, end = int(self.document_starts[row]), int(self.document_starts[row + 1])
+        return (self.document_id(row), self.metadata(row), [self.text(chunk) for chunk in range(start, end)],
+                np.asarray(self.embeddings[start:end]))
+
+    def iter_documents(self, skip: Callable[[str], bool] = None,
+                       shard_map: ShardMap = None) -> Iterator[SnapshotDocument]:
+        """Read the documents in the shard order of shard_map, by default the snapshot's own"""
+        rows = range(self.document_count)
+        if shard_map is not None and shard_map.splits != self.shard_map.splits:
+            rows = sorted(rows, key=lambda row: shard_map.key(self.tenant(row), self.document_id(row)))
+        for row in rows:
+            if skip is None or not skip(self.document_id(row)):
+                yield self.document(row)
+
+    def document_mask(self, filters: Optional[Dict[str, Any]], start: int = 0,
+                      end: int = None) -> Optional[np.ndarray]:
+        """Which documents of rows start to end match search filters, or None when the filters match all"""
+        end = self.document_count if end is None else end
+        if not filters:
+            return None
+        mask = None
+
+        def narrow(rows: np.ndarray):
+            nonlocal mask
+            mask = rows if mask is None else mask & rows
+
+        for field, column in (("file_type", self.file_types), ("uploaded_by", self.uploaded_by)):
+            value = filters.get(field)
+            if value:
+                names = self.strings["file_types" if field == "file_type" else field]
+                wanted = set(_values(value))
+                narrow(np.isin(column[start:end], [code for code, name in enumerate(names) if name in wanted]))
+
+        value = filters.get("document_id")
+        if value:
+            rows = np.zeros(end - start, dtype=bool)
+            for document_id in _values(value):
+                row = self.find_document(document_id)
+                if row is not None and start <= row < end:
+                    rows[row - start] = True
+            narrow(rows)
+
+        for tag_id in filters.get("tags") or []:
+            if tag_id not in self._tag_rows:
+                self._tag_rows[tag_id] = np.asarray(self.tags.get(tag_id, []), dtype=np.int64)
+            tagged = self._tag_rows[tag_id]
+            rows = np.zeros(end - start, dtype=bool)
+            rows[tagged[np.searchsorted(tagged, start):np.searchsorted(tagged, end)] - start] = True
+            narrow(rows)
+
+        uploaded_after = _to_timestamp(filters.get("uploaded_after"))
+        if uploaded_after is not None:
+            narrow(self.uploaded_at[start:end] >= uploaded_after)
+        uploaded_before = _to_timestamp(filters.get("uploaded_before"))
+        if uploaded_before is not None:
+            narrow(self.uploaded_at[start:end] <= uploaded_before)
+        return mask
+
+    def _ranges(self, filters: Dict[str, Any]) -> List[Tuple[int, int]]:
+        """
+        Row ranges a search must scan: the documents it is limited to, else
+        the shards of the tenants it is limited to, else everything. The
+        filters used up here are removed.
+        """
+        document_ids = filters.pop("document_id", None)
+        if document_ids:
+            rows = sorted({row for row in map(self.find_document, _values(document_ids)) if row is not None})
+            return [(row, row + 1) for row in rows]
+        tenants = filters.pop("uploaded_by", None)
+        if tenants:
+            return sorted(self.tenants[tenant] for tenant in set(_values(tenants)) if tenant in self.tenants)
+        return [(0, self.document_count)]
+
+    def _pieces(self, ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        """
+        Cut row ranges at shard boundaries into pieces of about an even
+        share of the search threads, but no smaller than
+        SHARD_MIN_SEARCH_CHUNKS.
+        """
+        starts = self.document_starts
+        total = sum(int(starts[end] - starts[start]) for start, end in ranges)
+        target = max(settings.SHARD_MIN_SEARCH_CHUNKS, -(-total // max(1, settings.SHARD_SEARCH_THREADS)))
+        pieces = []
+        for start, end in ranges:
+            boundaries = self._shard_starts[(self._shard_starts > start) & (self._shard_starts < end)]
+            count = int(starts[end] - starts[start]) // target
+            if count and len(boundaries):
+                # The first shard boundary after each multiple of the target
+                reached = starts[boundaries] - starts[start]
+                indexes = np.searchsorted(reached, np.arange(1, count + 1) * target)
+                cuts = np.unique(boundaries[indexes[indexes < len(boundaries)]])
+                for cut in cuts:
+                    pieces.append((start, int(cut)))
+                    start = int(cut)
+            pieces.append((start, end))
+        return pieces
+
+    def _search_range(self, start: int, end: int, query: np.ndarray, limit: int, filters: Dict[str, Any],
+                      hidden: Optional[np.ndarray]) -> List[Tuple[float, int]]:
+        """The nearest chunks of rows start to end, as (distance, chunk) pairs"""
+        first, last = int(self.document_starts[start]), int(self.document_starts[end])
+        mask = self.document_mask(filters, start, end)
+        if hidden is not None and hidden[start:end].any():
+            visible = ~hidden[start:end]
+            mask = visible if mask is None else mask & visible
+        chunk_mask = None if mask is None else np.repeat(mask, self.lengths[start:end])
+        if chunk_mask is not None and chunk_mask.sum() * 4 < len(chunk_mask):
+            # Few matches: copying them out is cheaper than scanning the range
+            chunks = first + np.flatnonzero(chunk_mask)
+            embeddings, squared_norms = self.embeddings[chunks], self.squared_norms[chunks]
+        else:
+            chunks = None
+            embeddings, squared_norms = self.embeddings[first:last], self.squared_norms[first:last]
+        if len(squared_norms) == 0:
+            return []
+        distances = _squared_distances(embeddings, squared_norms, query)
+        if chunks is None and chunk_mask is not None:
+            distances[~chunk_mask] = np.inf
+        return [
+            (float(distances[i]), int(first + i if chunks is None else chunks[i]))
+            for i in _nearest(distances, limit) if distances[i] != np.inf
+        ]
+
+    def search(self, query_embedding: np.ndarray, limit: int, filters: Dict[str, Any] = None,
+               hidden: np.ndarray = None) -> List[Dict[str, Any]]:
+        """
+        Find the chunks nearest to a query embedding by exact squared L2
+        distance, skipping documents that are hidden or do not match the
+        filters.
+
+        A search limited to one tenant scans only that tenant's shards. The
+        rows to scan are split at shard boundaries and searched
+        concurrently, and the nearest chunks of every piece are merged.
+        """
+        if limit <= 0 or self.chunk_count == 0:
+            return []
+        filters = dict(filters or {})
+        pieces = self._pieces(self._ranges(filters))
+        query = np.asarray(query_embedding, dtype=np.float32)
+        found = _fan_out(lambda piece: self._search_range(*piece, query, limit, filters, hidden), pieces)
+
+        results = []
+        for distance, chunk in heapq.nsmallest(limit, itertools.chain.from_iterable(found)):
+            row = int(self.chunk_documents[chunk])
+            results.append(_chunk_result(
+                self.document_id(row), self.metadata(row), chunk - int(self.document_starts[row]),
+                self.text(chunk), distance
+            ))
+        return results
+
+    def document_chunks(self, document_id: str) -> tuple:
+        """Get a document's chunk texts and embeddings in chunk order"""
+        row = self.find_document(document_id)
+        if row is None:
+            return [], None
+        _, _, texts, embeddings = self.document(row)
+        return texts, np.asarray(embeddings, dtype=float)
+
+
+def encode_log_record(op: str, document_id: str, metadata: Dict[str, Any] = None, texts: List[str] = None,
+                      embeddings: np.ndarray = None) -> bytes:
+    """Encode one append log operation ("add", "delete" or "metadata")"""
+    payload = b""
+    header = {"op": op, "id": document_id, "metadata": metadata, "texts": texts}
+    if embeddings is not None:
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        header["shape"] = list(embeddings.shape)
+        payload = embeddings.tobytes()
+    encoded = json.dumps(header).encode("utf-8")
+    return LOG_RECORD.pack(len(encoded), len(payload)) + encoded + payload
+
+
+class _Change:
+    """A document written or deleted since the snapshot; texts is None for a deletion"""
+
+    def __init__(self, sequence: int, metadata: Dict[str, Any] = None, texts: List[str] = None,
+                 embeddings: np.ndarray = None):
+        self.sequence = sequence
+        self.metadata = metadata
+        self.texts = texts
+        self.embeddings = embeddings
+
+
+class SnapshotIndex:
+    """
+    Searchable copy of one index version: a memory-mapped snapshot plus the
+    documents changed since, kept in memory and in an append log.
+
+    Opening replays the small log on top of the snapshot, so a restarted
+    server searches at once without rehydrating the vector database.
+    Changed documents hide their rows in the snapshot. merge() writes both
+    into the next snapshot and starts a new log; changes made while it
+    runs are kept for the snapshot after.
+
+    A read-only index follows a snapshot and log written by another
+    process, such as a generation published by the shared index writer;
+    catch_up() applies what was appended since.
+    """
+
+    def __init__(self, directory: str, version: Dict[str, Any] = None, read_only: bool = False):
+        """
+        Args:
+            directory: Directory of this version's snapshot and append log
+            version: Registry entry of the index version, read from the
+                snapshot if not given
+            read_only: Follow the snapshot and log instead of owning them
+        """
+        self.directory = directory
+        self.version = version
+        self.read_only = read_only
+        self.path = os.path.join(directory, SNAPSHOT_FILE)
+        self.log_path = os.path.join(directory, LOG_FILE)
+        self.merging_log_path = f"{self.log_path}.merging"
+        if not read_only:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.RLock()
+        self._merge_lock = threading.Lock()
+        self._changes: Dict[str, _Change] = {}
+        # Metadata updates made before there is a snapshot to apply them to,
+        # applied by the merge that builds the first one
+        self._patches: Dict[str, _Change] = {}
+        self._sequence = 0
+        self._delta = None
+        self.snapshot: Optional[Snapshot] = None
+        self._hidden: Optional[np.ndarray] = None
+        self._log = None
+        self._log_offset = 0
+
+        if read_only:
+            # Nothing to rebuild from here, so an unreadable snapshot is an error
+            self.snapshot = Snapshot(self.path)
+            self.version = version or self.snapshot.version
+            self._log_offset = self._replay(self.log_path, truncate=False)
+        else:
+            if os.path.exists(self.path):
+                try:
+                    self.snapshot = Snapshot(self.path)
+                except Exception as e:
+                    print(f"Ignoring unreadable vector index snapshot {self.path}: {e}")
+            for path in (self.merging_log_path, self.log_path):
+                self._replay(path)
+            self._log = open(self.log_path, "ab")
+        self._reset_hidden()
+
+    @property
+    def ready(self) -> bool:
+        """Whether searches can be served, i.e. a snapshot exists"""
+        return self.snapshot is not None
+
+    @property
+    def log_size(self) -> int:
+        return self._log.tell() if self._log is not None else self._log_offset
+
+    @property
+    def changed_documents(self) -> int:
+        """Documents added, updated or deleted since the snapshot"""
+        return len(self._changes)
+
+    @property
+    def chunk_count(self) -> int:
+        with self._lock:
+            snapshot = self.snapshot
+            hidden = 0
+            if snapshot is not None and self._hidden is not None and self._hidden.any():
+                hidden = int(snapshot.lengths[self._hidden].sum())
+            changed = sum(len(change.texts) for change in self._changes.values() if change.texts is not None)
+            return (snapshot.chunk_count if snapshot else 0) - hidden + changed
+
+    def _replay(self, path: str, offset: int = 0, truncate: bool = True) -> int:
+        """Apply the complete records of a log from offset on, returning the offset after the last one"""
+        try:
+            file = open(path, "rb")
+        except FileNotFoundError:
+            return offset
+        with file:
+            file.seek(offset)
+            valid = offset
+            while True:
+                head = file.read(LOG_RECORD.size)
+                if len(head) < LOG_RECORD.size:
+                    break
+                header_length, payload_length = LOG_RECORD.unpack(head)
+                header = file.read(header_length)
+                payload = file.read(payload_length)
+                if len(header) < header_length or len(payload) < payload_length:
+                    break
+                record = json.loads(header)
+                embeddings = None
+                if payload_length:
+                    embeddings = np.frombuffer(payload, dtype=np.float32).reshape(record["shape"])
+                self._apply(record["op"], record["id"], record.get("metadata"), record.get("texts"), embeddings)
+                valid = file.tell()
+        # Drop a record cut short by a crash; one being followed may still be written
+        if truncate and valid < os.path.getsize(path):
+            with open(path, "r+b") as file:
+                file.truncate(valid)
+        return valid
+
+    def catch_up(self):
+        """Apply the records another process appended to the log since the last call (read-only indexes)"""
+        with self._lock:
+            self._log_offset = self._replay(self.log_path, self._log_offset, truncate=False)
+
+    def _apply(self, op: str, document_id: str, metadata: Dict[str, Any] = None, texts: List[str] = None,
+               embeddings: np.ndarray = None):
+        self._sequence += 1
+        if op == "add":
+            self._changes[document_id] = _Change(self._sequence, metadata, texts, embeddings)
+        elif op == "delete":
+            self._changes[document_id] = _Change(self._sequence)
+        elif op == "metadata":
+            change = self._changes.get(document_id)
+            if change is None and self.snapshot is not None:
+                row = self.snapshot.find_document(document_id)
+                if row is not None:
+                    _, current, texts, embeddings = self.snapshot.document(row)
+                    change = _Change(self._sequence, current, texts, np.array(embeddings))
+            if change is None and self.snapshot is None:
+                patch = self._patches.setdefault(document_id, _Change(self._sequence, {}))
+                patch.sequence = self._sequence
+                patch.metadata.update(metadata)
+                return
+            if change is None or change.texts is None:
+                return
+            change.sequence = self._sequence
+            change.metadata = {**change.metadata, **metadata}
+            self._changes[document_id] = change
+        self._delta = None
+        if self._hidden is not None:
+            row = self.snapshot.find_document(document_id)
+            if row is not None:
+                self._hidden[row] = True
+
+    def _append(self, op: str, document_id: str, metadata: Dict[str, Any] = None, texts: List[str] = None,
+                embeddings: np.ndarray = None):
+        if self.read_only:
+            raise Exception("Cannot change a read-only snapshot index")
+        with self._lock:
+            if self._log.closed:
+                # The version stopped serving; its snapshot is rebuilt if it serves again
+                return
+            if embeddings is not None:
+                embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+            self._log.write(encode_log_record(op, document_id, metadata, texts, embeddings))
+            self._log.flush()
+            os.fsync(self._log.fileno())
+            self._apply(op, document_id, metadata, texts, embeddings)
+
+    def add_document(self, document_id: str, texts: List[str], embeddings: np.ndarray, metadata: Dict[str, Any]):
+        self._append("add", document_id, metadata, list(texts), embeddings)
+
+    def update_metadata(self, document_id: str, fields: Dict[str, Any]):
+        self._append("metadata", document_id, fields)
+
+    def delete(self, document_ids: List[str]):
+        for document_id in document_ids:
+            self._append("delete", document_id)
+
+    def changes_since(self, sequence: int) -> Tuple[Optional[Snapshot], int, List[SnapshotDocument]]:
+        """
+        Get what changed on top of the snapshot after a change sequence number.
+
+        Returns:
+            The snapshot, the sequence number of the latest change and the
+            documents changed after sequence, with None texts for deletions
+        """
+        with self._lock:
+            return self.snapshot, self._sequence, [
+                (document_id, change.metadata, change.texts, change.embeddings)
+                for document_id, change in self._changes.items() if change.sequence > sequence
+            ]
+
+    def _reset_hidden(self):
+        snapshot = self.snapshot
+        if snapshot is None:
+            self._hidden = None
+            return
+        hidden = np.zeros(snapshot.document_count, dtype=bool)
+        for document_id in self._changes:
+            row = snapshot.find_document(document_id)
+            if row is not None:
+                hidden[row] = True
+        self._hidden = hidden
+
+    def _delta_index(self):
+        """Changed documents stacked into one matrix, rebuilt after each change"""
+        with self._lock:
+            if self._delta is None:
+                documents = [(document_id, change) for document_id, change in self._changes.items()
+                             if change.texts]
+                if documents:
+                    embeddings = np.vstack([change.embeddings for _, change in documents]).astype(np.float32)
+                    starts = np.cumsum([0] + [len(change.texts) for _, change in documents])
+                    self._delta = (documents, starts, embeddings, np.einsum("ij,ij->i", embeddings, embeddings))
+                else:
+                    self._delta = ([], np.zeros(1, dtype=np.int64), None, None)
+            return self._delta
+
+    def search(self, query_embedding: np.ndarray, limit: int, filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        with self._lock:
+            snapshot, hidden = self.snapshot, self._hidden
+            hidden = None if hidden is None or not hidden.any() else hidden.copy()
+        results = snapshot.search(query_embedding, limit, filters, hidden) if snapshot is not None else []
+
+        documents, starts, embeddings, squared_norms = self._delta_index()
+        if documents:
+            query = np.asarray(query_embedding, dtype=np.float32)
+            document_mask = np.array([matches_filters(document_id, change.metadata, filters)
+                                      for document_id, change in documents])
+            chunks = np.flatnonzero(np.repeat(document_mask, np.diff(starts)))
+            distances = _squared_distances(embeddings[chunks], squared_norms[chunks], query)
+            for i in _nearest(distances, limit):
+                chunk = int(chunks[i])
+                document = int(np.searchsorted(starts, chunk, side="right")) - 1
+                document_id, change = documents[document]
+                chunk_index = chunk - int(starts[document])
+                results.append(_chunk_result(document_id, change.metadata, chunk_index,
+                                             change.texts[chunk_index], distances[i]))
+        return heapq.nsmallest(limit, results, key=lambda result: result["similarity_score"])
+
+    def document_chunks(self, document_id: str) -> tuple:
+        with self._lock:
+            change = self._changes.get(document_id)
+            snapshot = self.snapshot
+        if change is not None:
+            if change.texts is None:
+                return [], None
+            return list(change.texts), np.asarray(change.embeddings, dtype=float)
+        if snapshot is None:
+            return [], None
+        return snapshot.document_chunks(document_id)
+
+    def _documents(self, base: Iterator[SnapshotDocument], changes: Dict[str, _Change],
+                   patches: Dict[str, _Change], shard_map: ShardMap) -> Iterator[SnapshotDocument]:
+        """The base documents with the changes applied, in shard order"""
+        kept = (
+            (document_id, {**metadata, **patches[document_id].metadata}, texts, embeddings)
+            if document_id in patches else (document_id, metadata, texts, embeddings)
+            for document_id, metadata, texts, embeddings in base if document_id not in changes
+        )
+        changed = sorted(
+            ((document_id, change.metadata, change.texts, change.embeddings)
+             for document_id, change in changes.items() if change.texts),
+            key=shard_map.document_key
+        )
+        return heapq.merge(kept, changed, key=shard_map.document_key)
+
+    def _write(self, path: str, snapshot: Optional[Snapshot], changes: Dict[str, _Change],
+               patches: Dict[str, _Change] = None,
+               exported: Tuple[ShardMap, Iterator[SnapshotDocument]] = None) -> str:
+        """Write a snapshot, or documents exported from the collection, with changes applied to path"""
+        if exported is not None:
+            shard_map, base = exported
+        else:
+            # Re-planned from the current tenant sizes, so growing tenants are split
+            tenant_chunks = snapshot.tenant_chunks() if snapshot is not None else {}
+            for change in changes.values():
+                if change.texts:
+                    tenant = change.metadata.get("uploaded_by", "")
+                    tenant_chunks[tenant] = tenant_chunks.get(tenant, 0) + len(change.texts)
+            shard_map = ShardMap.plan(tenant_chunks)
+            base = snapshot.iter_documents(changes.__contains__, shard_map) if snapshot is not None else iter(())
+        documents = self._documents(base, changes, patches or {}, shard_map)
+        return write_snapshot(path, self.version, documents, shard_map)
+
+    def export(self, path: str) -> str:
+        """Write the snapshot with the current changes applied to another file, e.g. for shared serving"""
+        with self._lock:
+            snapshot, changes = self.snapshot, dict(self._changes)
+        return self._write(path, snapshot, changes)
+
+    def merge(self, exported: Tuple[ShardMap, Iterator[SnapshotDocument]] = None) -> Snapshot:
+        """
+        Write the next snapshot and start a new append log.
+
+        Args:
+            exported: Shard map and documents to start from instead of the
+                current snapshot (see export_collection), e.g. when no
+                snapshot exists yet
+
+        Returns:
+            The new snapshot
+        """
+        if self.read_only:
+            raise Exception("Cannot merge a read-only snapshot index")
+        with self._merge_lock:
+            with self._lock:
+                sequence = self._sequence
+                changes = dict(self._changes)
+                patches = dict(self._patches)
+                snapshot = self.snapshot
+                # Changes from here on go to a new log. A log left over by a
+                # failed merge is extended instead, so nothing is lost
+                self._log.close()
+                if os.path.exists(self.merging_log_path):
+                    with open(self.merging_log_path, "ab") as merging, open(self.log_path, "rb") as log:
+                        shutil.copyfileobj(log, merging)
+                    os.remove(self.log_path)
+                else:
+                    os.replace(self.log_path, self.merging_log_path)
+                self._log = open(self.log_path, "ab")
+
+            self._write(self.path, snapshot, changes, patches, exported)
+            merged = Snapshot(self.path)
+
+            with self._lock:
+                self.snapshot = merged
+                self._changes = {
+                    document_id: change for document_id, change in self._changes.items() if change.sequence > sequence
+                }
+                patches = {
+                    document_id: patch for document_id, patch in self._patches.items() if patch.sequence > sequence
+                }
+                self._patches = {}
+                self._delta = None
+                self._reset_hidden()
+                # Updates that came in while the first snapshot was written
+                for document_id, patch in patches.items():
+                    self._apply("metadata", document_id, patch.metadata)
+            os.remove(self.merging_log_path)
+            return merged
+
+    def discard(self):
+        """Stop serving the snapshot, e.g. when it failed its checksum, until merge() builds a new one"""
+        with self._lock:
+            self.snapshot = None
+            self._hidden = None
+
+    def close(self):
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
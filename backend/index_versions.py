@@ -0,0 +1,261 @@
+import os
+import json
+import time
+import datetime
+import threading
+from typing import Dict, Any, List
+import numpy as np
+from config import settings
+from document_processor import DocumentProcessor
+from vector_store import add_chunks, build_chunk_metadata
+
+
+class Reindexer:
+    """
+    Builds new versions of the vector index in the background while
+    searches keep using the active version.
+
+    A version is rebuilt from the stored text of every document with its
+    own chunking and embedding model. Embedding is throttled to a share of
+    one thread's time and progress is checkpointed, so an interrupted build
+    resumes where it stopped. Switching first indexes documents uploaded
+    (and drops documents deleted) since the build, then flips searches over
+    in one step; the previous version is kept for rollback.
+    """
+
+    def __init__(self, vector_store, document_store, content_store, cpu_share: float = None,
+                 batch_size: int = None, checkpoint_interval: int = None):
+        """
+        Args:
+            vector_store: VectorStore whose registry holds the versions
+            document_store: Source of the documents to index
+            content_store: Stored document text, also given each version's chunk spans
+            cpu_share: Fraction of wall time spent embedding, between 0 and 1
+            batch_size: Chunks embedded per batch
+            checkpoint_interval: Documents indexed between checkpoints
+        """
+        self.vector_store = vector_store
+        self.document_store = document_store
+        self.content_store = content_store
+        self.registry = vector_store.registry
+        self.cpu_share = min(1.0, cpu_share or settings.REINDEX_CPU_SHARE)
+        self.batch_size = batch_size or settings.REINDEX_BATCH_SIZE
+        self.checkpoint_interval = checkpoint_interval or settings.REINDEX_CHECKPOINT_INTERVAL
+        self._threads: Dict[str, threading.Thread] = {}
+        self._cancelled: Dict[str, threading.Event] = {}
+        self._switch_lock = threading.Lock()
+
+    def start(self, model_name: str = None, chunk_size: int = None, chunk_overlap: int = None) -> Dict[str, Any]:
+        """
+        Register a new index version and start building it. Settings not
+        given are taken from the active version.
+
+        Returns:
+            The registry entry of the new version
+        """
+        active = self.vector_store.version
+        chunk_size = chunk_size or active["chunk_size"]
+        chunk_overlap = active["chunk_overlap"] if chunk_overlap is None else chunk_overlap
+        if not 0 <= chunk_overlap < chunk_size:
+            raise ValueError("chunk_overlap must be smaller than chunk_size")
+
+        version = self.registry.create(model_name or active["model_name"], chunk_size, chunk_overlap)
+        self.vector_store.track(version["name"])
+        self._launch(version["name"])
+        return version
+
+    def resume(self, name: str = None) -> List[str]:
+        """
+        Continue a cancelled or failed build from its checkpoint or, without
+        a name, every build interrupted by a restart of the server.
+
+        Returns:
+            Names of the versions whose build was started
+        """
+        statuses = ("building", "cancelled", "failed") if name else ("building",)
+        started = []
+        for version in self.registry.versions():
+            if name and version["name"] != name:
+                continue
+            if version["status"] in statuses and version["name"] not in self._threads:
+                self.vector_store.track(version["name"])
+                self._launch(version["name"])
+                started.append(version["name"])
+        return started
+
+    def cancel(self, name: str) -> bool:
+        """Stop a running build after the current document; see resume"""
+        cancelled = self._cancelled.get(name)
+        if cancelled is None:
+            return False
+        cancelled.set()
+        return True
+
+    def _launch(self, name: str):
+        cancelled = threading.Event()
+        thread = threading.Thread(target=self._run, args=(name, cancelled), name=f"reindex-{name}", daemon=True)
+        self._cancelled[name] = cancelled
+        self._threads[name] = thread
+        thread.start()
+
+    def _run(self, name: str, cancelled: threading.Event):
+        try:
+            self.build(name, cancelled)
+        except Exception as e:
+            print(f"Re-indexing {name} failed: {e}")
+            self.registry.update(name, status="failed", error=str(e))
+        finally:
+            self._threads.pop(name, None)
+            self._cancelled.pop(name, None)
+
+    def build(self, name: str, cancelled: threading.Event = None):
+        """Index every document into a version, skipping those already checkpointed"""
+        version = self.registry.get(name)
+        collection = self.vector_store.open_collection(version)
+        model = self.vector_store.get_model(version["model_name"])
+        processor = DocumentProcessor(version["chunk_size"], version["chunk_overlap"])
+        self.registry.update(name, status="building", error=None)
+
+        done = self._load_checkpoint(name)
+        since_checkpoint = 0
+        for document in self.document_store.iter_documents():
+            if cancelled is not None and cancelled.is_set():
+                self._save_checkpoint(name, done)
+                self.registry.update(name, status="cancelled", documents=len(done))
+                return
+            if document["id"] in done:
+                continue
+
+            self._index_document(document, version, collection, model, processor)
+            done.add(document["id"])
+            since_checkpoint += 1
+            if since_checkpoint >= self.checkpoint_interval:
+                self._save_checkpoint(name, done)
+                self.registry.update(name, documents=len(done))
+                since_checkpoint = 0
+
+        self._save_checkpoint(name, done)
+        self.registry.update(name, status="ready", documents=len(done), built_at=datetime.datetime.now().isoformat())
+
+    def _index_document(self, document: Dict[str, Any], version: Dict[str, Any], collection, model,
+                        processor: DocumentProcessor) -> int:
+        document_id = document["id"]
+        text = self.content_store.get_text(document_id)
+        if text is None:
+            # Documents ingested before the content store existed only have their chunks
+            chunks, _ = self.vector_store.get_document_embeddings(document_id)
+            text = "\n".join(chunks)
+        else:
+            self.content_store.set_spans(document_id, version["span_name"], processor._create_chunk_spans(text))
+
+        chunks = processor._create_chunks(text)
+        # Drop whatever an interrupted run left, which may have more chunks
+        existing = collection.get(where={"document_id": document_id}, include=[])
+        if existing and existing["ids"]:
+            collection.delete(ids=existing["ids"])
+        if chunks:
+            add_chunks(collection, document_id, chunks, self._encode(model, chunks), build_chunk_metadata(document))
+        return len(chunks)
+
+    def _encode(self, model, chunks: List[str]) -> np.ndarray:
+        """Embed chunks in batches, sleeping between batches to stay within the CPU share"""
+        embeddings = []
+        for start in range(0, len(chunks), self.batch_size):
+            started_at = time.perf_counter()
+            embeddings.append(model.encode(chunks[start:start + self.batch_size]))
+            if self.cpu_share < 1:
+                busy = time.perf_counter() - started_at
+                time.sleep(busy * (1 / self.cpu_share - 1))
+        return np.vstack(embeddings)
+
+    def sync(self, name: str) -> Dict[str, int]:
+        """
+        Bring a version up to date with the document store: index documents
+        it is missing and remove documents deleted since it was built.
+
+        Returns:
+            Number of documents added and removed
+        """
+        version = self.registry.get(name)
+        collection = self.vector_store.open_collection(version)
+        model = self.vector_store.get_model(version["model_name"])
+        processor = DocumentProcessor(version["chunk_size"], version["chunk_overlap"])
+
+        # Chunk ids are "<document id>_<chunk index>"
+        indexed = {chunk_id.rsplit("_", 1)[0] for chunk_id in collection.get(include=[])["ids"]}
+        documents = {document["id"]: document for document in self.document_store.iter_documents()}
+
+        removed = indexed - documents.keys()
+        for document_id in removed:
+            collection.delete(where={"document_id": document_id})
+        added = documents.keys() - indexed
+        for document_id in added:
+            self._index_document(documents[document_id], version, collection, model, processor)
+        return {"added": len(added), "removed": len(removed)}
+
+    def switch(self, name: str) -> Dict[str, Any]:
+        """
+        Serve searches from a built version. Documents changed since the
+        build are applied first.
+
+        Returns:
+            The registry entry of the now active version, with the sync counts
+        """
+        with self._switch_lock:
+            version = self.registry.get(name)
+            if version is None:
+                raise ValueError(f"Unknown index version: {name}")
+            if version["status"] not in ("ready", "standby", "active"):
+                raise ValueError(f"Index version {name} is {version['status']}, not ready")
+            changes = self.sync(name)
+            self.vector_store.activate(name)
+            return {**self.vector_store.version, "synced": changes}
+
+    def rollback(self) -> Dict[str, Any]:
+        """Switch back to the version that was active before the last switch"""
+        previous = self.registry.previous
+        if previous is None:
+            raise ValueError("There is no previous index version to roll back to")
+        return self.switch(previous)
+
+    def drop(self, name: str):
+        """Delete a version that is not active, cancelling its build"""
+        if name == self.vector_store.version["name"]:
+            raise ValueError("The active index version cannot be dropped")
+        self.cancel(name)
+        thread = self._threads.get(name)
+        if thread is not None:
+            thread.join()
+        self.vector_store.drop_version(name)
+        try:
+            os.remove(self._checkpoint_path(name))
+        except FileNotFoundError:
+            pass
+
+    def status(self) -> Dict[str, Any]:
+        """Get every version with whether its build is running"""
+        return {
+            "active": self.registry.active,
+            "previous": self.registry.previous,
+            "versions": [
+                {**version, "running": version["name"] in self._threads}
+                for version in self.registry.versions()
+            ]
+        }
+
+    def _checkpoint_path(self, name: str) -> str:
+        return os.path.join(os.path.dirname(self.registry.path) or ".", f"reindex_{name}.checkpoint.json")
+
+    def _load_checkpoint(self, name: str) -> set:
+        try:
+            with open(self._checkpoint_path(name), "r", encoding="utf-8") as file:
+                return set(json.load(file))
+        except FileNotFoundError:
+            return set()
+
+    def _save_checkpoint(self, name: str, done: set):
+        path = self._checkpoint_path(name)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(sorted(done), file)
+        os.replace(temp_path, path)
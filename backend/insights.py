@@ -0,0 +1,332 @@
+import os
+import re
+import sqlite3
+import datetime
+import threading
+from typing import Dict, Any, List, Optional
+import numpy as np
+from sklearn.cluster import KMeans
+from sklearn.feature_extraction.text import CountVectorizer
+from config import settings
+
+TOKEN_PATTERN = re.compile(r"[A-Za-z][A-Za-z']*|[.!?]+")
+VOWEL_GROUPS = re.compile(r"[aeiouy]+")
+WORDS_PER_MINUTE = 238
+
+POSITIVE_WORDS = frozenset("""
+    achieve achieved advantage benefit benefits best better effective efficient excellent gain gains good
+    great growth improve improved improvement improves increase innovative opportunity opportunities
+    positive profit profitable progress strong stronger succeed success successful support valuable win
+""".split())
+NEGATIVE_WORDS = frozenset("""
+    bad challenge challenges concern concerns decline declined decrease difficult failure fail failed
+    problem problems risk risks loss losses negative poor weak weaker worse worst threat threats issue
+    issues delay delays error errors shortage
+""".split())
+
+
+def count_syllables(word: str) -> int:
+    """Estimate the syllables of a word from its vowel groups"""
+    word = word.lower()
+    if word.endswith("'s"):
+        word = word[:-2]
+    count = len(VOWEL_GROUPS.findall(word))
+    if word.endswith("e") and not word.endswith(("le", "ee")) and count > 1:
+        count -= 1
+    return max(1, count)
+
+
+def analyze_text(text: str) -> Dict[str, Any]:
+    """
+    Compute readability and sentiment in a single pass over the text.
+
+    Readability uses the Flesch reading ease and Flesch-Kincaid grade
+    formulas over word, sentence and syllable counts. Sentiment classifies
+    each sentence by its positive and negative lexicon words.
+
+    Returns:
+        Dict with "readability" and "sentiment_analysis" entries
+    """
+    words = syllables = 0
+    sentence_words = sentence_score = 0
+    sentences = {"positive": 0, "neutral": 0, "negative": 0}
+
+    def end_sentence():
+        label = "positive" if sentence_score > 0 else "negative" if sentence_score < 0 else "neutral"
+        sentences[label] += 1
+
+    for match in TOKEN_PATTERN.finditer(text):
+        token = match.group()
+        if token[0] in ".!?":
+            if sentence_words:
+                end_sentence()
+            sentence_words = sentence_score = 0
+            continue
+        word = token.lower()
+        words += 1
+        sentence_words += 1
+        syllables += count_syllables(word)
+        if word in POSITIVE_WORDS:
+            sentence_score += 1
+        elif word in NEGATIVE_WORDS:
+            sentence_score -= 1
+    if sentence_words:
+        end_sentence()
+
+    sentence_count = max(1, sum(sentences.values()))
+    words_per_sentence = words / sentence_count
+    syllables_per_word = syllables / words if words else 0.0
+    score = 206.835 - 1.015 * words_per_sentence - 84.6 * syllables_per_word
+    grade = 0.39 * words_per_sentence + 11.8 * syllables_per_word - 15.59
+    minutes = max(1, round(words / WORDS_PER_MINUTE))
+
+    breakdown = {label: round(count / sentence_count, 2) for label, count in sentences.items()}
+    overall = max(breakdown, key=breakdown.get)
+
+    return {
+        "readability": {
+            "score": round(min(100.0, max(0.0, score))),
+            "grade_level": _grade_label(grade),
+            "reading_time": f"{minutes} minute{'s' if minutes != 1 else ''}",
+            "complexity": "Simple" if score >= 70 else "Moderate" if score >= 50 else "Complex",
+            "word_count": words,
+            "sentence_count": sentence_count
+        },
+        "sentiment_analysis": {
+            "overall_sentiment": overall,
+            "confidence": breakdown[overall],
+            "sentiment_breakdown": breakdown
+        }
+    }
+
+
+def _grade_label(grade: float) -> str:
+    if grade <= 6:
+        return "Elementary"
+    if grade <= 8:
+        return "Middle School"
+    if grade <= 12:
+        return "High School"
+    if grade <= 16:
+        return "College"
+    return "Graduate"
+
+
+class CorpusIDF:
+    """
+    Chunk-level document frequencies of every term in the corpus, stored in
+    SQLite and updated incrementally as documents are added and removed.
+
+    Each document's contribution is kept so removing (or re-adding) a
+    document subtracts exactly what it added.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or settings.INSIGHTS_IDF_PATH
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS terms (
+                term TEXT PRIMARY KEY,
+                df INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS documents (
+                document_id TEXT PRIMARY KEY,
+                chunk_count INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS document_terms (
+                document_id TEXT NOT NULL,
+                term TEXT NOT NULL,
+                df INTEGER NOT NULL,
+                PRIMARY KEY (document_id, term)
+            );
+        """)
+
+    def add_document(self, document_id: str, terms: List[str], chunk_df: np.ndarray, chunk_count: int) -> np.ndarray:
+        """
+        Add a document's chunk frequencies to the corpus table.
+
+        Args:
+            document_id: Document the chunks belong to
+            terms: Vocabulary of the document
+            chunk_df: Number of the document's chunks containing each term
+            chunk_count: Number of chunks in the document
+
+        Returns:
+            The updated corpus IDF of each term, smoothed as in scikit-learn
+        """
+        rows = [(term, int(df)) for term, df in zip(terms, chunk_df)]
+        with self._lock:
+            self._remove(document_id)
+            self.conn.executemany(
+                "INSERT INTO terms VALUES (?, ?) ON CONFLICT(term) DO UPDATE SET df = df + excluded.df", rows
+            )
+            self.conn.executemany(
+                "INSERT INTO document_terms VALUES (?, ?, ?)", [(document_id, term, df) for term, df in rows]
+            )
+            self.conn.execute("INSERT INTO documents VALUES (?, ?)", (document_id, chunk_count))
+            self.conn.commit()
+            return self._idf(terms)
+
+    def remove_document(self, document_id: str):
+        """Subtract a document's contribution from the corpus table"""
+        with self._lock:
+            self._remove(document_id)
+            self.conn.commit()
+
+    def _remove(self, document_id: str):
+        rows = self.conn.execute(
+            "SELECT df, term FROM document_terms WHERE document_id = ?", (document_id,)
+        ).fetchall()
+        if rows:
+            self.conn.executemany("UPDATE terms SET df = df - ? WHERE term = ?", rows)
+            self.conn.executemany("DELETE FROM terms WHERE term = ? AND df <= 0", [(term,) for _, term in rows])
+            self.conn.execute("DELETE FROM document_terms WHERE document_id = ?", (document_id,))
+        self.conn.execute("DELETE FROM documents WHERE document_id = ?", (document_id,))
+
+    def _idf(self, terms: List[str]) -> np.ndarray:
+        total = self.conn.execute("SELECT COALESCE(SUM(chunk_count), 0) FROM documents").fetchone()[0]
+        frequencies = {}
+        # Stay under SQLite's bound parameter limit
+        for start in range(0, len(terms), 500):
+            batch = terms[start:start + 500]
+            frequencies.update(self.conn.execute(
+                f"SELECT term, df FROM terms WHERE term IN ({','.join('?' * len(batch))})", batch
+            ).fetchall())
+        df = np.array([frequencies.get(term, 0) for term in terms], dtype=float)
+        return np.log((1 + total) / (1 + df)) + 1
+
+
+class InsightsBuilder:
+    """
+    Computes document insights once at ingest and stores them with the
+    document, so the insights endpoint only reads them back.
+
+    Keywords are ranked by TF-IDF against the corpus IDF table, readability
+    and sentiment come from analyze_text, and topics are k-means clusters
+    of the chunk embeddings already in the vector store, named after their
+    highest scoring terms.
+    """
+
+    def __init__(self, vector_store, document_store, idf: CorpusIDF = None,
+                 keyword_count: int = None, topic_count: int = None):
+        """
+        Args:
+            vector_store: VectorStore holding the chunk embeddings
+            document_store: DocumentStore the insights are written to
+            idf: Corpus IDF table
+            keyword_count: Number of keywords kept
+            topic_count: Maximum number of topic clusters
+        """
+        self.vector_store = vector_store
+        self.document_store = document_store
+        self.idf = idf or CorpusIDF()
+        self.keyword_count = keyword_count or settings.INSIGHTS_KEYWORD_COUNT
+        self.topic_count = topic_count or settings.INSIGHTS_TOPIC_COUNT
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def schedule(self, document_id: str) -> bool:
+        """Mark a document as being built; False if a build is already pending"""
+        with self._lock:
+            if document_id in self._pending:
+                return False
+            self._pending.add(document_id)
+            return True
+
+    def build(self, document_id: str, text: Optional[str] = None, chunks: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        Compute and store the insights of a document.
+
+        Args:
+            document_id: The ID of the document
+            text: Full document text; the chunks joined if not given
+            chunks: Document chunks; read from the vector store if not given
+
+        Returns:
+            The stored insights
+        """
+        try:
+            stored_chunks, embeddings = self.vector_store.get_document_embeddings(document_id)
+            chunks = chunks or stored_chunks
+            insights = self.compute(document_id, text or "\n".join(chunks), chunks, embeddings)
+            self.document_store.update_document_insights(document_id, insights)
+            return insights
+        finally:
+            with self._lock:
+                self._pending.discard(document_id)
+
+    def compute(self, document_id: str, text: str, chunks: List[str],
+                embeddings: Optional[np.ndarray] = None) -> Dict[str, Any]:
+        """Compute the insights of a document without storing them"""
+        insights = analyze_text(text)
+        insights["keywords"] = []
+        insights["topic_modeling"] = {"main_topics": [], "topic_distribution": {}}
+
+        try:
+            vectorizer = CountVectorizer(stop_words="english", token_pattern=r"(?u)\b[a-zA-Z][a-zA-Z]+\b")
+            counts = vectorizer.fit_transform(chunks)
+        except ValueError:
+            # No chunks, or nothing but stop words
+            insights["generated_at"] = datetime.datetime.now().isoformat()
+            return insights
+
+        terms = vectorizer.get_feature_names_out().tolist()
+        chunk_df = np.asarray((counts > 0).sum(axis=0)).ravel()
+        idf = self.idf.add_document(document_id, terms, chunk_df, len(chunks))
+
+        insights["keywords"] = self._keywords(terms, np.asarray(counts.sum(axis=0)).ravel(), idf)
+        if embeddings is None or len(embeddings) != len(chunks):
+            # Without stored embeddings, cluster the chunks' TF-IDF vectors
+            embeddings = counts.multiply(idf).toarray()
+        insights["topic_modeling"] = self._topics(terms, counts, idf, np.asarray(embeddings, dtype=float))
+        insights["generated_at"] = datetime.datetime.now().isoformat()
+        return insights
+
+    def _keywords(self, terms: List[str], frequencies: np.ndarray, idf: np.ndarray) -> List[Dict[str, Any]]:
+        scores = (1 + np.log(np.maximum(frequencies, 1))) * idf
+        top = np.argsort(-scores)[:self.keyword_count]
+        best = scores[top[0]] if len(top) else 1.0
+        return [
+            {"word": terms[i], "frequency": int(frequencies[i]), "relevance": round(float(scores[i] / best), 2)}
+            for i in top
+        ]
+
+    def _topics(self, terms: List[str], counts, idf: np.ndarray, embeddings: np.ndarray) -> Dict[str, Any]:
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings = embeddings / np.where(norms == 0, 1.0, norms)
+        clusters = min(self.topic_count, len(embeddings))
+        if clusters > 1:
+            labels = KMeans(n_clusters=clusters, n_init=10, random_state=0).fit_predict(embeddings)
+        else:
+            labels = np.zeros(len(embeddings), dtype=int)
+
+        document_vector = embeddings.mean(axis=0)
+        document_vector /= np.linalg.norm(document_vector) or 1.0
+
+        topics = []
+        for label in np.unique(labels):
+            members = np.flatnonzero(labels == label)
+            weights = np.asarray(counts[members].sum(axis=0)).ravel() * idf
+            name = " ".join(terms[i] for i in np.argsort(-weights)[:2]).title()
+            centroid = embeddings[members].mean(axis=0)
+            centroid /= np.linalg.norm(centroid) or 1.0
+            topics.append({
+                "name": name,
+                "relevance": round(float(max(0.0, centroid @ document_vector)), 2),
+                "share": round(100 * len(members) / len(labels))
+            })
+
+        topics.sort(key=lambda topic: topic["relevance"], reverse=True)
+        distribution = {}
+        for topic in topics:
+            # Two clusters can share their top terms
+            name = topic["name"] if topic["name"] not in distribution else f"{topic['name']} ({len(distribution) + 1})"
+            topic["name"] = name
+            distribution[name] = topic.pop("share")
+        return {"main_topics": topics, "topic_distribution": distribution}
@@ -0,0 +1,230 @@
+import time
+import bisect
+import asyncio
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Tuple
+from config import settings
+
+# Upper bounds in seconds, from 1ms to 60s
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Stage timings of the request being handled: list of (stage, seconds)
+_request_stages: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar(
+    "request_stages", default=None
+)
+
+
+class Histogram:
+    """Cumulative-bucket histogram of durations, in the Prometheus layout"""
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+
+class MetricsRegistry:
+    """Histograms of stage and endpoint latencies and counters of stage errors"""
+
+    def __init__(self):
+        self.stages: Dict[str, Histogram] = {}
+        self.stage_errors: Dict[Tuple[str, str], int] = {}
+        self.requests: Dict[Tuple[str, str, str], Histogram] = {}
+        self._lock = threading.Lock()
+
+    def observe_stage(self, stage: str, seconds: float, error: Optional[BaseException] = None):
+        with self._lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = Histogram()
+            histogram.observe(seconds)
+            if error is not None:
+                key = (stage, type(error).__name__)
+                self.stage_errors[key] = self.stage_errors.get(key, 0) + 1
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float):
+        key = (method, route, str(status))
+        with self._lock:
+            histogram = self.requests.get(key)
+            if histogram is None:
+                histogram = self.requests[key] = Histogram()
+            histogram.observe(seconds)
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            lines += [
+                "# HELP app_stage_duration_seconds Time spent in each processing stage.",
+                "# TYPE app_stage_duration_seconds histogram",
+            ]
+            for stage, histogram in sorted(self.stages.items()):
+                lines += _render_histogram("app_stage_duration_seconds", {"stage": stage}, histogram)
+
+            lines += [
+                "# HELP app_stage_errors_total Exceptions raised in each processing stage.",
+                "# TYPE app_stage_errors_total counter",
+            ]
+            for (stage, error), count in sorted(self.stage_errors.items()):
+                lines.append(f"app_stage_errors_total{_labels({'stage': stage, 'error': error})} {count}")
+
+            lines += [
+                "# HELP app_request_duration_seconds Time to handle HTTP requests, until the response is sent.",
+                "# TYPE app_request_duration_seconds histogram",
+            ]
+            for (method, route, status), histogram in sorted(self.requests.items()):
+                labels = {"method": method, "route": route, "status": status}
+                lines += _render_histogram("app_request_duration_seconds", labels, histogram)
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _render_histogram(name: str, labels: Dict[str, str], histogram: Histogram) -> List[str]:
+    lines = []
+    cumulative = 0
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        lines.append(f"{name}_bucket{_labels({**labels, 'le': repr(bound)})} {cumulative}")
+    lines.append(f"{name}_bucket{_labels({**labels, 'le': '+Inf'})} {histogram.count}")
+    lines.append(f"{name}_sum{_labels(labels)} {histogram.sum}")
+    lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+    return lines
+
+
+metrics = MetricsRegistry()
+enabled = settings.METRICS_ENABLED
+
+
+@contextmanager
+def _timed_stage(name: str):
+    started_at = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        seconds = time.perf_counter() - started_at
+        metrics.observe_stage(name, seconds, error)
+        stages = _request_stages.get()
+        if stages is not None:
+            stages.append((name, seconds))
+
+
+class _NoopStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NOOP_STAGE = _NoopStage()
+
+
+def stage(name: str):
+    """
+    Time a block as a processing stage:
+
+        with stage("vector_store.encode"):
+            embeddings = model.encode(chunks)
+
+    Returns a shared no-op context manager when metrics are disabled.
+    """
+    if not enabled:
+        return _NOOP_STAGE
+    return _timed_stage(name)
+
+
+def timed(name: str):
+    """Decorator timing every call of a function, sync or async, as a stage"""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not enabled:
+                    return await func(*args, **kwargs)
+                with _timed_stage(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            with _timed_stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def server_timing(stages: List[Tuple[str, float]], total: float) -> str:
+    """Format stage timings as a Server-Timing header, summing repeated stages"""
+    durations: Dict[str, float] = {}
+    for name, seconds in stages:
+        durations[name] = durations.get(name, 0.0) + seconds
+    entries = [f"{name.replace('.', '-')};dur={seconds * 1000:.1f}" for name, seconds in durations.items()]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+class InstrumentationMiddleware:
+    """
+    ASGI middleware recording the latency of every request by route
+    template and adding a Server-Timing header with the time spent in each
+    stage before the response started.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not enabled:
+            await self.app(scope, receive, send)
+            return
+
+        stages: List[Tuple[str, float]] = []
+        token = _request_stages.set(stages)
+        started_at = time.perf_counter()
+        finished_at = None
+        status = 500
+
+        async def timed_send(message):
+            nonlocal status, finished_at
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                header = server_timing(stages, time.perf_counter() - started_at)
+                message = {**message, "headers": [*message.get("headers", []), (b"server-timing", header.encode())]}
+            await send(message)
+            # Background tasks run after the last body message and are not counted
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                finished_at = time.perf_counter()
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            _request_stages.reset(token)
+            route = scope.get("route")
+            metrics.observe_request(
+                scope["method"],
+                getattr(route, "path", "unmatched"),
+                status,
+                (finished_at or time.perf_counter()) - started_at
+            )
@@ -0,0 +1,269 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, Any, Optional, Callable, Awaitable
+from config import settings
+from tokens import count_tokens
+
+# Hits whose last access time is held in memory before being written
+ACCESS_BATCH_SIZE = 256
+
+
+def hash_text(text: str) -> str:
+    """SHA-256 hex digest of a text, used as a content fingerprint"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """
+    Content-addressed cache for LLM responses.
+
+    Entries are keyed by (model, prompt template, input hash, params), so
+    the same request against the same content is answered from disk. The
+    cache is stored in SQLite, bounded in size with least-recently-used
+    eviction, and tracks the latency and tokens each hit saves. Access
+    times of hits are written in batches, so a hit costs a single read.
+    The cache size is summed in SQL inside each write, so workers sharing
+    one database file all evict against the same total.
+    """
+
+    def __init__(self, path: str = None, max_bytes: int = None):
+        """
+        Open (or create) the cache database.
+
+        Args:
+            path: SQLite file to store the cache in
+            max_bytes: Total size of cached responses before eviction kicks in
+        """
+        self.path = path or settings.LLM_CACHE_PATH
+        self.max_bytes = max_bytes if max_bytes is not None else settings.LLM_CACHE_MAX_BYTES
+        self._lock = threading.Lock()
+        # Last access times of hits not yet written, by key
+        self._accessed: Dict[str, float] = {}
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                document_id TEXT,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                latency REAL NOT NULL,
+                tokens INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS entries_document ON entries (document_id);
+            CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access);
+            CREATE TABLE IF NOT EXISTS document_versions (
+                document_id TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL
+            );
+        """)
+
+        self.hits = 0
+        self.misses = 0
+        self.latency_saved = 0.0
+        self.tokens_saved = 0
+        self.call_latency = 0.0
+
+    @staticmethod
+    def make_key(model: str, template: str, text: str, params: Dict[str, Any] = None) -> str:
+        """
+        Build the cache key for a request.
+
+        Args:
+            model: Model name
+            template: Prompt template the input is inserted into
+            text: Input text
+            params: Generation parameters that change the output
+
+        Returns:
+            Hex digest identifying the request
+        """
+        payload = json.dumps({
+            "model": model,
+            "template": hash_text(template),
+            "input": hash_text(text),
+            "params": params or {}
+        }, sort_keys=True, default=str)
+        return hash_text(payload)
+
+    def get(self, key: str) -> Optional[str]:
+        """Get a cached response, or None on a miss"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT value, latency, tokens FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._accessed[key] = time.time()
+            if len(self._accessed) >= ACCESS_BATCH_SIZE:
+                self._write_accesses()
+                self.conn.commit()
+            self.hits += 1
+            self.latency_saved += row[1]
+            self.tokens_saved += row[2]
+            return row[0]
+
+    def put(self, key: str, value: str, latency: float = 0.0, tokens: int = 0, document_id: str = None):
+        """
+        Store a response and evict the least recently used entries if the
+        cache grew past its size limit.
+        """
+        size = len(value.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            # The insert takes SQLite's write lock, so the total read by
+            # _evict cannot change under it until the commit
+            self.conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, document_id, value, size, latency, tokens, now, now)
+            )
+            self._accessed.pop(key, None)
+            self._write_accesses()
+            self._evict()
+            self.conn.commit()
+
+    def _write_accesses(self):
+        self.conn.executemany(
+            "UPDATE entries SET last_access = ? WHERE key = ?",
+            [(accessed_at, key) for key, accessed_at in self._accessed.items()]
+        )
+        self._accessed = {}
+
+    def _evict(self):
+        # Evict down to 90% of the limit so every put does not trigger eviction
+        total = self._size()
+        if total <= self.max_bytes:
+            return
+        target = self.max_bytes * 0.9
+        rows = self.conn.execute("SELECT key, size FROM entries ORDER BY last_access").fetchall()
+        evicted = []
+        for key, size in rows:
+            if total <= target:
+                break
+            evicted.append((key,))
+            total -= size
+        self.conn.executemany("DELETE FROM entries WHERE key = ?", evicted)
+
+    def _size(self) -> int:
+        return self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def get_or_generate(self, model: str, template: str, text: str, params: Dict[str, Any],
+                        generate: Callable[[], str], document_id: str = None) -> str:
+        """
+        Return the cached response for a request, calling generate() and
+        caching its result on a miss.
+
+        Args:
+            model: Model name
+            template: Prompt template the input is inserted into
+            text: Input text
+            params: Generation parameters that change the output
+            generate: Function performing the actual LLM call
+            document_id: Document the input came from, for invalidation
+
+        Returns:
+            The response text
+        """
+        key = self.make_key(model, template, text, params)
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+
+        start = time.perf_counter()
+        value = generate()
+        latency = time.perf_counter() - start
+        self.record(key, value, latency, template, text, document_id)
+        return value
+
+    async def aget_or_generate(self, model: str, template: str, text: str, params: Dict[str, Any],
+                               generate: Callable[[], Awaitable[str]], document_id: str = None) -> str:
+        """
+        Async variant of get_or_generate for coroutine-based LLM calls. The
+        database is read and written in a worker thread, off the event loop.
+        """
+        key = self.make_key(model, template, text, params)
+        cached = await asyncio.to_thread(self.get, key)
+        if cached is not None:
+            return cached
+
+        start = time.perf_counter()
+        value = await generate()
+        latency = time.perf_counter() - start
+        await asyncio.to_thread(self.record, key, value, latency, template, text, document_id)
+        return value
+
+    def record(self, key: str, value: str, latency: float, template: str, text: str, document_id: str = None):
+        """
+        Cache the result of an LLM call made outside get_or_generate, such as
+        a streamed response, counting its latency and tokens like a miss.
+
+        Args:
+            key: Cache key from make_key
+            value: The complete response text
+            latency: Seconds the call took
+            template: Prompt template the input was inserted into
+            text: Input text
+            document_id: Document the input came from, for invalidation
+        """
+        tokens = count_tokens(template) + count_tokens(text) + count_tokens(value)
+        with self._lock:
+            self.call_latency += latency
+        self.put(key, value, latency=latency, tokens=tokens, document_id=document_id)
+
+    def sync_document(self, document_id: str, content_hash: str):
+        """
+        Record the current content hash of a document, dropping its cached
+        responses if the content changed since they were generated.
+        """
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT content_hash FROM document_versions WHERE document_id = ?", (document_id,)
+            ).fetchone()
+            if row and row[0] == content_hash:
+                return
+            if row:
+                self._delete_document_entries(document_id)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO document_versions VALUES (?, ?)", (document_id, content_hash)
+            )
+            self.conn.commit()
+
+    def invalidate_document(self, document_id: str):
+        """Drop every cached response generated from a document"""
+        with self._lock:
+            self._delete_document_entries(document_id)
+            self.conn.execute("DELETE FROM document_versions WHERE document_id = ?", (document_id,))
+            self.conn.commit()
+
+    def _delete_document_entries(self, document_id: str):
+        self.conn.execute("DELETE FROM entries WHERE document_id = ?", (document_id,))
+
+    def stats(self) -> Dict[str, Any]:
+        """Get hit/miss counters and the latency and tokens saved by hits"""
+        with self._lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "size_bytes": self._size(),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "llm_call_seconds": round(self.call_latency, 3),
+                "latency_saved_seconds": round(self.latency_saved, 3),
+                "tokens_saved": self.tokens_saved
+            }
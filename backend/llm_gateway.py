@@ -0,0 +1,370 @@
+import json
+import time
+import random
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, Any, AsyncIterator
+import httpx
+from openai import AsyncOpenAI
+from config import settings
+from instrumentation import timed
+from llm_cache import hash_text
+from local_llm import local_completion
+from tokens import count_tokens
+
+try:
+    import h2  # noqa: F401  HTTP/2 support for httpx
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """Check whether an LLM client error is a rate limit (HTTP 429) response"""
+    if "RateLimit" in type(error).__name__:
+        return True
+    return getattr(error, "status_code", None) == 429 or getattr(error, "http_status", None) == 429
+
+
+class TokenRateLimiter:
+    """
+    Token bucket limiting how many prompt tokens are sent per minute.
+
+    The bucket starts full and refills continuously, so short bursts up to
+    the per-minute budget go out immediately and sustained load is paced.
+    """
+
+    def __init__(self, tokens_per_minute: int):
+        self.capacity = float(tokens_per_minute)
+        self.rate = tokens_per_minute / 60.0
+        self.available = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens: int):
+        """Wait until the bucket holds enough tokens for a request, then take them"""
+        if self.capacity <= 0:
+            return
+        # A single request larger than the bucket would otherwise never fit
+        tokens = min(tokens, self.capacity)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.available = min(self.capacity, self.available + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.available >= tokens:
+                    self.available -= tokens
+                    return
+                await asyncio.sleep((tokens - self.available) / self.rate)
+
+
+class ModelMetrics:
+    """Counters and timings of the calls made to one model"""
+
+    def __init__(self):
+        self.requests = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.retries = 0
+        self.in_flight = 0
+        self.queued = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.queue_seconds = 0.0
+        self.max_queue_seconds = 0.0
+        self.latency_seconds = 0.0
+        self.max_latency_seconds = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        completed = self.requests - self.in_flight - self.queued
+        return {
+            "requests": self.requests,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "retries": self.retries,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "avg_queue_ms": round(self.queue_seconds / completed * 1000, 2) if completed else 0.0,
+            "max_queue_ms": round(self.max_queue_seconds * 1000, 2),
+            "avg_latency_ms": round(self.latency_seconds / completed * 1000, 2) if completed else 0.0,
+            "max_latency_ms": round(self.max_latency_seconds * 1000, 2)
+        }
+
+
+class ModelLimiter:
+    """Concurrency cap and token bucket shared by every call to one model"""
+
+    def __init__(self, max_concurrency: int, tokens_per_minute: int):
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.rate_limiter = TokenRateLimiter(tokens_per_minute)
+        self.metrics = ModelMetrics()
+
+
+class LLMGateway:
+    """
+    Shared async client for every LLM call the backend makes.
+
+    All calls go through one pooled HTTP/2 connection pool. Each model has
+    its own concurrency cap and prompt token budget, rate limit errors are
+    retried with backoff, and identical completions already in flight are
+    merged into a single upstream call. Per-model latency and queueing
+    metrics are kept for the admin API.
+
+    Point OPENAI_API_BASE at the fake server in local_llm.py to exercise it
+    offline; with LLM_PROVIDER set to "local" no HTTP calls are made at all.
+    """
+
+    def __init__(self, api_key: str = None, base_url: str = None, local: bool = None,
+                 model_limits: Dict[str, Dict[str, int]] = None):
+        """
+        Args:
+            api_key: OpenAI API key
+            base_url: Base URL of an OpenAI-compatible API
+            local: Answer with local_completion instead of calling the API
+            model_limits: Per-model overrides of max_concurrency and tokens_per_minute
+        """
+        self.local = local if local is not None else settings.LLM_PROVIDER == "local"
+        self.model_limits = model_limits if model_limits is not None else settings.LLM_MODEL_LIMITS
+        self.max_retries = settings.LLM_MAX_RETRIES
+        self._limiters: Dict[str, ModelLimiter] = {}
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._waiters: Dict[str, int] = {}
+
+        self.http_client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            timeout=httpx.Timeout(settings.LLM_REQUEST_TIMEOUT, connect=10.0),
+            limits=httpx.Limits(
+                max_connections=settings.LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.LLM_MAX_CONNECTIONS
+            )
+        )
+        self.client = AsyncOpenAI(
+            api_key=api_key or settings.OPENAI_API_KEY or "local",
+            base_url=base_url or settings.OPENAI_API_BASE,
+            http_client=self.http_client,
+            max_retries=0  # Retries are handled here, under the model's limits
+        )
+
+    def model(self, name: str, **defaults) -> "GatewayModel":
+        """Get a LangChain-style handle (apredict/astream) bound to a model and default params"""
+        return GatewayModel(self, name, **defaults)
+
+    def _limiter(self, model: str) -> ModelLimiter:
+        limiter = self._limiters.get(model)
+        if limiter is None:
+            limits = self.model_limits.get(model, {})
+            limiter = ModelLimiter(
+                limits.get("max_concurrency", settings.LLM_MAX_CONCURRENCY),
+                limits.get("tokens_per_minute", settings.LLM_TOKENS_PER_MINUTE)
+            )
+            self._limiters[model] = limiter
+        return limiter
+
+    async def complete(self, prompt: str, model: str = None, **params) -> str:
+        """
+        Get a chat completion for a prompt.
+
+        Identical requests (same model, prompt and params) made while one is
+        already in flight wait for that call instead of making their own. The
+        upstream call is cancelled once every caller waiting on it has been.
+
+        Args:
+            prompt: Prompt sent as the user message
+            model: Model name, defaults to LLM_COMPLETION_MODEL
+            params: Extra request parameters such as max_tokens or temperature
+
+        Returns:
+            The completion text
+        """
+        model = model or settings.LLM_COMPLETION_MODEL
+        key = hash_text(json.dumps([model, prompt, params], sort_keys=True, default=str))
+
+        future = self._in_flight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._complete(model, prompt, params))
+            self._in_flight[key] = future
+            future.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self._limiter(model).metrics.coalesced += 1
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            # Shielded so one caller going away does not cancel the call for the others
+            return await asyncio.shield(future)
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+                if not future.done():
+                    self._forget(key, future)
+                    future.cancel()
+
+    def _forget(self, key: str, future: asyncio.Future):
+        # A cancelled call may still be finishing when a new one starts for the same key
+        if self._in_flight.get(key) is future:
+            del self._in_flight[key]
+
+    async def _complete(self, model: str, prompt: str, params: Dict[str, Any]) -> str:
+        limiter = self._limiter(model)
+        metrics = limiter.metrics
+        prompt_tokens = count_tokens(prompt, model)
+        metrics.requests += 1
+        attempt = 0
+        while True:
+            async with self._slot(limiter, prompt_tokens):
+                started_at = time.perf_counter()
+                metrics.in_flight += 1
+                try:
+                    text = await self._request(model, prompt, params)
+                except Exception as e:
+                    if not is_rate_limit_error(e) or attempt >= self.max_retries:
+                        metrics.errors += 1
+                        raise
+                    metrics.retries += 1
+                else:
+                    metrics.prompt_tokens += prompt_tokens
+                    metrics.completion_tokens += count_tokens(text, model)
+                    self._record_latency(metrics, time.perf_counter() - started_at)
+                    return text
+                finally:
+                    metrics.in_flight -= 1
+            # Exponential backoff with jitter, outside the semaphore so other calls proceed
+            delay = settings.LLM_RETRY_BASE_DELAY * (2 ** attempt)
+            await asyncio.sleep(delay + random.uniform(0, delay))
+            attempt += 1
+
+    @timed("llm.request")
+    async def _request(self, model: str, prompt: str, params: Dict[str, Any]) -> str:
+        if self.local:
+            return local_completion(prompt)
+        response = await self.client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            **params
+        )
+        return (response.choices[0].message.content or "").strip()
+
+    async def stream(self, prompt: str, model: str = None, **params) -> AsyncIterator[str]:
+        """
+        Stream a chat completion as it is generated. Streams hold one of the
+        model's concurrency slots until they finish and are never coalesced.
+        """
+        model = model or settings.LLM_COMPLETION_MODEL
+        limiter = self._limiter(model)
+        metrics = limiter.metrics
+        prompt_tokens = count_tokens(prompt, model)
+        metrics.requests += 1
+        async with self._slot(limiter, prompt_tokens):
+            started_at = time.perf_counter()
+            metrics.in_flight += 1
+            pieces = []
+            try:
+                if self.local:
+                    pieces.append(local_completion(prompt))
+                    yield pieces[0]
+                else:
+                    response = await self.client.chat.completions.create(
+                        model=model,
+                        messages=[{"role": "user", "content": prompt}],
+                        stream=True,
+                        **params
+                    )
+                    async for chunk in response:
+                        piece = chunk.choices[0].delta.content if chunk.choices else None
+                        if piece:
+                            pieces.append(piece)
+                            yield piece
+            except Exception:
+                metrics.errors += 1
+                raise
+            finally:
+                metrics.in_flight -= 1
+            metrics.prompt_tokens += prompt_tokens
+            metrics.completion_tokens += count_tokens("".join(pieces), model)
+            self._record_latency(metrics, time.perf_counter() - started_at)
+
+    async def generate_image(self, prompt: str, size: str = "512x512") -> str:
+        """Generate an image for a prompt and return its URL"""
+        if self.local:
+            raise Exception("Image generation is not available with the local LLM provider")
+        limiter = self._limiter(settings.LLM_IMAGE_MODEL)
+        metrics = limiter.metrics
+        metrics.requests += 1
+        async with self._slot(limiter):
+            started_at = time.perf_counter()
+            metrics.in_flight += 1
+            try:
+                response = await self.client.images.generate(
+                    model=settings.LLM_IMAGE_MODEL, prompt=prompt, n=1, size=size
+                )
+            except Exception:
+                metrics.errors += 1
+                raise
+            finally:
+                metrics.in_flight -= 1
+        self._record_latency(metrics, time.perf_counter() - started_at)
+        return response.data[0].url
+
+    @asynccontextmanager
+    async def _slot(self, limiter: ModelLimiter, prompt_tokens: int = 0):
+        """
+        Hold one of the model's concurrency slots once its token budget
+        allows the prompt. The call counts as queued until then, and stops
+        counting if it is cancelled while it waits.
+        """
+        metrics = limiter.metrics
+        metrics.queued += 1
+        queued_at = time.perf_counter()
+        try:
+            async with limiter.semaphore:
+                if prompt_tokens:
+                    await limiter.rate_limiter.acquire(prompt_tokens)
+                self._record_queue(metrics, time.perf_counter() - queued_at)
+                queued_at = None
+                yield
+        finally:
+            if queued_at is not None:
+                metrics.queued -= 1
+
+    @staticmethod
+    def _record_queue(metrics: ModelMetrics, seconds: float):
+        metrics.queued -= 1
+        metrics.queue_seconds += seconds
+        metrics.max_queue_seconds = max(metrics.max_queue_seconds, seconds)
+
+    @staticmethod
+    def _record_latency(metrics: ModelMetrics, seconds: float):
+        metrics.latency_seconds += seconds
+        metrics.max_latency_seconds = max(metrics.max_latency_seconds, seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        """Get per-model request, coalescing, queueing and latency metrics"""
+        return {
+            "http2": HTTP2_AVAILABLE,
+            "unique_in_flight": len(self._in_flight),
+            "models": {model: limiter.metrics.to_dict() for model, limiter in self._limiters.items()}
+        }
+
+    async def aclose(self):
+        """Close the pooled HTTP connections"""
+        await self.http_client.aclose()
+
+
+class GatewayModel:
+    """
+    A model of the gateway exposed with the apredict/astream interface the
+    summarization engine and question answering call.
+    """
+
+    def __init__(self, gateway: LLMGateway, model_name: str, **defaults):
+        self.gateway = gateway
+        self.model_name = model_name
+        self.defaults = defaults
+
+    async def apredict(self, prompt: str, **params) -> str:
+        return await self.gateway.complete(prompt, self.model_name, **{**self.defaults, **params})
+
+    async def astream(self, prompt: str, **params) -> AsyncIterator[str]:
+        async for piece in self.gateway.stream(prompt, self.model_name, **{**self.defaults, **params}):
+            yield piece
@@ -0,0 +1,158 @@
+import re
+
+SENTENCE_PATTERN = re.compile(r"[^.!?\n]+[.!?]?")
+LIST_HINTS = ("bullet", "key points", "as a list", "main points", "slide")
+
+
+def local_completion(prompt: str, max_sentences: int = 5) -> str:
+    """
+    Deterministic stand-in for an LLM completion.
+
+    Picks the input text out of the prompt (everything after the last
+    "Text:" or ":" line) and returns its leading sentences, formatted as a
+    list when the prompt asks for one. The output depends only on the
+    prompt, so it is stable across runs and safe to cache.
+    """
+    text = prompt
+    marker = prompt.rfind("Text:")
+    if marker != -1:
+        text = prompt[marker + len("Text:"):]
+    elif "\n" in prompt:
+        text = prompt.split("\n", 1)[1]
+
+    sentences = [s.strip() for s in SENTENCE_PATTERN.findall(text) if len(s.strip()) > 1]
+    sentences = [s for s in sentences if not s.endswith(":")][:max_sentences]
+    if not sentences:
+        return ""
+
+    if any(hint in prompt.lower() for hint in LIST_HINTS):
+        return "\n".join(f"- {sentence}" for sentence in sentences)
+    return " ".join(sentences)
+
+
+def serve(host: str = "127.0.0.1", port: int = 8089, latency: float = 0.0, rate_limit_every: int = 0):
+    """
+    Run a fake OpenAI-compatible API answering with local_completion.
+
+    Point OPENAI_API_BASE at http://host:port/v1 to exercise the real client
+    code paths offline.
+
+    Args:
+        host: Interface to listen on
+        port: Port to listen on
+        latency: Seconds to wait before answering each request
+        rate_limit_every: If set, answer every Nth request with HTTP 429
+    """
+    import json
+    import time
+    import itertools
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    counter = itertools.count(1)
+    counter_lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            with counter_lock:
+                request_number = next(counter)
+
+            if rate_limit_every and request_number % rate_limit_every == 0:
+                self._send(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}})
+                return
+            if latency:
+                time.sleep(latency)
+
+            model = body.get("model", "local")
+            if self.path.endswith("/images/generations"):
+                self._send(200, {
+                    "created": int(time.time()),
+                    "data": [{"url": f"http://{host}:{port}/images/local-{request_number}.png"}]
+                })
+                return
+            if self.path.endswith("/chat/completions"):
+                prompt = "\n".join(m.get("content", "") for m in body.get("messages", []))
+                text = local_completion(prompt)
+                choice = {"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}
+                kind = "chat.completion"
+            elif self.path.endswith("/completions"):
+                prompt = body.get("prompt", "")
+                text = local_completion(prompt if isinstance(prompt, str) else "\n".join(prompt))
+                choice = {"index": 0, "text": text, "finish_reason": "stop"}
+                kind = "text_completion"
+            else:
+                self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+                return
+
+            if body.get("stream"):
+                self._stream(request_number, model, text)
+                return
+
+            prompt_tokens = max(1, len(prompt) // 4)
+            completion_tokens = max(1, len(text) // 4)
+            self._send(200, {
+                "id": f"local-{request_number}",
+                "object": kind,
+                "created": int(time.time()),
+                "model": model,
+                "choices": [choice],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens
+                }
+            })
+
+        def _stream(self, request_number: int, model: str, text: str):
+            # Server-sent events in the chat.completion.chunk format, one word per chunk
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            words = text.split(" ")
+            for i, word in enumerate(words):
+                piece = word if i == 0 else " " + word
+                self._send_event(request_number, model, {"content": piece}, None)
+            self._send_event(request_number, model, {}, "stop")
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+
+        def _send_event(self, request_number: int, model: str, delta: dict, finish_reason):
+            chunk = {
+                "id": f"local-{request_number}",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+
+        def _send(self, status: int, payload: dict):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    print(f"Local LLM server listening on http://{host}:{port}/v1")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to wait per request")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="answer every Nth request with 429")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.latency, args.rate_limit_every)
@@ -1,23 +1,36 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Form, Body, Request
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Form, Body, Request, Response, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 from typing import List, Optional, Dict
 import os
-import shutil
 import uuid
 import tempfile
 from pydantic import BaseModel
 from dotenv import load_dotenv
+import asyncio
 import datetime
+import json
 import random
-from gtts import gTTS
-import openai
 
 # Import our modules
 from document_processor import DocumentProcessor
-from vector_store import VectorStore
-from document_store import DocumentStore
+from vector_store import VectorStore, build_chunk_metadata, DEFAULT_VERSION
+from document_store import DocumentStore, encode_cursor, content_fingerprint, text_fingerprint
+from content_store import ContentStore
+from blob_store import LocalBlobStore
+from index_versions import Reindexer
+from shared_index import SharedVectorStore, WriterProxy
+from uploads import UploadSizeLimitMiddleware, inspect_upload
+from instrumentation import InstrumentationMiddleware, metrics
 from summarizer import DocumentSummarizer
+from summary_tree import SummaryTreeStore, SummaryTreeBuilder
+from question_answering import DocumentQA
+from insights import InsightsBuilder
+from narration import Narrator
+from stats_store import StatsStore
+from llm_cache import LLMCache, hash_text
+from llm_gateway import LLMGateway
+from tokens import count_tokens, split_by_tokens
 from config import settings
 
 # Load environment variables
@@ -26,15 +39,16 @@ load_dotenv()
 # Determine whether to use mock services
 USE_MOCK_SERVICES = True  # Set this to False when ready to use real Firebase and ChromaDB
 
-# Add OpenAI API key for GPT-based features
-openai.api_key = os.getenv("OPENAI_API_KEY")
-
 app = FastAPI(
     title="AI Document Search API",
     description="API for AI-powered document search and retrieval",
     version="1.0.0"
 )
 
+# Reject oversized uploads while the body is received (inside CORS so the
+# 413 response still carries CORS headers)
+app.add_middleware(UploadSizeLimitMiddleware)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -42,16 +56,34 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
+# Outermost, so request latencies include the other middleware
+app.add_middleware(InstrumentationMiddleware)
+
 # Initialize our core services
-document_processor = DocumentProcessor()
-vector_store = VectorStore(use_mock=False)
+# Workers forked by serve.py share one memory-mapped index and send changes
+# to the index writer process, which also runs re-indexing and compaction
+shared_index = settings.VECTOR_STORE_MODE == "shared"
+vector_store = SharedVectorStore() if shared_index else VectorStore(use_mock=False)
+# Uploads are chunked the way the active index version was built
+document_processor = DocumentProcessor(vector_store.version["chunk_size"], vector_store.version["chunk_overlap"])
 document_store = DocumentStore(use_mock=False)
-summarizer = DocumentSummarizer()
-
-# Create temporary directory for file uploads
-os.makedirs("temp", exist_ok=True)
+content_store = ContentStore()
+stats_store = StatsStore(use_mock=False)
+llm_cache = LLMCache()
+llm_gateway = LLMGateway()
+summarizer = DocumentSummarizer(cache=llm_cache, gateway=llm_gateway)
+summary_tree_store = SummaryTreeStore()
+summary_tree_builder = SummaryTreeBuilder(summarizer, summary_tree_store)
+document_qa = DocumentQA(vector_store, summarizer, content_store=content_store)
+insights_builder = InsightsBuilder(vector_store, document_store)
+if shared_index:
+    reindexer = WriterProxy(vector_store.writer, "reindexer")
+else:
+    reindexer = Reindexer(vector_store, document_store, content_store)
+narrator = Narrator()
 
 # Pydantic models for API
 class DocumentResponse(BaseModel):
@@ -69,10 +101,26 @@ class SearchResponse(BaseModel):
     snippet: str
     similarity_score: float
 
+class SearchFilters(BaseModel):
+    file_type: Optional[List[str]] = None
+    uploaded_by: Optional[str] = None
+    tags: Optional[List[str]] = None
+    uploaded_after: Optional[datetime.datetime] = None
+    uploaded_before: Optional[datetime.datetime] = None
+
+class IndexVersionCreate(BaseModel):
+    model_name: Optional[str] = None
+    chunk_size: Optional[int] = None
+    chunk_overlap: Optional[int] = None
+
+class BulkDeleteRequest(BaseModel):
+    document_ids: List[str]
+
 class SummaryResponse(BaseModel):
     summary: str
     document_id: str
     title: str
+    engine: Optional[str] = None
 
 # Tag-related models
 class Tag(BaseModel):
@@ -101,13 +149,118 @@ mock_tags = [
 # Mock document-tag relationships
 mock_document_tags = []  # List of (document_id, tag_id) tuples
 
+def _get_document_tag_ids(document_id: str) -> List[str]:
+    """Get the IDs of the tags currently attached to a document"""
+    return [tag_id for doc_id, tag_id in mock_document_tags if doc_id == document_id]
+
+def _set_next_cursor(response: Response, documents: List[Dict], limit: int):
+    """Expose the cursor for the next page when the current page is full"""
+    if documents and len(documents) >= limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(documents[-1])
+
+def _stream_documents_ndjson(user_id: Optional[str] = None):
+    """Yield every document as one JSON line, a page at a time"""
+    for doc in document_store.iter_documents(user_id=user_id):
+        yield json.dumps(doc, default=str) + "\n"
+
+KEY_POINTS_PROMPT = "Extract key points from the following document:\n{content}"
+SLIDES_PROMPT = "Create slide content for the following document:\n{content}"
+
+def _fit_content(template: str, content: str, model: str) -> str:
+    """Cut a document's content down to the prompt budget (SUMMARY_CONTEXT_TOKENS), keeping its best sentences"""
+    budget = settings.SUMMARY_CONTEXT_TOKENS - count_tokens(template, model)
+    if count_tokens(content, model) <= budget:
+        return content
+    # Text without a sentence short enough to keep is cut on token boundaries
+    return summarizer.extractive.shrink(content, budget) or split_by_tokens(content, budget, model)[0]
+
+async def _cached_completion(document_id: str, template: str, content: str, max_tokens: int) -> str:
+    """Run a completion over a document's content through the response cache and the LLM gateway"""
+    model = "local" if llm_gateway.local else settings.LLM_COMPLETION_MODEL
+    
+    async def generate() -> str:
+        fitted = await asyncio.to_thread(_fit_content, template, content, model)
+        return await llm_gateway.complete(template.format(content=fitted), model, max_tokens=max_tokens)
+    
+    return await llm_cache.aget_or_generate(
+        model=model,
+        template=template,
+        text=content,
+        params={"max_tokens": max_tokens},
+        generate=generate,
+        document_id=document_id
+    )
+
 # Admin user IDs - in a real app, this would be in a database
 ADMIN_USER_IDS = ["admin", "testuser"]
 
+async def _reconcile_stats_periodically():
+    """Periodically rebuild the stats counters to correct any drift"""
+    while True:
+        delay = settings.STATS_RECONCILE_INTERVAL
+        try:
+            # Counters reconciled shortly before a restart are not rescanned
+            due = await asyncio.to_thread(stats_store.seconds_until_reconcile, delay)
+            if due > 0:
+                delay = due
+            else:
+                await asyncio.to_thread(stats_store.reconcile, document_store, vector_store)
+        except Exception as e:
+            print(f"Stats reconciliation failed: {e}")
+        await asyncio.sleep(delay)
+
+@app.on_event("startup")
+async def start_stats_reconciliation():
+    if settings.STATS_RECONCILE_INTERVAL > 0 and not shared_index:
+        asyncio.create_task(_reconcile_stats_periodically())
+
+async def _compact_index_periodically():
+    while True:
+        try:
+            # Keep going while full batches are found
+            while await asyncio.to_thread(vector_store.compact) == settings.COMPACTION_BATCH_SIZE:
+                pass
+            await asyncio.to_thread(vector_store.merge_snapshot)
+        except Exception as e:
+            print(f"Index compaction failed: {e}")
+        await asyncio.sleep(settings.COMPACTION_INTERVAL)
+
+@app.on_event("startup")
+async def start_index_compaction():
+    if settings.COMPACTION_INTERVAL > 0 and not shared_index:
+        asyncio.create_task(_compact_index_periodically())
+
+@app.on_event("startup")
+async def resume_reindexing():
+    if not shared_index:
+        reindexer.resume()
+
+@app.on_event("shutdown")
+async def close_llm_gateway():
+    await llm_gateway.aclose()
+
+@app.post("/admin/stats/reconcile")
+async def admin_reconcile_stats():
+    """
+    Admin endpoint to rebuild the statistics counters from scratch
+    """
+    try:
+        stats = await asyncio.to_thread(stats_store.reconcile, document_store, vector_store)
+        return {"status": "success", "reconciled_at": stats["reconciled_at"]}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to AI Document Search API"}
 
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Stage and endpoint latency histograms in the Prometheus text format
+    """
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/tags", response_model=List[TagResponse])
 async def get_tags():
     """
@@ -183,11 +336,17 @@ async def add_tags_to_document(document_id: str, tag_ids: List[str] = Body(...))
         
         # In a real implementation, save to database
         # For now, add to mock document tags
+        previous_tag_ids = _get_document_tag_ids(document_id)
         for tag_id in tag_ids:
             # Only add if not already associated
             if (document_id, tag_id) not in mock_document_tags:
                 mock_document_tags.append((document_id, tag_id))
         
+        # Keep the tag flags denormalized into the chunks in sync for filtered search
+        current_tag_ids = _get_document_tag_ids(document_id)
+        document_store.update_document_tags(document_id, current_tag_ids)
+        vector_store.update_document_tags(document_id, current_tag_ids, previous_tag_ids)
+        
         return {"status": "success"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -211,7 +370,12 @@ async def remove_tag_from_document(document_id: str, tag_id: str):
         # In a real implementation, remove from database
         # For now, remove from mock document tags
         if (document_id, tag_id) in mock_document_tags:
+            previous_tag_ids = _get_document_tag_ids(document_id)
             mock_document_tags.remove((document_id, tag_id))
+            
+            current_tag_ids = _get_document_tag_ids(document_id)
+            document_store.update_document_tags(document_id, current_tag_ids)
+            vector_store.update_document_tags(document_id, current_tag_ids, previous_tag_ids)
         
         return {"status": "success"}
     except Exception as e:
@@ -250,71 +414,153 @@ async def get_documents_by_tag(tag_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _find_indexed_source(fingerprint: str) -> tuple:
+    """
+    Find a document with the given content fingerprint whose chunks are
+    still indexed.
+    
+    Returns:
+        (source document, its chunks, their embeddings), or (None, [], None)
+    """
+    source = document_store.find_by_fingerprint(fingerprint)
+    if source is None:
+        return None, [], None
+    chunks, embeddings = vector_store.get_document_embeddings(source['id'])
+    if not chunks:
+        return None, [], None
+    return source, chunks, embeddings
+
+def _copy_derived_data(source: Dict, document_id: str, background_tasks: BackgroundTasks):
+    """Give a deduplicated upload the stored text, summary tree and insights of its source"""
+    content_store.copy(source['id'], document_id)
+    text = content_store.get_text(document_id)
+    
+    tree = summary_tree_store.get(source['id'])
+    if tree is not None:
+        summary_tree_store.save(document_id, tree)
+    elif text is not None:
+        # Map calls over the same text are answered from the LLM cache
+        background_tasks.add_task(summary_tree_builder.build, document_id, text)
+    
+    if source.get('insights'):
+        document_store.update_document_insights(document_id, source['insights'])
+    elif insights_builder.schedule(document_id):
+        background_tasks.add_task(insights_builder.build, document_id, text)
+
 @app.post("/upload", response_model=DocumentResponse)
-async def upload_document(file: UploadFile = File(...), title: str = Form(...)):
+async def upload_document(background_tasks: BackgroundTasks, file: UploadFile = File(...), title: str = Form(...)):
     """
     Upload a document for processing and indexing
     """
     try:
-        # Check file type
-        file_extension = os.path.splitext(file.filename)[1].lower()
-        if file_extension not in ['.pdf', '.docx', '.txt']:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Unsupported file type: {file_extension}. Supported types are: .pdf, .docx, .txt"
-            )
+        # Enforce the size limit, hash and sniff the type in one pass over the
+        # spooled upload, which the parsers then read directly
+        upload = await asyncio.to_thread(inspect_upload, file.file, file.filename)
         
-        # Save file to temporary location
-        temp_file_path = f"temp/{str(uuid.uuid4())}{file_extension}"
-        with open(temp_file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        # A file uploaded before is not processed again: the new document
+        # references its stored file and reuses its chunks and embeddings
+        source, chunks, embeddings = await asyncio.to_thread(
+            _find_indexed_source, content_fingerprint(upload.sha256)
+        )
+        same_file = source is not None
+        processed_data = None
+        text_hash = source.get('textHash') if same_file else None
         
-        # Process document to extract text and metadata
-        try:
-            processed_data = document_processor.process_file(temp_file_path)
-            
-            # Store document in Firebase
-            document_id = document_store.store_document(
-                file_path=temp_file_path,
-                title=title,
-                metadata=processed_data['metadata'],
-                user_id="demo_user"
+        if not same_file:
+            # Process document to extract text and metadata
+            processed_data = await asyncio.to_thread(
+                document_processor.process_stream, upload.file, upload.file_type, upload.size
             )
+            chunks = processed_data['chunks']
+            if settings.DEDUP_TEXT_FINGERPRINT:
+                text_hash = text_fingerprint(processed_data['text'])
+                source, source_chunks, embeddings = await asyncio.to_thread(_find_indexed_source, text_hash)
+                if source is not None:
+                    chunks = source_chunks
+        
+        # Store document in Firebase
+        doc_metadata = await document_store.store_document(
+            file_path=None,
+            file_obj=upload.file,
+            metadata={
+                **(processed_data['metadata'] if processed_data else {"file_type": upload.file_type, "file_size": upload.size}),
+                "title": title,
+                "filename": file.filename,
+                "chunk_count": len(chunks),
+                "index_version": vector_store.version["name"],
+                "content_hash": upload.sha256,
+                "text_hash": text_hash
+            },
+            user_id="demo_user",
+            source=source if same_file else None
+        )
+        document_id = doc_metadata['id']
+        
+        # Add document to vector store for search, with the filterable
+        # document fields denormalized into every chunk (embeddings are
+        # only computed when not reused). Encoding and the store writes
+        # run in worker threads so other requests are not held up
+        await asyncio.to_thread(
+            vector_store.add_document,
+            document_id=document_id,
+            text_chunks=chunks,
+            metadata=build_chunk_metadata(doc_metadata),
+            embeddings=embeddings
+        )
+        await asyncio.to_thread(stats_store.record_document_added, doc_metadata, chunk_count=len(chunks))
+        
+        if source is not None:
+            await asyncio.to_thread(_copy_derived_data, source, document_id, background_tasks)
+        else:
+            # Keep the extracted text once, compressed, with its chunk and page offsets
+            await asyncio.to_thread(content_store.put, document_id, processed_data['text'], {
+                vector_store.version["span_name"]: processed_data['chunk_spans'],
+                "pages": processed_data['page_spans']
+            })
             
-            # Add document to vector store for search
-            vector_store.add_document(
-                document_id=document_id,
-                chunks=processed_data['chunks'],
-                metadata=processed_data['metadata']
-            )
+            # Drops cached LLM responses if this document's content changed
+            await asyncio.to_thread(llm_cache.sync_document, document_id, hash_text(processed_data['text']))
             
-            # Get document metadata
-            doc_metadata = document_store.get_document(document_id)
+            # Build the chunk/section/document summary tree after responding,
+            # so summary requests only need a cheap final pass
+            background_tasks.add_task(summary_tree_builder.build, document_id, processed_data['text'])
             
-            return DocumentResponse(
-                id=document_id,
-                title=title,
-                file_url=doc_metadata.get('fileUrl', ''),
-                file_type=doc_metadata.get('fileType', ''),
-                uploaded_at=str(doc_metadata.get('uploadedAt', '')),
-                uploaded_by="demo_user"
-            )
-        finally:
-            # Clean up temporary file
-            if os.path.exists(temp_file_path):
-                os.remove(temp_file_path)
-                
+            # Compute keywords, readability and topics once, so /insights is a read
+            if insights_builder.schedule(document_id):
+                background_tasks.add_task(
+                    insights_builder.build, document_id, processed_data['text'], processed_data['chunks']
+                )
+        
+        return DocumentResponse(
+            id=document_id,
+            title=title,
+            file_url=doc_metadata.get('fileUrl', ''),
+            file_type=doc_metadata.get('fileType', upload.file_type),
+            uploaded_at=str(doc_metadata.get('uploadedAt', '')),
+            uploaded_by="demo_user"
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/search", response_model=List[SearchResponse])
-async def search_documents(query: str = Body(..., embed=True), limit: int = Body(5, embed=True)):
+async def search_documents(
+    query: str = Body(..., embed=True),
+    limit: int = Body(5, embed=True),
+    filters: Optional[SearchFilters] = Body(None, embed=True)
+):
     """
-    Search documents using natural language query
+    Search documents using natural language query, optionally scoped by
+    file type, owner, tags and upload date
     """
     try:
-        # Search in vector store
-        search_results = vector_store.search(query=query, limit=limit)
+        # Search in vector store; filters are pushed down into the index
+        search_results = vector_store.search(
+            query=query,
+            limit=limit,
+            filters=filters.dict(exclude_none=True) if filters else None
+        )
         
         # Format results
         formatted_results = []
@@ -328,7 +574,7 @@ async def search_documents(query: str = Body(..., embed=True), limit: int = Body
                     document_id=doc_id,
                     title=doc_metadata.get('title', 'Untitled Document'),
                     file_type=doc_metadata.get('fileType', 'unknown'),
-                    snippet=result['content'][:200] + "...",
+                    snippet=result['chunk_text'][:200] + "...",
                     similarity_score=result['similarity_score']
                 ))
         
@@ -337,13 +583,15 @@ async def search_documents(query: str = Body(..., embed=True), limit: int = Body
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/documents", response_model=List[DocumentResponse])
-async def get_documents(limit: int = Query(50)):
+async def get_documents(response: Response, limit: int = Query(50, ge=1, le=500), cursor: Optional[str] = Query(None)):
     """
-    Get a list of documents
+    Get a page of documents, newest first. When more documents exist the
+    cursor for the next page is returned in the X-Next-Cursor header.
     """
     try:
         # Get documents from document store
-        documents = document_store.get_documents(user_id="demo_user", limit=limit)
+        documents = document_store.get_documents(user_id="demo_user", limit=limit, cursor=cursor)
+        _set_next_cursor(response, documents, limit)
         
         # Format results
         return [
@@ -357,9 +605,29 @@ async def get_documents(limit: int = Query(50)):
             )
             for doc in documents
         ]
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/blobs/{key:path}")
+async def get_blob(key: str):
+    """
+    Serve a file of the local blob store
+    """
+    blob_store = getattr(document_store, "blob_store", None)
+    path = blob_store.key_path(key) if isinstance(blob_store, LocalBlobStore) else None
+    if path is None or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="File not found")
+    return FileResponse(path)
+
+@app.get("/documents/export")
+async def export_documents():
+    """
+    Stream all of the user's documents as newline-delimited JSON
+    """
+    return StreamingResponse(_stream_documents_ndjson(user_id="demo_user"), media_type="application/x-ndjson")
+
 @app.get("/documents/{document_id}")
 async def get_document(document_id: str):
     """
@@ -377,9 +645,18 @@ async def get_document(document_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/documents/{document_id}/summary", response_model=SummaryResponse)
-async def get_document_summary(document_id: str, summary_type: str = Query("general"), max_tokens: int = Query(500)):
+async def get_document_summary(
+    document_id: str,
+    summary_type: str = Query("general"),
+    max_tokens: int = Query(500),
+    engine: str = Query("auto", pattern="^(extractive|llm|auto)$")
+):
     """
-    Generate a summary for a specific document
+    Generate a summary for a specific document.
+    
+    engine selects how: "extractive" picks sentences locally in milliseconds,
+    "llm" uses the language model, and "auto" uses the LLM summary tree once
+    it has been built and the extractive summary until then.
     """
     try:
         # Get document from document store
@@ -388,36 +665,119 @@ async def get_document_summary(document_id: str, summary_type: str = Query("gene
         if not document:
             raise HTTPException(status_code=404, detail="Document not found")
         
-        # Get document chunks from vector store
-        results = vector_store.collection.get(
-            where={"document_id": document_id}
-        )
-        
-        if not results["documents"]:
-            raise HTTPException(status_code=404, detail="Document content not found in vector store")
-        
-        # Sort chunks by chunk index
-        sorted_chunks = []
-        for i, metadata in enumerate(results["metadatas"]):
-            sorted_chunks.append({
-                "chunk_index": metadata["chunk_index"],
-                "content": results["documents"][i]
-            })
-        
-        sorted_chunks.sort(key=lambda x: x["chunk_index"])
-        chunks = [chunk["content"] for chunk in sorted_chunks]
-        
-        # Generate summary
-        summary = summarizer.summarize_chunks(chunks, max_tokens, summary_type)
+        summary, engine_used = await _summarize_document(document_id, max_tokens, summary_type, engine)
         
         return SummaryResponse(
             summary=summary,
             document_id=document_id,
-            title=document.get('title', 'Untitled Document')
+            title=document.get('title', 'Untitled Document'),
+            engine=engine_used
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _summarize_document(document_id: str, max_tokens: int, summary_type: str, engine: str) -> tuple:
+    """
+    Summarize a document with the requested engine.
+    
+    Returns:
+        (summary, engine actually used)
+    """
+    # Use the summary tree built at ingest when it is ready
+    tree = summary_tree_store.get(document_id) if engine != "extractive" else None
+    if tree is not None:
+        return await summarizer.summarize_tree(tree, max_tokens, summary_type, document_id=document_id), "llm"
+    
+    text = _get_document_text(document_id)
+    if engine == "llm":
+        return await summarizer.summarize_chunks(
+            summarizer._split_text(text), max_tokens, summary_type, document_id=document_id, source_text=text
+        ), "llm"
+    return summarizer.summarize_extractive(text, summary_type)["summary"], "extractive"
+
+def _get_document_text(document_id: str) -> str:
+    """
+    Get the extracted text of a document from the content store. Documents
+    ingested before the content store existed fall back to their chunks.
+    """
+    text = content_store.get_text(document_id)
+    if text is None:
+        text = "\n".join(_get_document_chunks(document_id))
+    return text
+
+def _get_document_chunks(document_id: str) -> List[str]:
+    """Get the indexed chunks of a document in order"""
+    chunks, _ = vector_store.get_document_embeddings(document_id)
+    if not chunks:
+        raise HTTPException(status_code=404, detail="Document content not found in vector store")
+    return chunks
+
+def _sse(event: str, data) -> str:
+    """Format one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+def _sse_response(request: Request, events) -> StreamingResponse:
+    """
+    Stream an async generator of {"event", "data"} dicts as server-sent
+    events. When the client disconnects the generator is closed, which
+    cancels the LLM calls still in flight.
+    """
+    async def body():
+        try:
+            async for event in events:
+                if await request.is_disconnected():
+                    break
+                yield _sse(event["event"], event["data"])
+            yield _sse("done", {})
+        except Exception as e:
+            yield _sse("error", {"detail": str(e)})
+        finally:
+            await events.aclose()
+    
+    return StreamingResponse(
+        body(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def _summary_events(document_id: str, max_tokens: int, summary_type: str, engine: str):
+    """Streaming counterpart of _summarize_document"""
+    tree = summary_tree_store.get(document_id) if engine != "extractive" else None
+    if tree is not None:
+        yield {"event": "engine", "data": "llm"}
+        async for event in summarizer.stream_tree_summary(tree, max_tokens, summary_type, document_id=document_id):
+            yield event
+        return
+    
+    text = _get_document_text(document_id)
+    if engine == "llm":
+        yield {"event": "engine", "data": "llm"}
+        async for event in summarizer.stream_summary(summarizer._split_text(text), max_tokens, summary_type,
+                                                     document_id=document_id, source_text=text):
+            yield event
+        return
+    yield {"event": "engine", "data": "extractive"}
+    yield {"event": "token", "data": summarizer.summarize_extractive(text, summary_type)["summary"]}
+
+@app.get("/documents/{document_id}/summary/stream")
+async def stream_document_summary(
+    request: Request,
+    document_id: str,
+    summary_type: str = Query("general"),
+    max_tokens: int = Query(500),
+    engine: str = Query("auto", pattern="^(extractive|llm|auto)$")
+):
+    """
+    Stream a document summary as server-sent events: "engine", then "map"
+    and "reduce" progress for LLM summaries, then "token" events carrying
+    the summary text as it is generated, and finally "done".
+    """
+    document = document_store.get_document(document_id)
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+    
+    return _sse_response(request, _summary_events(document_id, max_tokens, summary_type, engine))
+
 @app.delete("/documents/{document_id}")
 async def delete_document(document_id: str):
     """
@@ -430,27 +790,75 @@ async def delete_document(document_id: str):
         if not document:
             raise HTTPException(status_code=404, detail="Document not found")
         
-        # Delete from vector store
-        vector_store.delete_document(document_id)
-        
-        # Delete from document store
-        success = document_store.delete_document(document_id)
-        
-        if not success:
-            raise HTTPException(status_code=500, detail="Failed to delete document")
+        await _delete_document(document)
         
         return {"message": "Document deleted successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/documents/bulk-delete")
+async def bulk_delete_documents(request: BulkDeleteRequest):
+    """
+    Delete several documents. Their chunks stop matching searches at once
+    and are removed from the index by background compaction.
+    """
+    document_ids = list(dict.fromkeys(request.document_ids))
+    if len(document_ids) > settings.BULK_DELETE_MAX:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {settings.BULK_DELETE_MAX} documents can be deleted at once"
+        )
+    
+    deleted, not_found, failed = [], [], {}
+    for document_id in document_ids:
+        try:
+            document = document_store.get_document(document_id)
+            if not document:
+                not_found.append(document_id)
+                continue
+            await _delete_document(document)
+            deleted.append(document_id)
+        except Exception as e:
+            failed[document_id] = str(e)
+    
+    return {"deleted": deleted, "not_found": not_found, "failed": failed}
+
+async def _delete_document(document: Dict):
+    """Delete a document and everything derived from it"""
+    document_id = document['id']
+    
+    # Its chunk ids are known when it was chunked for the active index version
+    indexed_active = (document.get('indexVersion') or DEFAULT_VERSION) == vector_store.version['name']
+    vector_store.delete_document(document_id, document.get('chunkCount', 0) if indexed_active else 0)
+    
+    # Delete from document store
+    success = await document_store.delete_document(document_id, document)
+    
+    if not success:
+        raise HTTPException(status_code=500, detail="Failed to delete document")
+    
+    stats_store.record_document_removed(document)
+    await asyncio.to_thread(llm_cache.invalidate_document, document_id)
+    summary_tree_store.delete(document_id)
+    insights_builder.idf.remove_document(document_id)
+    content_store.delete(document_id)
+
+@app.get("/admin/documents/export")
+async def admin_export_documents():
+    """
+    Admin endpoint to stream all documents as newline-delimited JSON
+    """
+    return StreamingResponse(_stream_documents_ndjson(), media_type="application/x-ndjson")
+
 @app.get("/admin/documents", response_model=List[DocumentResponse])
-async def admin_get_documents(limit: int = Query(50)):
+async def admin_get_documents(response: Response, limit: int = Query(50, ge=1, le=500), cursor: Optional[str] = Query(None)):
     """
-    Admin endpoint to get all documents
+    Admin endpoint to get a page of all documents, newest first
     """
     try:
         # Get documents from document store without filtering by user
-        documents = document_store.get_documents(limit=limit)
+        documents = document_store.get_documents(limit=limit, cursor=cursor)
+        _set_next_cursor(response, documents, limit)
         
         # Format results
         return [
@@ -464,6 +872,8 @@ async def admin_get_documents(limit: int = Query(50)):
             )
             for doc in documents
         ]
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -473,40 +883,23 @@ async def admin_get_stats():
     Admin endpoint to get detailed system statistics
     """
     try:
-        # Get all documents
-        documents = document_store.get_documents(limit=1000)
-        
-        # Calculate statistics
-        doc_count = len(documents)
-        
-        # Count documents by file type
-        file_types = {}
-        for doc in documents:
-            file_type = doc.get('fileType', 'unknown')
-            file_types[file_type] = file_types.get(file_type, 0) + 1
-        
-        # Count documents by user
-        user_docs = {}
-        for doc in documents:
-            user = doc.get('uploadedBy', 'unknown')
-            user_docs[user] = user_docs.get(user, 0) + 1
+        # Counters are maintained on store and delete, so this is a single read
+        stats = stats_store.get_stats()
         
         # Convert to sorted lists for better readability
-        file_type_stats = [{"type": k, "count": v} for k, v in file_types.items()]
+        file_type_stats = [{"type": k, "count": v} for k, v in stats["by_type"].items()]
         file_type_stats.sort(key=lambda x: x["count"], reverse=True)
         
-        user_stats = [{"user_id": k, "document_count": v} for k, v in user_docs.items()]
+        user_stats = [{"user_id": k, "document_count": v} for k, v in stats["by_user"].items()]
         user_stats.sort(key=lambda x: x["document_count"], reverse=True)
         
-        # Calculate mock storage usage (in a real app, this would be actual storage metrics)
-        storage_usage = sum(doc.get('fileSize', 0) for doc in documents if 'fileSize' in doc)
-        
         return {
-            "total_documents": doc_count,
+            "total_documents": stats["total_documents"],
             "documents_by_type": file_type_stats,
             "documents_by_user": user_stats,
-            "storage_usage": storage_usage,
-            "vector_store_chunks": len(vector_store.collection.get()["ids"]) if not USE_MOCK_SERVICES else "N/A",
+            "storage_usage": stats["total_bytes"],
+            "vector_store_chunks": stats["total_chunks"],
+            "stats_reconciled_at": stats["reconciled_at"],
             "system_status": "healthy",
             "api_version": app.version,
             "timestamp": datetime.datetime.now().isoformat()
@@ -514,8 +907,155 @@ async def admin_get_stats():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/admin/llm-cache/stats")
+async def admin_get_llm_cache_stats():
+    """
+    Admin endpoint to get LLM response cache hit rates and savings
+    """
+    try:
+        return llm_cache.stats()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/admin/storage/stats")
+async def admin_get_storage_stats():
+    """
+    Admin endpoint to get blob transfer and metadata write latencies
+    """
+    try:
+        return document_store.storage_stats()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/admin/llm-gateway/stats")
+async def admin_get_llm_gateway_stats():
+    """
+    Admin endpoint to get per-model LLM call, queueing and latency metrics
+    """
+    try:
+        return llm_gateway.stats()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _use_index_version(version: Dict):
+    """Chunk new uploads the way the now active index version was built"""
+    document_processor.chunk_size = version["chunk_size"]
+    document_processor.chunk_overlap = version["chunk_overlap"]
+
+if shared_index:
+    # Switches made through another worker arrive with the next generation
+    vector_store.version_listeners.append(_use_index_version)
+
+@app.get("/admin/index/versions")
+async def admin_get_index_versions():
+    """
+    Admin endpoint to list the vector index versions and their build progress
+    """
+    try:
+        return reindexer.status()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/admin/index/versions", status_code=202)
+async def admin_create_index_version(options: IndexVersionCreate = Body(IndexVersionCreate())):
+    """
+    Admin endpoint to start building a new index version with another
+    embedding model or chunking, while searches keep using the active one
+    """
+    try:
+        return reindexer.start(options.model_name, options.chunk_size, options.chunk_overlap)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/admin/index/versions/{name}/switch")
+async def admin_switch_index_version(name: str):
+    """
+    Admin endpoint to serve searches from a built index version
+    """
+    try:
+        version = await asyncio.to_thread(reindexer.switch, name)
+        _use_index_version(version)
+        return version
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/admin/index/rollback")
+async def admin_rollback_index_version():
+    """
+    Admin endpoint to switch back to the previously active index version
+    """
+    try:
+        version = await asyncio.to_thread(reindexer.rollback)
+        _use_index_version(version)
+        return version
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/admin/index/versions/{name}/cancel")
+async def admin_cancel_index_version(name: str):
+    """
+    Admin endpoint to stop building an index version
+    """
+    if not reindexer.cancel(name):
+        raise HTTPException(status_code=404, detail="No build running for this index version")
+    return {"message": "Build cancelled"}
+
+@app.post("/admin/index/versions/{name}/resume", status_code=202)
+async def admin_resume_index_version(name: str):
+    """
+    Admin endpoint to continue a cancelled or failed build from its checkpoint
+    """
+    if not reindexer.resume(name):
+        raise HTTPException(status_code=404, detail="No cancelled or failed build for this index version")
+    return {"message": "Build resumed"}
+
+@app.delete("/admin/index/versions/{name}")
+async def admin_drop_index_version(name: str):
+    """
+    Admin endpoint to delete an index version that is not active
+    """
+    try:
+        await asyncio.to_thread(reindexer.drop, name)
+        return {"message": "Index version deleted"}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/admin/index/snapshot")
+async def admin_get_index_snapshot():
+    """
+    Admin endpoint to describe the memory-mapped snapshot of the active
+    index version and the changes logged since it was written
+    """
+    try:
+        return await asyncio.to_thread(vector_store.snapshot_status)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/admin/index/snapshot/merge")
+async def admin_merge_index_snapshot():
+    """
+    Admin endpoint to merge the logged changes into a new snapshot now
+    rather than once the log has grown past SNAPSHOT_LOG_MAX_BYTES
+    """
+    try:
+        if not await asyncio.to_thread(vector_store.merge_snapshot, True):
+            raise HTTPException(status_code=409, detail="No snapshot is ready to merge into")
+        return await asyncio.to_thread(vector_store.snapshot_status)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/documents/{document_id}/insights")
-async def get_document_insights(document_id: str):
+async def get_document_insights(document_id: str, background_tasks: BackgroundTasks):
     """
     Get insights from a document such as sentiment analysis,
     readability metrics, and topic modeling
@@ -526,53 +1066,19 @@ async def get_document_insights(document_id: str):
         if not document:
             raise HTTPException(status_code=404, detail="Document not found")
         
-        # Get document text (in a real implementation, get from file contents)
-        document_title = document.get('title', 'Untitled')
+        # Insights are computed at ingest; documents ingested before that
+        # (or still being processed) get them built in the background
+        insights = document.get('insights')
+        if not insights:
+            if insights_builder.schedule(document_id):
+                background_tasks.add_task(insights_builder.build, document_id)
+            return JSONResponse(status_code=202, content={"document_id": document_id, "status": "pending"})
         
-        # Create mock insights for development
-        insights = {
+        return {
             "document_id": document_id,
-            "title": document_title,
-            "sentiment_analysis": {
-                "overall_sentiment": "positive",
-                "confidence": 0.87,
-                "sentiment_breakdown": {
-                    "positive": 0.72,
-                    "neutral": 0.25,
-                    "negative": 0.03
-                }
-            },
-            "topic_modeling": {
-                "main_topics": [
-                    { "name": "Business Strategy", "relevance": 0.85 },
-                    { "name": "Financial Analysis", "relevance": 0.65 },
-                    { "name": "Market Research", "relevance": 0.58 },
-                    { "name": "Technology Implementation", "relevance": 0.42 }
-                ],
-                "topic_distribution": {
-                    "Strategic Planning": 32,
-                    "Resource Allocation": 28,
-                    "Performance Metrics": 24,
-                    "Risk Assessment": 16
-                }
-            },
-            "readability": {
-                "score": 65,
-                "grade_level": "College",
-                "reading_time": "5 minutes",
-                "complexity": "Moderate"
-            },
-            "keywords": [
-                { "word": "strategy", "frequency": 14, "relevance": 0.92 },
-                { "word": "implementation", "frequency": 9, "relevance": 0.85 },
-                { "word": "analysis", "frequency": 8, "relevance": 0.83 },
-                { "word": "performance", "frequency": 7, "relevance": 0.78 },
-                { "word": "resources", "frequency": 6, "relevance": 0.72 }
-            ],
-            "generated_at": datetime.datetime.now().isoformat()
+            "title": document.get('title', 'Untitled'),
+            **insights
         }
-        
-        return insights
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -613,9 +1119,16 @@ async def get_related_documents(document_id: str, limit: int = Query(3)):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/documents/{document_id}/ask")
-async def ask_document_question(document_id: str, question: str = Body(..., embed=True)):
+async def ask_document_question(
+    document_id: str,
+    question: str = Body(..., embed=True),
+    scope: str = Body("document", embed=True, pattern="^(document|corpus)$")
+):
     """
-    Ask a question about a document and get an answer
+    Ask a question about a document and get an answer grounded in its most
+    relevant chunks. With scope="corpus" chunks from all documents are used.
+    The answer cites chunk ids, and retrieval, packing and LLM time are
+    reported separately.
     """
     try:
         # Get document from document store
@@ -623,18 +1136,33 @@ async def ask_document_question(document_id: str, question: str = Body(..., embe
         if not document:
             raise HTTPException(status_code=404, detail="Document not found")
         
-        # In a real implementation, use RAG to answer the question
-        # For now, return a mock answer
+        result = await document_qa.answer(question, document_id if scope == "document" else None)
         return {
             "document_id": document_id,
             "question": question,
-            "answer": f"Based on the document '{document.get('title')}', the answer to your question about '{question}' would involve analyzing the key points discussed in the document. The document discusses various aspects related to this topic and provides valuable insights that can address your specific query.",
-            "confidence": 0.85,
+            **result,
             "generated_at": datetime.datetime.now().isoformat()
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/documents/{document_id}/ask/stream")
+async def stream_document_answer(
+    request: Request,
+    document_id: str,
+    question: str = Body(..., embed=True),
+    scope: str = Body("document", embed=True, pattern="^(document|corpus)$")
+):
+    """
+    Ask a question about a document and stream the answer as server-sent
+    events: "sources", "token" events, "citations", then "done"
+    """
+    document = document_store.get_document(document_id)
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+    
+    return _sse_response(request, document_qa.answer_stream(question, document_id if scope == "document" else None))
+
 @app.get("/documents/{document_id}/enhanced-summary")
 async def get_enhanced_document_summary(
     document_id: str,
@@ -642,7 +1170,8 @@ async def get_enhanced_document_summary(
     include_key_points: bool = Query(True),
     include_tags: bool = Query(True),
     include_entities: bool = Query(True),
-    max_length: int = Query(1000)
+    max_length: int = Query(1000),
+    engine: str = Query("auto", pattern="^(extractive|llm|auto)$")
 ):
     """
     Generate an enhanced summary of a document with additional insights
@@ -654,59 +1183,98 @@ async def get_enhanced_document_summary(
             raise HTTPException(status_code=404, detail="Document not found")
         
         # Get basic summary
-        summary_response = await get_document_summary(
-            document_id=document_id,
-            summary_type="detailed",
-            max_tokens=max_length
-        )
+        summary, engine_used = await _summarize_document(document_id, max_length, "detailed", engine)
         
         # Create enhanced summary response
         result = {
             "document_id": document_id,
             "title": document.get('title', 'Untitled'),
             "summary_type": summary_type,
-            "summary": summary_response.summary,
+            "summary": summary,
+            "engine": engine_used,
             "generated_at": datetime.datetime.now().isoformat()
         }
-        
-        # Add key points if requested
-        if include_key_points:
-            result["key_points"] = [
-                f"The document discusses important information related to {document.get('title')}",
-                "Several methodologies and approaches are outlined in detail",
-                "Data analysis reveals significant patterns worth further investigation",
-                "Recommendations focus on practical implementation steps",
-                "Multiple stakeholders are identified with specific action items"
-            ]
-        
-        # Add tags if requested (mock implementation)
-        if include_tags:
-            result["tags"] = [
-                {"id": "tag-1", "name": "Important", "color": "#f44336"},
-                {"id": "tag-2", "name": "Work", "color": "#2196f3"}
-            ]
-        
-        # Add named entities if requested
-        if include_entities:
-            result["named_entities"] = {
-                "organizations": ["Company XYZ", "Department A", "Team Alpha"],
-                "people": ["John Smith", "Mary Johnson", "Technical Lead"],
-                "locations": ["Headquarters", "Branch Office", "Meeting Room 3"],
-                "dates": ["Q3 2023", "March 15th", "Next fiscal year"],
-                "products": ["Product Z", "System X", "Framework Y"]
-            }
-        
-        # Add document metadata
-        result["metadata"] = {
-            "file_type": document.get('fileType', 'unknown'),
-            "uploaded_at": document.get('uploadedAt', ''),
-            "last_modified": document.get('updatedAt', document.get('uploadedAt', ''))
-        }
+        result.update(await _enhanced_summary_details(
+            document, summary, engine_used, include_key_points, include_tags, include_entities
+        ))
         
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _enhanced_summary_details(document: Dict, summary: str, engine_used: str, include_key_points: bool,
+                                    include_tags: bool, include_entities: bool) -> Dict:
+    """Build the key points, tags, entities and metadata sections of an enhanced summary"""
+    details = {}
+    
+    # Add key points if requested
+    if include_key_points:
+        if engine_used == "extractive":
+            details["key_points"] = summarizer.extractive.key_points(_get_document_text(document['id']))
+        else:
+            details["key_points"] = await summarizer.extract_key_points(summary, document['id'])
+    
+    # Add tags if requested (mock implementation)
+    if include_tags:
+        details["tags"] = [
+            {"id": "tag-1", "name": "Important", "color": "#f44336"},
+            {"id": "tag-2", "name": "Work", "color": "#2196f3"}
+        ]
+    
+    # Add named entities if requested
+    if include_entities:
+        details["named_entities"] = {
+            "organizations": ["Company XYZ", "Department A", "Team Alpha"],
+            "people": ["John Smith", "Mary Johnson", "Technical Lead"],
+            "locations": ["Headquarters", "Branch Office", "Meeting Room 3"],
+            "dates": ["Q3 2023", "March 15th", "Next fiscal year"],
+            "products": ["Product Z", "System X", "Framework Y"]
+        }
+    
+    # Add document metadata
+    details["metadata"] = {
+        "file_type": document.get('fileType', 'unknown'),
+        "uploaded_at": document.get('uploadedAt', ''),
+        "last_modified": document.get('updatedAt', document.get('uploadedAt', ''))
+    }
+    
+    return details
+
+@app.get("/documents/{document_id}/enhanced-summary/stream")
+async def stream_enhanced_document_summary(
+    request: Request,
+    document_id: str,
+    summary_type: str = Query("comprehensive"),
+    include_key_points: bool = Query(True),
+    include_tags: bool = Query(True),
+    include_entities: bool = Query(True),
+    max_length: int = Query(1000),
+    engine: str = Query("auto", pattern="^(extractive|llm|auto)$")
+):
+    """
+    Stream an enhanced summary: the summary events of /summary/stream,
+    followed by a "details" event with key points, tags, entities and
+    metadata once the summary is complete
+    """
+    document = document_store.get_document(document_id)
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+    
+    async def events():
+        engine_used, pieces = engine, []
+        async for event in _summary_events(document_id, max_length, "detailed", engine):
+            if event["event"] == "engine":
+                engine_used = event["data"]
+            elif event["event"] == "token":
+                pieces.append(event["data"])
+            yield event
+        details = await _enhanced_summary_details(
+            document, "".join(pieces).strip(), engine_used, include_key_points, include_tags, include_entities
+        )
+        yield {"event": "details", "data": {"summary_type": summary_type, **details}}
+    
+    return _sse_response(request, events())
+
 @app.post("/documents/{document_id}/key-points")
 async def generate_key_points(document_id: str):
     """
@@ -717,13 +1285,8 @@ async def generate_key_points(document_id: str):
         if not document:
             raise HTTPException(status_code=404, detail="Document not found")
 
-        # Use OpenAI to generate key points
-        response = openai.Completion.create(
-            engine="text-davinci-003",
-            prompt=f"Extract key points from the following document:\n{document['content']}",
-            max_tokens=150
-        )
-        key_points = response.choices[0].text.strip().split("\n")
+        # Use OpenAI to generate key points, reusing the cached response if any
+        key_points = (await _cached_completion(document_id, KEY_POINTS_PROMPT, _get_document_text(document_id), 150)).split("\n")
 
         return {"document_id": document_id, "key_points": key_points}
     except Exception as e:
@@ -739,13 +1302,8 @@ async def generate_slides(document_id: str):
         if not document:
             raise HTTPException(status_code=404, detail="Document not found")
 
-        # Use OpenAI to generate slide content
-        response = openai.Completion.create(
-            engine="text-davinci-003",
-            prompt=f"Create slide content for the following document:\n{document['content']}",
-            max_tokens=300
-        )
-        slides = response.choices[0].text.strip().split("\n\n")
+        # Use OpenAI to generate slide content, reusing the cached response if any
+        slides = (await _cached_completion(document_id, SLIDES_PROMPT, _get_document_text(document_id), 300)).split("\n\n")
 
         return {"document_id": document_id, "slides": slides}
     except Exception as e:
@@ -758,12 +1316,7 @@ async def generate_image(document_id: str, description: str = Body(...)):
     """
     try:
         # Use OpenAI DALL-E to generate an image
-        response = openai.Image.create(
-            prompt=description,
-            n=1,
-            size="512x512"
-        )
-        image_url = response['data'][0]['url']
+        image_url = await llm_gateway.generate_image(description, size="512x512")
 
         return {"document_id": document_id, "image_url": image_url}
     except Exception as e:
@@ -779,12 +1332,12 @@ async def generate_voice(document_id: str):
         if not document:
             raise HTTPException(status_code=404, detail="Document not found")
 
-        # Use gTTS to generate voice
-        tts = gTTS(text=document['content'], lang='en')
-        temp_file = f"temp/{document_id}.mp3"
-        tts.save(temp_file)
-
-        return FileResponse(temp_file, media_type="audio/mpeg", filename=f"{document_id}.mp3")
+        # Stream the narration as segments are synthesized (cached per segment)
+        return StreamingResponse(
+            narrator.stream(_get_document_text(document_id)),
+            media_type="audio/mpeg",
+            headers={"Content-Disposition": f'attachment; filename="{document_id}.mp3"'}
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -0,0 +1,223 @@
+import io
+import os
+import asyncio
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import AsyncIterator, List, Optional
+from config import settings
+from llm_cache import hash_text
+from tokens import split_by_tokens
+
+try:
+    from gtts import gTTS
+except ImportError:  # Only the local engine is available without gTTS
+    gTTS = None
+
+STREAM_CHUNK_BYTES = 64 * 1024
+
+# A silent MPEG-1 Layer III frame: 32 kbps, 44.1 kHz, mono, no side info.
+# 104 bytes and 1152 samples (about 26 ms) per frame.
+SILENT_MP3_FRAME = bytes([0xFF, 0xFB, 0x10, 0xC4]) + bytes(100)
+SILENT_FRAME_SECONDS = 1152 / 44100
+
+
+class TTSEngine(ABC):
+    """Text-to-speech engine turning a segment of text into MP3 bytes"""
+
+    name = "base"
+
+    @abstractmethod
+    def synthesize(self, text: str) -> bytes:
+        """Synthesize a segment of text, returning MP3 bytes"""
+
+
+class GTTSEngine(TTSEngine):
+    """Google Translate text-to-speech through gTTS (needs network access)"""
+
+    name = "gtts"
+
+    def __init__(self, lang: str = "en"):
+        if gTTS is None:
+            raise Exception("gTTS is not installed")
+        self.lang = lang
+        self.name = f"gtts-{lang}"
+
+    def synthesize(self, text: str) -> bytes:
+        buffer = io.BytesIO()
+        gTTS(text=text, lang=self.lang).write_to_fp(buffer)
+        return buffer.getvalue()
+
+
+class LocalTTSEngine(TTSEngine):
+    """
+    Offline stand-in producing silent MP3 audio as long as the text would
+    take to read aloud, for development and tests without network access.
+    """
+
+    name = "local"
+
+    def __init__(self, words_per_minute: int = 160):
+        self.words_per_minute = words_per_minute
+
+    def synthesize(self, text: str) -> bytes:
+        seconds = len(text.split()) * 60 / self.words_per_minute
+        return SILENT_MP3_FRAME * max(1, round(seconds / SILENT_FRAME_SECONDS))
+
+
+def create_engine(name: str = None) -> TTSEngine:
+    """Create the TTS engine configured by NARRATION_ENGINE"""
+    name = name or settings.NARRATION_ENGINE
+    if name == "local":
+        return LocalTTSEngine()
+    if name == "gtts":
+        return GTTSEngine(settings.NARRATION_LANGUAGE)
+    raise ValueError(f"Unknown narration engine: {name}")
+
+
+class SegmentCache:
+    """
+    Synthesized audio segments stored as files named by the hash of the
+    engine and text, so unchanged text is never synthesized twice. The
+    least recently used segments are evicted once the directory grows past
+    max_bytes.
+    """
+
+    def __init__(self, directory: str = None, max_bytes: int = None):
+        """
+        Args:
+            directory: Directory holding the segment files
+            max_bytes: Size limit of the cached segments
+        """
+        self.directory = directory or settings.NARRATION_CACHE_DIRECTORY
+        self.max_bytes = max_bytes if max_bytes is not None else settings.NARRATION_CACHE_MAX_BYTES
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._total_bytes = sum(size for _, _, size in self._entries())
+
+    def key(self, engine: TTSEngine, text: str) -> str:
+        return hash_text(f"{engine.name}\n{text}")
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.mp3")
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Get a cached segment, or None on a miss"""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as file:
+                audio = file.read()
+            # The modification time doubles as the last access time for eviction
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return audio
+
+    def put(self, key: str, audio: bytes):
+        """
+        Store a segment, written to a unique temp file and renamed into
+        place, and evict the least recently used segments if the cache grew
+        past its size limit.
+        """
+        path = self._path(key)
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix=".tmp", delete=False) as file:
+            file.write(audio)
+            temp_path = file.name
+        with self._lock:
+            try:
+                previous = os.path.getsize(path)
+            except OSError:
+                previous = 0
+            try:
+                os.replace(temp_path, path)
+            except OSError:
+                os.remove(temp_path)
+                raise
+            self._total_bytes += len(audio) - previous
+            self._evict()
+
+    def _entries(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".mp3"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                yield entry.path, stat.st_mtime, stat.st_size
+
+    def _evict(self):
+        # Evict down to 90% of the limit so every put does not trigger eviction
+        if self._total_bytes <= self.max_bytes:
+            return
+        target = self.max_bytes * 0.9
+        for path, _, size in sorted(self._entries(), key=lambda entry: entry[1]):
+            if self._total_bytes <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            self._total_bytes -= size
+
+
+class Narrator:
+    """
+    Narrates documents as a stream of MP3 audio.
+
+    The text is split into sentence-aligned segments, which are synthesized
+    concurrently a few segments ahead of playback and cached by content
+    hash. MP3 is a sequence of independent frames, so segment outputs are
+    concatenated and streamed as soon as the first one is ready.
+    """
+
+    def __init__(self, engine: TTSEngine = None, cache: SegmentCache = None,
+                 max_concurrency: int = None, segment_tokens: int = None):
+        """
+        Args:
+            engine: TTS engine, created from NARRATION_ENGINE if not given
+            cache: Segment cache
+            max_concurrency: Segments synthesized at the same time
+            segment_tokens: Maximum segment size in tokens
+        """
+        self.engine = engine or create_engine()
+        self.cache = cache or SegmentCache()
+        self.max_concurrency = max_concurrency or settings.NARRATION_MAX_CONCURRENCY
+        self.segment_tokens = segment_tokens or settings.NARRATION_SEGMENT_TOKENS
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    def split_segments(self, text: str) -> List[str]:
+        """Split text into sentence-aligned segments"""
+        return split_by_tokens(text, self.segment_tokens)
+
+    def synthesize_segment(self, text: str) -> bytes:
+        """Get the audio of one segment from the cache, synthesizing it on a miss"""
+        key = self.cache.key(self.engine, text)
+        audio = self.cache.get(key)
+        if audio is None:
+            audio = self.engine.synthesize(text)
+            self.cache.put(key, audio)
+        return audio
+
+    async def _synthesize(self, text: str) -> bytes:
+        async with self._semaphore:
+            return await asyncio.to_thread(self.synthesize_segment, text)
+
+    async def stream(self, text: str) -> AsyncIterator[bytes]:
+        """
+        Yield the narration of a text as MP3 bytes, in order. At most
+        max_concurrency segments are synthesized ahead of the one being
+        streamed; closing the generator cancels them.
+        """
+        segments = deque(self.split_segments(text))
+        pending = deque()
+        try:
+            while segments or pending:
+                while segments and len(pending) < self.max_concurrency:
+                    pending.append(asyncio.ensure_future(self._synthesize(segments.popleft())))
+                audio = await pending.popleft()
+                for start in range(0, len(audio), STREAM_CHUNK_BYTES):
+                    yield audio[start:start + STREAM_CHUNK_BYTES]
+        finally:
+            for task in pending:
+                task.cancel()
@@ -0,0 +1,213 @@
+import re
+import time
+import asyncio
+from typing import Dict, Any, List, Optional, AsyncIterator
+from config import settings
+from tokens import count_tokens
+
+QA_TEMPLATE = """Answer the question using only the context below. Each context passage starts with its
+chunk id in square brackets; cite the chunk ids you used in square brackets after the
+sentences they support. If the context does not contain the answer, say so.
+
+{text}
+
+Answer:"""
+
+CITATION_PATTERN = re.compile(r"\[([^\[\]]+)\]")
+
+# Overlapping neighbours share roughly DocumentProcessor.chunk_overlap
+# characters; search a little further back to allow for stripped whitespace
+OVERLAP_SEARCH_CHARS = 400
+OVERLAP_PROBE_CHARS = 40
+
+
+def merge_overlap(first: str, second: str) -> str:
+    """
+    Join two consecutive chunks, dropping the text the second repeats from
+    the end of the first.
+    """
+    probe = second[:OVERLAP_PROBE_CHARS]
+    start = first.rfind(probe, max(0, len(first) - OVERLAP_SEARCH_CHARS))
+    if probe and start != -1 and second.startswith(first[start:]):
+        return first + second[len(first) - start:]
+    return first + "\n" + second
+
+
+class DocumentQA:
+    """
+    Retrieval-augmented question answering over the vector store.
+
+    The top chunks for a question are retrieved (from one document or the
+    whole corpus), neighbouring chunks are merged so their overlaps are not
+    sent twice, the merged passages are packed greedily by relevance under
+    a token budget, and the LLM is called once with chunk-id citations.
+    """
+
+    def __init__(self, vector_store, summarizer, top_k: int = None, context_tokens: int = None,
+                 content_store=None):
+        """
+        Args:
+            vector_store: VectorStore to retrieve chunks from
+            summarizer: DocumentSummarizer providing the LLM, model name and cache
+            top_k: Number of chunks retrieved per question
+            context_tokens: Token budget of the packed context
+            content_store: Optional ContentStore to read merged chunk ranges from exactly
+        """
+        self.vector_store = vector_store
+        self.summarizer = summarizer
+        self.content_store = content_store
+        self.top_k = top_k or settings.QA_TOP_K
+        self.context_tokens = context_tokens or settings.QA_CONTEXT_TOKENS
+
+    def retrieve(self, question: str, document_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Get the chunks most similar to the question, scoped to one document if given"""
+        filters = {"document_id": document_id} if document_id else None
+        return self.vector_store.search(query=question, limit=self.top_k, filters=filters)
+
+    def pack(self, hits: List[Dict[str, Any]]) -> tuple:
+        """
+        Merge overlapping neighbours and pack passages under the token budget.
+
+        Returns:
+            (context text, list of chunk ids included)
+        """
+        # Group consecutive chunks of the same document into passages
+        ordered = sorted(hits, key=lambda h: (h["document_id"], h["metadata"].get("chunk_index", 0)))
+        passages = []
+        for hit in ordered:
+            index = hit["metadata"].get("chunk_index", 0)
+            last = passages[-1] if passages else None
+            if last and last["document_id"] == hit["document_id"] and last["last_index"] + 1 == index:
+                last["text"] = merge_overlap(last["text"], hit["chunk_text"])
+                last["chunk_ids"].append(hit["chunk_id"])
+                last["members"].append(hit)
+                last["last_index"] = index
+                last["score"] = min(last["score"], hit["similarity_score"])
+            else:
+                passages.append(self._passage(hit, index))
+
+        # The stored text of a chunk range has no overlap to guess at
+        if self.content_store is not None:
+            for passage in passages:
+                if len(passage["members"]) > 1:
+                    text = self.content_store.get_spans(
+                        passage["document_id"], self.vector_store.version["span_name"],
+                        passage["first_index"], passage["last_index"]
+                    )
+                    passage["text"] = text or passage["text"]
+
+        # Greedily take the most relevant passages (smallest distance) that
+        # fit; a merged passage too large for the remaining budget is broken
+        # back into its chunks, which compete on their own scores
+        budget = self.context_tokens
+        chosen = []
+        candidates = sorted(passages, key=lambda p: p["score"])
+        while candidates:
+            passage = candidates.pop(0)
+            tokens = count_tokens(self._format(passage) + "\n\n", self.summarizer.model_name)
+            if tokens <= budget:
+                chosen.append(passage)
+                budget -= tokens
+            elif len(passage["members"]) > 1:
+                singles = [self._passage(hit, hit["metadata"].get("chunk_index", 0)) for hit in passage["members"]]
+                candidates = sorted(candidates + singles, key=lambda p: p["score"])
+
+        # Present the context in document order
+        chosen.sort(key=lambda p: (p["document_id"], p["first_index"]))
+        context = "\n\n".join(self._format(p) for p in chosen)
+        return context, [chunk_id for p in chosen for chunk_id in p["chunk_ids"]]
+
+    @staticmethod
+    def _passage(hit: Dict[str, Any], index: int) -> Dict[str, Any]:
+        return {
+            "document_id": hit["document_id"],
+            "text": hit["chunk_text"],
+            "chunk_ids": [hit["chunk_id"]],
+            "members": [hit],
+            "first_index": index,
+            "last_index": index,
+            "score": hit["similarity_score"]
+        }
+
+    @staticmethod
+    def _format(passage: Dict[str, Any]) -> str:
+        return f"[{', '.join(passage['chunk_ids'])}] {passage['text']}"
+
+    def prepare(self, question: str, document_id: Optional[str] = None) -> Dict[str, Any]:
+        """Retrieve and pack the context for a question, timing each step"""
+        start = time.perf_counter()
+        hits = self.retrieve(question, document_id)
+        retrieved = time.perf_counter()
+        context, chunk_ids = self.pack(hits)
+        packed = time.perf_counter()
+        return {
+            "text": f"Context:\n{context}\n\nQuestion: {question}",
+            "chunk_ids": chunk_ids,
+            "timings": {
+                "retrieval_ms": round((retrieved - start) * 1000, 2),
+                "packing_ms": round((packed - retrieved) * 1000, 2)
+            }
+        }
+
+    async def answer(self, question: str, document_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Answer a question with one LLM call.
+
+        Returns:
+            Dict with answer, citations (chunk ids cited in the answer),
+            sources (chunk ids given as context) and timings
+        """
+        prepared = await asyncio.to_thread(self.prepare, question, document_id)
+        if not prepared["chunk_ids"]:
+            return self._result("No relevant content was found to answer this question.", prepared, 0.0)
+
+        prompt = QA_TEMPLATE.format(text=prepared["text"])
+        cache = self.summarizer.cache
+        start = time.perf_counter()
+        if cache is None:
+            answer = await self.summarizer.llm.apredict(prompt)
+        else:
+            answer = await cache.aget_or_generate(
+                self.summarizer.model_name, QA_TEMPLATE, prepared["text"], {},
+                lambda: self.summarizer.llm.apredict(prompt), document_id
+            )
+        return self._result(answer.strip(), prepared, time.perf_counter() - start)
+
+    async def answer_stream(self, question: str, document_id: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streaming variant of answer: a "sources" event, "token" events as the
+        answer is generated, then a "citations" event with timings.
+        """
+        prepared = await asyncio.to_thread(self.prepare, question, document_id)
+        yield {"event": "sources", "data": prepared["chunk_ids"]}
+        if not prepared["chunk_ids"]:
+            result = self._result("No relevant content was found to answer this question.", prepared, 0.0)
+            yield {"event": "token", "data": result["answer"]}
+            yield {"event": "citations", "data": {"citations": [], "timings": result["timings"]}}
+            return
+
+        pieces = []
+        start = time.perf_counter()
+        async for chunk in self.summarizer.llm.astream(QA_TEMPLATE.format(text=prepared["text"])):
+            piece = getattr(chunk, "content", chunk)
+            if piece:
+                pieces.append(piece)
+                yield {"event": "token", "data": piece}
+        result = self._result("".join(pieces).strip(), prepared, time.perf_counter() - start)
+        yield {"event": "citations", "data": {"citations": result["citations"], "timings": result["timings"]}}
+
+    @staticmethod
+    def _result(answer: str, prepared: Dict[str, Any], llm_seconds: float) -> Dict[str, Any]:
+        sources = set(prepared["chunk_ids"])
+        cited = []
+        for match in CITATION_PATTERN.finditer(answer):
+            for chunk_id in match.group(1).split(","):
+                chunk_id = chunk_id.strip()
+                if chunk_id in sources and chunk_id not in cited:
+                    cited.append(chunk_id)
+        return {
+            "answer": answer,
+            "citations": cited,
+            "sources": prepared["chunk_ids"],
+            "timings": {**prepared["timings"], "llm_ms": round(llm_seconds * 1000, 2)}
+        }
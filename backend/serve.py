@@ -0,0 +1,199 @@
+"""
+Preload-and-fork server.
+
+The embedding model is loaded once and the heavy modules are imported
+before forking, so every worker shares their memory copy-on-write instead
+of loading its own. Workers search a memory-mapped copy of the vector
+index (shared_index.py), which the page cache also holds once. A single
+writer process owns the Chroma collections: workers send it every index
+change, and it publishes the changes to the shared copy. Re-indexing,
+compaction and stats reconciliation run in the writer only.
+
+    cd backend
+    python serve.py --workers 8 --port 8000
+
+Dead workers and a dead writer are restarted; SIGTERM or Ctrl-C stops
+everything.
+"""
+import os
+import gc
+import sys
+import time
+import signal
+import socket
+import argparse
+import threading
+import traceback
+from typing import Dict, Callable
+
+# Read by config, which the imports below load
+os.environ["VECTOR_STORE_MODE"] = "shared"
+os.environ["SHARED_INDEX_AUTHKEY"] = os.urandom(32).hex()
+# Firestore's gRPC channels are only safe across fork with fork support on
+os.environ.setdefault("GRPC_ENABLE_FORK_SUPPORT", "1")
+
+import torch
+import uvicorn
+from config import settings
+import shared_index
+
+# Imported before forking so their code and import-time data are shared
+PRELOAD_MODULES = (
+    "fastapi", "chromadb", "numpy", "sklearn", "langchain", "vector_store", "document_processor",
+    "document_store", "summarizer", "question_answering", "insights", "index_versions",
+)
+
+
+def _fork(target: Callable, *args) -> int:
+    pid = os.fork()
+    if pid == 0:
+        # Children restarted later would otherwise inherit the supervisor's handlers
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        code = 0
+        try:
+            target(*args)
+        except BaseException:
+            traceback.print_exc()
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+
+def _run_writer(ready_fd: int):
+    """Own the Chroma collections, serve index changes from the workers and publish generations"""
+    from vector_store import VectorStore
+    from document_store import DocumentStore
+    from content_store import ContentStore
+    from stats_store import StatsStore
+    from index_versions import Reindexer
+
+    vector_store = VectorStore(use_mock=False, models=shared_index.preloaded_models)
+    document_store = DocumentStore(use_mock=False)
+    stats_store = StatsStore(use_mock=False)
+    reindexer = Reindexer(vector_store, document_store, ContentStore())
+    writer = shared_index.IndexWriter(vector_store, {"vector_store": vector_store, "reindexer": reindexer})
+    writer.publish()
+    reindexer.resume()
+
+    def compact_periodically():
+        while True:
+            try:
+                # Keep going while full batches are found
+                while vector_store.compact() == settings.COMPACTION_BATCH_SIZE:
+                    pass
+                vector_store.merge_snapshot()
+            except Exception as e:
+                print(f"Index compaction failed: {e}")
+            time.sleep(settings.COMPACTION_INTERVAL)
+
+    def reconcile_stats_periodically():
+        while True:
+            delay = settings.STATS_RECONCILE_INTERVAL
+            try:
+                # Counters reconciled shortly before a restart are not rescanned
+                due = stats_store.seconds_until_reconcile(delay)
+                if due > 0:
+                    delay = due
+                else:
+                    stats_store.reconcile(document_store, vector_store)
+            except Exception as e:
+                print(f"Stats reconciliation failed: {e}")
+            time.sleep(delay)
+
+    if settings.COMPACTION_INTERVAL > 0:
+        threading.Thread(target=compact_periodically, name="compaction", daemon=True).start()
+    if settings.STATS_RECONCILE_INTERVAL > 0:
+        threading.Thread(target=reconcile_stats_periodically, name="stats-reconcile", daemon=True).start()
+
+    def ready():
+        os.write(ready_fd, b"1")
+        os.close(ready_fd)
+
+    writer.serve_forever(on_ready=ready)
+
+
+def _run_worker(sock: socket.socket, threads: int, log_level: str):
+    # Workers would otherwise each start a thread per core
+    torch.set_num_threads(threads)
+    import main as api
+    uvicorn.Server(uvicorn.Config(api.app, log_level=log_level)).run(sockets=[sock])
+
+
+def _start_writer() -> int:
+    """Fork the writer and wait until it has published a generation and is accepting connections"""
+    read_fd, write_fd = os.pipe()
+    pid = _fork(_run_writer, write_fd)
+    os.close(write_fd)
+    with os.fdopen(read_fd, "rb") as ready:
+        if ready.read(1) != b"1":
+            raise RuntimeError("The index writer exited before it was ready")
+    return pid
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Serve the API from preforked workers sharing model and index memory")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--threads", type=int, default=None, help="Torch threads per worker (default: cores / workers)")
+    parser.add_argument("--backlog", type=int, default=2048)
+    parser.add_argument("--log-level", default="info")
+    options = parser.parse_args()
+    threads = options.threads or max(1, (os.cpu_count() or 1) // options.workers)
+
+    for module in PRELOAD_MODULES:
+        __import__(module)
+    # A single thread keeps torch from starting a thread pool that the
+    # forked children would inherit in an unusable state
+    torch.set_num_threads(1)
+    shared_index.preload_models()
+    # Objects that survive until the fork are never collected, so the
+    # collector does not write to (and un-share) their pages in the children
+    gc.collect()
+    gc.freeze()
+
+    os.makedirs(settings.SHARED_INDEX_DIRECTORY, exist_ok=True)
+    children: Dict[int, str] = {_start_writer(): "writer"}
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((options.host, options.port))
+    sock.listen(options.backlog)
+    for _ in range(options.workers):
+        children[_fork(_run_worker, sock, threads, options.log_level)] = "worker"
+    print(f"Serving on {options.host}:{options.port} with {options.workers} workers", file=sys.stderr)
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        role = children.pop(pid, None)
+        if stopping or role is None:
+            continue
+        print(f"{role.capitalize()} {pid} exited with status {status}, restarting", file=sys.stderr)
+        time.sleep(1)
+        if role == "writer":
+            children[_start_writer()] = "writer"
+        else:
+            children[_fork(_run_worker, sock, threads, options.log_level)] = "worker"
+
+
+if __name__ == "__main__":
+    run()
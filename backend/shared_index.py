@@ -0,0 +1,423 @@
+import os
+import time
+import shutil
+import threading
+import functools
+from multiprocessing.connection import Client, Listener
+from typing import List, Dict, Any, Optional, Callable, Iterable
+import numpy as np
+from sentence_transformers import SentenceTransformer
+from config import settings
+from instrumentation import stage, timed
+from vector_store import IndexHandle, IndexVersionRegistry, similar_in_index
+from index_snapshot import SnapshotIndex, SnapshotDocument, SNAPSHOT_FILE, LOG_FILE, encode_log_record
+
+CURRENT_FILE = "CURRENT"
+GENERATION_PREFIX = "gen-"
+
+# Embedding models loaded by the serving process before it forks (serve.py),
+# shared copy-on-write with every worker
+preloaded_models: Dict[str, SentenceTransformer] = {}
+
+
+def preload_models() -> Dict[str, SentenceTransformer]:
+    """Load the embedding model of the active index version into preloaded_models"""
+    registry = IndexVersionRegistry()
+    model_name = registry.get(registry.active)["model_name"]
+    if model_name not in preloaded_models:
+        preloaded_models[model_name] = SentenceTransformer(model_name)
+    return preloaded_models
+
+
+def _authkey() -> bytes:
+    # Generated per run by serve.py and inherited by the writer and workers
+    return bytes.fromhex(os.environ.get("SHARED_INDEX_AUTHKEY", ""))
+
+
+def read_current(directory: str) -> Optional[str]:
+    """Get the name of the generation workers should serve, or None before the first publish"""
+    try:
+        with open(os.path.join(directory, CURRENT_FILE), "r", encoding="utf-8") as file:
+            return file.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def write_generation(vector_store, directory: str) -> str:
+    """
+    Write the active version of a VectorStore, without deleted documents,
+    as a new generation and make it the current one.
+
+    A generation is a directory holding a snapshot file (index_snapshot.py)
+    that workers memory-map: the embedding matrix, chunk texts, document
+    table and filter columns in one file. Later changes are appended to the
+    generation's log (append_changes) and replayed by the workers. The
+    snapshot is copied from the writer's own snapshot and append log when
+    those are enabled, otherwise exported from the collection.
+
+    Returns:
+        Name of the generation
+    """
+    current = read_current(directory)
+    number = int(current[len(GENERATION_PREFIX):len(GENERATION_PREFIX) + 8]) + 1 if current else 1
+    name = f"{GENERATION_PREFIX}{number:08d}"
+    path = os.path.join(directory, name)
+    os.makedirs(path, exist_ok=True)
+    vector_store.write_snapshot(os.path.join(path, SNAPSHOT_FILE))
+    open(os.path.join(path, LOG_FILE), "wb").close()
+
+    current_path = os.path.join(directory, CURRENT_FILE)
+    with open(f"{current_path}.tmp", "w", encoding="utf-8") as file:
+        file.write(name)
+    os.replace(f"{current_path}.tmp", current_path)
+    return name
+
+
+def append_changes(directory: str, name: str, documents: Iterable[SnapshotDocument]):
+    """
+    Append changed documents to a generation's log, where workers pick them
+    up. Documents with None texts were deleted.
+    """
+    with open(os.path.join(directory, name, LOG_FILE), "ab") as log:
+        for document_id, metadata, texts, embeddings in documents:
+            if texts is None:
+                log.write(encode_log_record("delete", document_id))
+            else:
+                log.write(encode_log_record("add", document_id, metadata, texts, embeddings))
+        log.flush()
+        os.fsync(log.fileno())
+
+
+def prune_generations(directory: str, keep: int):
+    """
+    Delete all but the newest keep generations. Workers still reading a
+    deleted generation keep their mappings until they move on.
+    """
+    names = sorted(
+        name for name in os.listdir(directory) if name.startswith(GENERATION_PREFIX) and not name.endswith(".tmp")
+    )
+    current = read_current(directory)
+    for name in names[:-keep] if keep else names:
+        if name != current:
+            path = os.path.join(directory, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                # Written when generations were single snapshot files
+                os.remove(path)
+
+
+class SharedVectorStore:
+    """
+    VectorStore of a preforked worker (see serve.py).
+
+    Searches and chunk reads are served from the generation the index
+    writer last published, memory-mapped and shared by all workers, with
+    the changes the writer appended to its log since. At most every
+    SHARED_INDEX_REFRESH_INTERVAL seconds the log is caught up on, or a
+    newer generation is picked up with a single assignment. Embeddings are
+    computed here with the preloaded model and every change is sent to the
+    writer, so it shows up in searches once the writer has published it.
+    """
+
+    use_mock = False
+
+    def __init__(self, directory: str = None, writer: "WriterClient" = None,
+                 models: Dict[str, SentenceTransformer] = None):
+        """
+        Args:
+            directory: Directory the writer publishes generations to
+            writer: Connection to the index writer
+            models: Embedding models already loaded, by name
+        """
+        self.directory = directory or settings.SHARED_INDEX_DIRECTORY
+        self.writer = writer or WriterClient()
+        self.models = dict(preloaded_models if models is None else models)
+        self._models_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._checked_at = 0.0
+        # Called with the new registry entry when another version starts serving
+        self.version_listeners: List[Callable[[Dict[str, Any]], None]] = []
+
+        registry = IndexVersionRegistry()
+        version = registry.get(registry.active)
+        self._handle = IndexHandle(version, self.get_model(version["model_name"]), None)
+        self.refresh()
+
+    @property
+    def version(self) -> Dict[str, Any]:
+        """Registry entry of the index version serving searches"""
+        return self._current().version
+
+    @property
+    def model(self) -> SentenceTransformer:
+        return self._current().model
+
+    def get_model(self, model_name: str) -> SentenceTransformer:
+        """Get an embedding model, loading it once if it was not preloaded"""
+        with self._models_lock:
+            if model_name not in self.models:
+                self.models[model_name] = SentenceTransformer(model_name)
+            return self.models[model_name]
+
+    def refresh(self):
+        """Open the current generation if the writer has published a newer one, else catch up on its log"""
+        name = read_current(self.directory)
+        handle = self._handle
+        if name is None:
+            return
+        if handle.collection is not None and os.path.basename(handle.collection.directory) == name:
+            handle.collection.catch_up()
+            return
+        generation = SnapshotIndex(os.path.join(self.directory, name), read_only=True)
+        model = self.get_model(generation.version["model_name"])
+        self._handle = IndexHandle(generation.version, model, generation)
+        if generation.version["name"] != handle.version["name"]:
+            for listener in self.version_listeners:
+                listener(generation.version)
+
+    def _current(self) -> IndexHandle:
+        now = time.monotonic()
+        if now - self._checked_at >= settings.SHARED_INDEX_REFRESH_INTERVAL and self._refresh_lock.acquire(blocking=False):
+            try:
+                self._checked_at = now
+                self.refresh()
+            except Exception as e:
+                # e.g. the generation was pruned between reading CURRENT and opening it
+                print(f"Opening the shared index failed: {e}")
+            finally:
+                self._refresh_lock.release()
+        return self._handle
+
+    def add_document(self, document_id: str, text_chunks: List[str], metadata: Dict[str, Any] = None,
+                     embeddings: Optional[np.ndarray] = None):
+        if not text_chunks:
+            return
+        if embeddings is None:
+            with stage("vector_store.encode"):
+                embeddings = self._current().model.encode(text_chunks)
+        self.writer.call("vector_store", "add_document", document_id, text_chunks, metadata, np.asarray(embeddings))
+
+    def update_document_tags(self, document_id: str, tag_ids: List[str], previous_tag_ids: List[str] = None):
+        self.writer.call("vector_store", "update_document_tags", document_id, tag_ids, previous_tag_ids)
+
+    def delete_document(self, document_id: str, chunk_count: int = 0):
+        self.delete_documents({document_id: chunk_count})
+
+    def delete_documents(self, documents: Dict[str, int]):
+        if documents:
+            self.writer.call("vector_store", "delete_documents", documents)
+
+    def compact(self, batch_size: int = None) -> int:
+        return self.writer.call("vector_store", "compact", batch_size)
+
+    def merge_snapshot(self, force: bool = False) -> bool:
+        return self.writer.call("vector_store", "merge_snapshot", force)
+
+    def snapshot_status(self) -> Dict[str, Any]:
+        return self.writer.call("vector_store", "snapshot_status")
+
+    def search(self, query: str, limit: int = 5, filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """Search for similar documents using the query, optionally pre-filtered by metadata"""
+        handle = self._current()
+        if handle.collection is None:
+            return []
+        with stage("vector_store.encode"):
+            query_embedding = handle.model.encode(query)
+        with stage("vector_store.shared_query"):
+            return handle.collection.search(query_embedding, limit, filters)
+
+    def count_chunks(self) -> int:
+        generation = self._current().collection
+        return generation.chunk_count if generation is not None else 0
+
+    @timed("vector_store.shared_read")
+    def get_document_embeddings(self, document_id: str) -> tuple:
+        generation = self._current().collection
+        if generation is None:
+            return [], None
+        return generation.document_chunks(document_id)
+
+    @timed("vector_store.similar")
+    def get_similar_documents(self, document_id: str, limit: int = 3) -> List[Dict[str, Any]]:
+        """Find documents similar to a given document"""
+        generation = self._current().collection
+        if generation is None:
+            return []
+        return similar_in_index(generation, document_id, limit)
+
+
+class WriterClient:
+    """Sends calls to the index writer process, over one connection per thread"""
+
+    def __init__(self, address: str = None, authkey: bytes = None):
+        self.address = address or settings.SHARED_INDEX_WRITER_ADDRESS
+        self.authkey = authkey or _authkey()
+        self._local = threading.local()
+
+    def call(self, target: str, method: str, *args, **kwargs):
+        """
+        Call a method of an object in the writer process.
+
+        Raises:
+            Whatever the method raised, re-raised here
+        """
+        connection = getattr(self._local, "connection", None)
+        for attempt in range(2):
+            try:
+                if connection is None:
+                    connection = self._local.connection = Client(self.address, authkey=self.authkey)
+                connection.send((target, method, args, kwargs))
+                break
+            except (OSError, EOFError):
+                # A connection left over from before the writer restarted
+                self._local.connection = connection = None
+                if attempt:
+                    raise
+        try:
+            status, value = connection.recv()
+        except (OSError, EOFError):
+            self._local.connection = None
+            raise
+        if status == "error":
+            raise value
+        return value
+
+
+class WriterProxy:
+    """Stands in for an object living in the writer process; method calls are forwarded to it"""
+
+    def __init__(self, client: WriterClient, target: str):
+        self.client = client
+        self.target = target
+
+    def __getattr__(self, method: str):
+        return functools.partial(self.client.call, self.target, method)
+
+
+class IndexWriter:
+    """
+    The only process that changes the vector index. It serves the calls
+    workers send over a Unix socket and, after calls that change what
+    searches return, publishes the changes. Changes arriving within
+    publish_delay of each other are published together.
+
+    Changes are appended to the current generation's log as long as the
+    writer's snapshot is the one that generation was copied from. A new
+    generation is written only once that snapshot has been merged (see
+    VectorStore.merge_snapshot), another version starts serving, or when
+    snapshots are disabled.
+    """
+
+    # Calls after which a new generation is published
+    PUBLISHING_CALLS = {
+        "add_document", "update_document_tags", "delete_document", "delete_documents", "switch", "rollback"
+    }
+
+    def __init__(self, vector_store, targets: Dict[str, Any], directory: str = None, address: str = None,
+                 authkey: bytes = None, publish_delay: float = None, keep_generations: int = None):
+        """
+        Args:
+            vector_store: VectorStore owning the Chroma collections
+            targets: Objects workers may call, by name
+            directory: Directory to publish generations to
+            address: Unix socket to listen on
+            authkey: Key workers must authenticate with
+            publish_delay: Seconds to wait for more changes before publishing
+            keep_generations: Generations kept on disk, including the current one
+        """
+        self.vector_store = vector_store
+        self.targets = targets
+        self.directory = directory or settings.SHARED_INDEX_DIRECTORY
+        self.address = address or settings.SHARED_INDEX_WRITER_ADDRESS
+        self.authkey = authkey or _authkey()
+        self.publish_delay = settings.SHARED_INDEX_PUBLISH_DELAY if publish_delay is None else publish_delay
+        self.keep_generations = keep_generations or settings.SHARED_INDEX_KEEP_GENERATIONS
+        self._changed = threading.Event()
+        self._publish_lock = threading.Lock()
+        # The writer's snapshot the current generation was copied from, and
+        # the sequence number of the last change published to it
+        self._generation: Optional[str] = None
+        self._base = None
+        self._sequence = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def publish(self) -> str:
+        """
+        Publish the changes to the active index version since the last call,
+        appended to the current generation or as a new one.
+
+        Returns:
+            Name of the generation workers serve the changes from
+        """
+        with self._publish_lock:
+            state = self.vector_store.snapshot_changes(self._sequence)
+            if state is not None and self._base is not None and state[0] is self._base:
+                _, sequence, documents = state
+                if documents:
+                    with stage("shared_index.publish_changes"):
+                        append_changes(self.directory, self._generation, documents)
+                self._sequence = sequence
+                return self._generation
+
+            # Changes made while the generation is written are appended again
+            # afterwards, which replays to the same result
+            base, sequence = state[:2] if state is not None else (None, 0)
+            with stage("shared_index.publish"):
+                name = write_generation(self.vector_store, self.directory)
+            self._generation, self._base, self._sequence = name, base, sequence
+            prune_generations(self.directory, self.keep_generations)
+            return name
+
+    def serve_forever(self, on_ready: Callable[[], None] = None):
+        """Accept worker connections until the process exits"""
+        try:
+            os.remove(self.address)
+        except FileNotFoundError:
+            pass
+        listener = Listener(self.address, family="AF_UNIX", authkey=self.authkey)
+        threading.Thread(target=self._publish_changes, name="shared-index-publisher", daemon=True).start()
+        if on_ready is not None:
+            on_ready()
+        while True:
+            try:
+                connection = listener.accept()
+            except Exception as e:
+                # Failed handshakes, e.g. a wrong authkey
+                print(f"Rejected index writer connection: {e}")
+                continue
+            threading.Thread(target=self._serve, args=(connection,), daemon=True).start()
+
+    def _serve(self, connection):
+        with connection:
+            while True:
+                try:
+                    target, method, args, kwargs = connection.recv()
+                except (OSError, EOFError):
+                    return
+                try:
+                    if method.startswith("_"):
+                        raise AttributeError(f"{method} cannot be called remotely")
+                    reply = ("ok", getattr(self.targets[target], method)(*args, **kwargs))
+                    if method in self.PUBLISHING_CALLS:
+                        self._changed.set()
+                except Exception as e:
+                    reply = ("error", e)
+                try:
+                    connection.send(reply)
+                except (OSError, EOFError):
+                    return
+                except Exception as e:
+                    # The result or exception could not be pickled
+                    connection.send(("error", Exception(str(e))))
+
+    def _publish_changes(self):
+        while True:
+            self._changed.wait()
+            time.sleep(self.publish_delay)
+            self._changed.clear()
+            try:
+                self.publish()
+            except Exception as e:
+                print(f"Publishing the shared index failed: {e}")
+                self._changed.set()
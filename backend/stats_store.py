@@ -0,0 +1,218 @@
+import copy
+import datetime
+import threading
+from typing import Dict, Any
+from config import settings
+
+STATS_COLLECTION = "stats"
+STATS_DOCUMENT = "global"
+
+
+def _empty_counts() -> Dict[str, Any]:
+    return {"total_documents": 0, "total_bytes": 0, "total_chunks": 0, "by_type": {}, "by_user": {}}
+
+
+def _empty_stats() -> Dict[str, Any]:
+    return {**_empty_counts(), "reconciled_at": None}
+
+
+def _add_counts(counts: Dict[str, Any], delta: Dict[str, Any]):
+    """Add the counters of delta to counts in place, dropping map entries that reach zero"""
+    for key in ("total_documents", "total_bytes", "total_chunks"):
+        counts[key] = counts.get(key, 0) + delta.get(key, 0)
+    for key in ("by_type", "by_user"):
+        for value, count in (delta.get(key) or {}).items():
+            total = counts[key].get(value, 0) + count
+            if total > 0:
+                counts[key][value] = total
+            else:
+                counts[key].pop(value, None)
+
+
+class StatsStore:
+    """
+    Keeps corpus-wide counters (documents by type and user, bytes, chunks)
+    up to date as documents are stored and deleted, so statistics can be
+    read from a single record instead of scanning the corpus.
+
+    Every update is also added to a "pending" map on the record, which a
+    reconciliation clears before it scans the corpus and adds to its result
+    when it commits, so updates made during the scan are kept.
+    """
+
+    def __init__(self, use_mock: bool = False):
+        """
+        Initialize the stats store.
+
+        Args:
+            use_mock: If True, keep the counters in memory instead of Firestore
+        """
+        self.use_mock = use_mock
+        self._lock = threading.Lock()
+
+        if not use_mock:
+            # DocumentStore initializes the Firebase app
+            from firebase_admin import firestore
+            self._firestore = firestore
+            self.client = firestore.client()
+            self.ref = self.client.collection(STATS_COLLECTION).document(STATS_DOCUMENT)
+        else:
+            self.mock_stats = _empty_stats()
+            # Updates made while a reconciliation scans, None when none runs
+            self.mock_pending = None
+
+    def record_document_added(self, document: Dict[str, Any], chunk_count: int = 0):
+        """
+        Count a newly stored document.
+
+        Args:
+            document: Document metadata as returned by DocumentStore
+            chunk_count: Number of chunks indexed for the document
+        """
+        self._apply(document, chunk_count, 1)
+
+    def record_document_removed(self, document: Dict[str, Any]):
+        """
+        Uncount a deleted document.
+
+        Args:
+            document: Document metadata as it was before deletion
+        """
+        self._apply(document, document.get("chunkCount", 0), -1)
+
+    def _apply(self, document: Dict[str, Any], chunk_count: int, sign: int):
+        file_type = document.get("fileType", "unknown")
+        user_id = document.get("uploadedBy", "unknown")
+        file_size = document.get("fileSize", 0) or 0
+
+        if self.use_mock:
+            delta = {
+                "total_documents": sign,
+                "total_bytes": sign * file_size,
+                "total_chunks": sign * chunk_count,
+                "by_type": {file_type: sign},
+                "by_user": {user_id: sign}
+            }
+            with self._lock:
+                _add_counts(self.mock_stats, delta)
+                if self.mock_pending is not None:
+                    _add_counts(self.mock_pending, delta)
+            return
+
+        increment = self._firestore.Increment
+        delta = {
+            "total_documents": increment(sign),
+            "total_bytes": increment(sign * file_size),
+            "total_chunks": increment(sign * chunk_count),
+            "by_type": {file_type: increment(sign)},
+            "by_user": {user_id: increment(sign)}
+        }
+        try:
+            # Nested dicts with merge=True avoid escaping user IDs as field paths
+            self.ref.set({**delta, "pending": delta}, merge=True)
+        except Exception as e:
+            raise Exception(f"Failed to update stats: {str(e)}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get the current counters.
+
+        Returns:
+            Dict with total_documents, total_bytes, total_chunks, by_type,
+            by_user and reconciled_at
+        """
+        if self.use_mock:
+            with self._lock:
+                return copy.deepcopy(self.mock_stats)
+
+        try:
+            doc = self.ref.get()
+            stats = _empty_stats()
+            if doc.exists:
+                stats.update(doc.to_dict())
+            stats.pop("pending", None)
+            # Decrements can leave zero entries behind in Firestore maps
+            stats["by_type"] = {k: v for k, v in stats["by_type"].items() if v > 0}
+            stats["by_user"] = {k: v for k, v in stats["by_user"].items() if v > 0}
+            return stats
+        except Exception as e:
+            raise Exception(f"Failed to get stats: {str(e)}")
+
+    def seconds_until_reconcile(self, interval: float) -> float:
+        """
+        Get how long until the counters are due for reconciliation, so a
+        restarted process does not rescan every document at once.
+
+        Args:
+            interval: Seconds between reconciliations
+
+        Returns:
+            Seconds left, 0 if they were never reconciled or are overdue
+        """
+        reconciled_at = self.get_stats().get("reconciled_at")
+        if not reconciled_at:
+            return 0.0
+        elapsed = (datetime.datetime.now() - datetime.datetime.fromisoformat(reconciled_at)).total_seconds()
+        return max(0.0, interval - elapsed)
+
+    def reconcile(self, document_store, vector_store) -> Dict[str, Any]:
+        """
+        Recompute every counter from the source of truth and overwrite the
+        stored values, correcting any drift from failed or concurrent updates.
+
+        Args:
+            document_store: DocumentStore to page through
+            vector_store: VectorStore used for the chunk count
+
+        Returns:
+            The reconciled stats
+        """
+        # Start collecting the updates made from here on; the chunk count is
+        # read now so chunks indexed during the scan are counted once
+        if self.use_mock:
+            with self._lock:
+                self.mock_pending = _empty_counts()
+        else:
+            try:
+                self.ref.set({"pending": {}}, merge=["pending"])
+            except Exception as e:
+                raise Exception(f"Failed to reconcile stats: {str(e)}")
+        stats = _empty_stats()
+        stats["total_chunks"] = vector_store.count_chunks()
+
+        try:
+            for doc in document_store.iter_documents(page_size=settings.STATS_RECONCILE_PAGE_SIZE):
+                file_type = doc.get("fileType", "unknown")
+                user_id = doc.get("uploadedBy", "unknown")
+                stats["total_documents"] += 1
+                stats["total_bytes"] += doc.get("fileSize", 0) or 0
+                stats["by_type"][file_type] = stats["by_type"].get(file_type, 0) + 1
+                stats["by_user"][user_id] = stats["by_user"].get(user_id, 0) + 1
+        except BaseException:
+            if self.use_mock:
+                with self._lock:
+                    self.mock_pending = None
+            raise
+        stats["reconciled_at"] = datetime.datetime.now().isoformat()
+
+        if self.use_mock:
+            with self._lock:
+                _add_counts(stats, self.mock_pending)
+                self.mock_pending = None
+                self.mock_stats = stats
+            return copy.deepcopy(stats)
+
+        @self._firestore.transactional
+        def commit(transaction):
+            # Updates made during the scan are added to the scanned counts
+            snapshot = self.ref.get(transaction=transaction)
+            pending = (snapshot.to_dict() or {}).get("pending") or {}
+            result = copy.deepcopy(stats)
+            _add_counts(result, pending)
+            transaction.set(self.ref, {**result, "pending": {}})
+            return result
+
+        try:
+            return commit(self.client.transaction())
+        except Exception as e:
+            raise Exception(f"Failed to reconcile stats: {str(e)}")
@@ -0,0 +1,201 @@
+import time
+import asyncio
+from typing import List, Any, Optional, Dict, AsyncIterator
+from config import settings
+from llm_cache import LLMCache
+from tokens import count_tokens, split_by_tokens
+
+
+class MapReduceSummarizer:
+    """
+    Summarizes a list of chunks by running the map prompt over every chunk
+    concurrently, then combining the partial summaries in a tree so that no
+    combine prompt exceeds the context budget. Concurrency, rate limits and
+    retries are left to the LLM client (LLMGateway).
+    """
+
+    def __init__(self, llm: Any, model_name: str, map_template: str, combine_template: str,
+                 context_tokens: int = None, cache: Optional[LLMCache] = None):
+        """
+        Args:
+            llm: Language model exposing apredict and astream, e.g. LLMGateway.model()
+            model_name: Model name, used for cache keys
+            map_template: Prompt applied to each chunk, with a {text} placeholder
+            combine_template: Prompt combining partial summaries, with a {text} placeholder
+            context_tokens: Maximum prompt size of a single combine call
+            cache: Optional response cache for individual calls
+        """
+        self.llm = llm
+        self.model_name = model_name
+        self.map_template = map_template
+        self.combine_template = combine_template
+        self.context_tokens = context_tokens or settings.SUMMARY_CONTEXT_TOKENS
+        self.cache = cache
+
+    async def summarize(self, chunks: List[str], **llm_kwargs) -> str:
+        """
+        Summarize the chunks of a document.
+
+        Args:
+            chunks: Text chunks, in document order
+            llm_kwargs: Extra arguments (such as max_tokens) for the final combine call
+
+        Returns:
+            The combined summary
+        """
+        if not chunks:
+            return ""
+        summaries = await asyncio.gather(*(self.map(chunk) for chunk in chunks))
+        if len(summaries) == 1:
+            return summaries[0]
+        return await self.reduce(list(summaries), **llm_kwargs)
+
+    async def summarize_events(self, chunks: List[str], **llm_kwargs) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Summarize like summarize(), yielding progress as it happens:
+        {"event": "map", ...} as each chunk finishes, {"event": "reduce", ...}
+        per intermediate combine level, then {"event": "token", ...} for each
+        piece of the final call's output.
+
+        Closing the generator (e.g. because the client went away) cancels
+        every LLM call still in flight.
+        """
+        if not chunks:
+            return
+        if len(chunks) == 1:
+            async for token in self.stream(self.map_template, chunks[0], **llm_kwargs):
+                yield {"event": "token", "data": token}
+            return
+
+        tasks = [asyncio.ensure_future(self.map(chunk)) for chunk in chunks]
+        try:
+            for completed, future in enumerate(asyncio.as_completed(tasks), start=1):
+                await future
+                yield {"event": "map", "data": {"completed": completed, "total": len(tasks)}}
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        async for event in self.reduce_events([task.result() for task in tasks], **llm_kwargs):
+            yield event
+
+    async def reduce_events(self, summaries: List[str], **llm_kwargs) -> AsyncIterator[Dict[str, Any]]:
+        """Like reduce(), yielding a "reduce" event per level and streaming the final combine"""
+        if len(summaries) == 1:
+            yield {"event": "token", "data": summaries[0]}
+            return
+
+        level, stalled = 0, False
+        groups = self._group(summaries)
+        while len(groups) > 1:
+            level += 1
+            yield {"event": "reduce", "data": {"level": level, "groups": len(groups)}}
+            previous = len(summaries)
+            summaries = await asyncio.gather(*(
+                self._call(self.combine_template, "\n\n".join(group)) for group in groups
+            ))
+            stalled = stalled or len(summaries) >= previous
+            groups = self._group(summaries, pairs=stalled)
+
+        async for token in self.stream(self.combine_template, "\n\n".join(groups[0]), **llm_kwargs):
+            yield {"event": "token", "data": token}
+
+    async def stream(self, template: str, text: str, **llm_kwargs) -> AsyncIterator[str]:
+        """
+        Stream the output of a single call as it is generated. Cached
+        responses are replayed in one piece; fresh ones are cached only
+        once the stream completes.
+        """
+        key = None
+        if self.cache is not None:
+            key = self.cache.make_key(self.model_name, template, text, llm_kwargs)
+            cached = await asyncio.to_thread(self.cache.get, key)
+            if cached is not None:
+                yield cached
+                return
+
+        prompt = template.format(text=text)
+        pieces = []
+        start = time.perf_counter()
+        async for chunk in self.llm.astream(prompt, **llm_kwargs):
+            # Chat models yield message chunks, plain LLMs yield strings
+            piece = getattr(chunk, "content", chunk)
+            if piece:
+                pieces.append(piece)
+                yield piece
+
+        if key is not None:
+            value = "".join(pieces).strip()
+            await asyncio.to_thread(
+                self.cache.put, key, value, latency=time.perf_counter() - start,
+                tokens=count_tokens(prompt, self.model_name) + count_tokens(value, self.model_name)
+            )
+
+    async def map(self, chunk: str, **llm_kwargs) -> str:
+        """Summarize a single chunk with the map prompt"""
+        return await self._call(self.map_template, chunk, **llm_kwargs)
+
+    async def reduce(self, summaries: List[str], **llm_kwargs) -> str:
+        """
+        Combine partial summaries level by level until one remains. Each
+        level packs neighbouring summaries into groups that fit the context
+        budget and combines the groups concurrently. Once a level leaves as
+        many summaries as it started with (the model's outputs were no
+        shorter), every later level pairs them, so the tree always ends.
+        """
+        previous, stalled = None, False
+        while len(summaries) > 1:
+            stalled = stalled or (previous is not None and len(summaries) >= previous)
+            groups = self._group(summaries, pairs=stalled)
+            previous = len(summaries)
+            final = len(groups) == 1
+            summaries = await asyncio.gather(*(
+                self._call(self.combine_template, "\n\n".join(group), **(llm_kwargs if final else {}))
+                for group in groups
+            ))
+        return summaries[0]
+
+    def _group(self, summaries: List[str], pairs: bool = False) -> List[List[str]]:
+        """
+        Pack neighbouring summaries into groups that fit the combine budget.
+        A summary too large to share a group is combined on its own, which
+        shrinks it for the next level; one larger than the whole budget is
+        first split so no prompt overflows.
+
+        With pairs, neighbours are combined two at a time instead, each cut
+        to half the budget, which halves the number of summaries.
+        """
+        budget = self.context_tokens - count_tokens(self.combine_template, self.model_name)
+        if pairs:
+            half = budget // 2
+            summaries = [
+                split_by_tokens(summary, half, self.model_name)[0]
+                if count_tokens(summary, self.model_name) > half else summary
+                for summary in summaries
+            ]
+            return [summaries[i:i + 2] for i in range(0, len(summaries), 2)]
+        groups, current, current_tokens = [], [], 0
+        for summary in summaries:
+            tokens = count_tokens(summary, self.model_name)
+            pieces = split_by_tokens(summary, budget, self.model_name) if tokens > budget else [summary]
+            for piece in pieces:
+                if len(pieces) > 1:
+                    tokens = count_tokens(piece, self.model_name)
+                if current and current_tokens + tokens > budget:
+                    groups.append(current)
+                    current, current_tokens = [], 0
+                current.append(piece)
+                current_tokens += tokens
+        if current:
+            groups.append(current)
+        return groups
+
+    async def _call(self, template: str, text: str, **llm_kwargs) -> str:
+        prompt = template.format(text=text)
+
+        async def generate() -> str:
+            return (await self.llm.apredict(prompt, **llm_kwargs)).strip()
+
+        if self.cache is None:
+            return await generate()
+        return await self.cache.aget_or_generate(self.model_name, template, text, llm_kwargs, generate)
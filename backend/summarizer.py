@@ -1,18 +1,27 @@
-from typing import Dict, Any
-from langchain.chat_models import ChatOpenAI
-from langchain.chains.summarize import load_summarize_chain
-from langchain.docstore.document import Document
+from typing import Dict, Any, Callable, Awaitable, List, AsyncIterator
 from langchain.prompts import PromptTemplate
 import os
+import time
+import asyncio
 from config import settings
+from llm_cache import LLMCache
+from tokens import count_tokens, split_by_tokens
+from extractive_summarizer import ExtractiveSummarizer
+from instrumentation import timed
+from llm_gateway import LLMGateway
+from summarization_engine import MapReduceSummarizer
+
+KEY_POINTS_TEMPLATE = """Extract 3-5 key points from this summary as a list:
+        {summary}
+        """
 
 class DocumentSummarizer:
-    def __init__(self):
-        self.llm = ChatOpenAI(
-            temperature=0,
-            model_name="gpt-3.5-turbo-16k",
-            openai_api_key=settings.OPENAI_API_KEY
-        )
+    def __init__(self, cache: LLMCache = None, gateway: LLMGateway = None):
+        self.gateway = gateway or LLMGateway()
+        self.model_name = "local" if self.gateway.local else "gpt-3.5-turbo-16k"
+        self.llm = self.gateway.model(self.model_name, temperature=0)
+        self.cache = cache
+        self.extractive = ExtractiveSummarizer()
         
         # Custom prompt for better summaries
         self.summary_prompt = PromptTemplate(
@@ -27,23 +36,46 @@ class DocumentSummarizer:
             Summary:"""
         )
         
-    def generate_summary(self, text: str, summary_type: str = "general", max_tokens: int = 500) -> Dict[str, Any]:
+        self.bullet_prompt = PromptTemplate(
+            input_variables=["text"],
+            template="""Extract the main points from the following text as a bulleted list:
+            
+            Text: {text}
+            
+            Main Points:"""
+        )
+        
+        self.general_engine = self._create_engine(self.summary_prompt)
+        self.bullet_point_engine = self._create_engine(self.bullet_prompt)
+        
+    def _create_engine(self, prompt: PromptTemplate) -> MapReduceSummarizer:
+        """Create a map-reduce engine using the prompt for both phases"""
+        return MapReduceSummarizer(
+            llm=self.llm,
+            model_name=self.model_name,
+            map_template=prompt.template,
+            combine_template=prompt.template,
+            cache=self.cache
+        )
+        
+    async def _cached(self, template: str, text: str, params: Dict[str, Any],
+                      generate: Callable[[], Awaitable[str]], document_id: str = None) -> str:
+        """Run an LLM call through the response cache when one is configured"""
+        if self.cache is None:
+            return await generate()
+        return await self.cache.aget_or_generate(self.model_name, template, text, params, generate, document_id)
+        
+    @timed("summarizer.generate")
+    async def generate_summary(self, text: str, summary_type: str = "general", max_tokens: int = 500,
+                               document_id: str = None) -> Dict[str, Any]:
         """Generate a summary of the document"""
         try:
-            # Split text into chunks if it's too long
-            docs = [Document(page_content=chunk) for chunk in self._split_text(text)]
-            
-            # Choose summarization strategy based on summary type
-            if summary_type == "bullet_points":
-                summary_chain = self._create_bullet_point_chain()
-            else:
-                summary_chain = self._create_general_chain()
-                
-            # Generate summary
-            summary = summary_chain.run(docs)
+            summary = await self.summarize_chunks(
+                self._split_text(text), max_tokens, summary_type, document_id, source_text=text
+            )
             
             # Extract key points
-            key_points = self._extract_key_points(summary)
+            key_points = await self.extract_key_points(summary, document_id)
             
             return {
                 "summary": summary,
@@ -59,66 +91,181 @@ class DocumentSummarizer:
                 "key_points": []
             }
             
-    def _split_text(self, text: str, max_chunk_size: int = 4000) -> list:
-        """Split text into chunks for processing"""
-        words = text.split()
-        chunks = []
-        current_chunk = []
-        current_size = 0
-        
-        for word in words:
-            word_size = len(word) + 1  # +1 for space
-            if current_size + word_size > max_chunk_size:
-                chunks.append(" ".join(current_chunk))
-                current_chunk = [word]
-                current_size = word_size
-            else:
-                current_chunk.append(word)
-                current_size += word_size
-                
-        if current_chunk:
-            chunks.append(" ".join(current_chunk))
-            
-        return chunks
+    @timed("summarizer.map_reduce")
+    async def summarize_chunks(self, chunks: List[str], max_tokens: int = 500, summary_type: str = "general",
+                               document_id: str = None, source_text: str = None) -> str:
+        """
+        Summarize a document given as text chunks. Map calls over the chunks
+        run concurrently and partial summaries are combined in a tree.
+        """
+        engine = self._engine_for(summary_type)
+        text = source_text if source_text is not None else "\n".join(chunks)
         
-    def _create_general_chain(self):
-        """Create a chain for general summarization"""
-        return load_summarize_chain(
-            llm=self.llm,
-            chain_type="map_reduce",
-            map_prompt=self.summary_prompt,
-            combine_prompt=self.summary_prompt,
-            verbose=False
+        return await self._cached(
+            engine.map_template,
+            text,
+            {"summary_type": summary_type, "max_tokens": max_tokens},
+            lambda: engine.summarize(self._map_chunks(chunks, text), max_tokens=max_tokens),
+            document_id
         )
         
-    def _create_bullet_point_chain(self):
-        """Create a chain for bullet point summarization"""
-        bullet_prompt = PromptTemplate(
-            input_variables=["text"],
-            template="""Extract the main points from the following text as a bulleted list:
-            
-            Text: {text}
-            
-            Main Points:"""
-        )
-        return load_summarize_chain(
-            llm=self.llm,
-            chain_type="map_reduce",
-            map_prompt=bullet_prompt,
-            combine_prompt=bullet_prompt,
-            verbose=False
+    async def stream_summary(self, chunks: List[str], max_tokens: int = 500, summary_type: str = "general",
+                             document_id: str = None, source_text: str = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streaming variant of summarize_chunks, yielding the engine's progress
+        and token events. The finished summary is cached like summarize_chunks,
+        under the same key, so either call serves the other's result.
+        """
+        engine = self._engine_for(summary_type)
+        text = source_text if source_text is not None else "\n".join(chunks)
+        params = {"summary_type": summary_type, "max_tokens": max_tokens}
+        
+        key = self.cache.make_key(self.model_name, engine.map_template, text, params) if self.cache else None
+        cached = await asyncio.to_thread(self.cache.get, key) if key else None
+        if cached is not None:
+            yield {"event": "token", "data": cached}
+            return
+        
+        pieces = []
+        start = time.perf_counter()
+        async for event in engine.summarize_events(self._map_chunks(chunks, text), max_tokens=max_tokens):
+            if event["event"] == "token":
+                pieces.append(event["data"])
+            yield event
+        
+        if key:
+            await asyncio.to_thread(self.cache.record, key, "".join(pieces).strip(),
+                                    time.perf_counter() - start, engine.map_template, text, document_id)
+        
+    def _engine_for(self, summary_type: str) -> MapReduceSummarizer:
+        """Choose summarization strategy based on summary type"""
+        if summary_type == "bullet_points":
+            return self.bullet_point_engine
+        return self.general_engine
+        
+    def _map_chunks(self, chunks: List[str], text: str) -> List[str]:
+        """
+        Get the chunks to send to the map phase. Very long documents are cut
+        down extractively first so fewer tokens and map calls go to the LLM.
+        """
+        limit = settings.SUMMARY_PRESHRINK_TOKENS
+        if limit and count_tokens(text, self.model_name) > limit:
+            return self._split_text(self.extractive.shrink(text, limit))
+        return chunks
+        
+    @timed("summarizer.extractive")
+    def summarize_extractive(self, text: str, summary_type: str = "general") -> Dict[str, Any]:
+        """Summarize locally by sentence extraction, without calling the LLM"""
+        summary = self.extractive.summarize(text, summary_type)
+        return {
+            "summary": summary,
+            "key_points": self.extractive.key_points(text),
+            "word_count": len(summary.split()),
+            "summary_type": summary_type
+        }
+        
+    @timed("summarizer.tree")
+    async def summarize_tree(self, tree: Dict[str, Any], max_tokens: int = 500, summary_type: str = "general",
+                             document_id: str = None) -> str:
+        """
+        Produce a summary from a prebuilt summary tree (see summary_tree.py).
+        A general summary is the tree's root and a detailed one its section
+        summaries, returned as they are when they fit max_tokens. Longer
+        ones, and bullet points, take one final pass over those nodes that
+        is held to max_tokens.
+        """
+        nodes = self._tree_nodes(tree, summary_type)
+        if not nodes:
+            return ""
+        
+        if summary_type != "bullet_points":
+            summary = "\n\n".join(nodes)
+            if count_tokens(summary, self.model_name) <= max_tokens:
+                return summary
+        
+        engine = self._engine_for(summary_type)
+        
+        async def final_pass() -> str:
+            if len(nodes) == 1:
+                return await engine.map(nodes[0], max_tokens=max_tokens)
+            return await engine.reduce(nodes, max_tokens=max_tokens)
+        
+        return await self._cached(
+            engine.map_template,
+            tree["document"]["hash"],
+            {"summary_type": summary_type, "max_tokens": max_tokens, "source": "summary_tree"},
+            final_pass,
+            document_id
         )
         
-    def _extract_key_points(self, summary: str) -> list:
-        """Extract key points from the summary"""
-        prompt = f"""Extract 3-5 key points from this summary as a list:
-        {summary}
+    async def stream_tree_summary(self, tree: Dict[str, Any], max_tokens: int = 500, summary_type: str = "general",
+                                  document_id: str = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streaming variant of summarize_tree. A final pass, when one is needed,
+        yields the engine's "reduce" and token events and is cached under
+        summarize_tree's key.
         """
+        nodes = self._tree_nodes(tree, summary_type)
+        if not nodes:
+            return
+        
+        if summary_type != "bullet_points":
+            summary = "\n\n".join(nodes)
+            if count_tokens(summary, self.model_name) <= max_tokens:
+                yield {"event": "token", "data": summary}
+                return
+        
+        engine = self._engine_for(summary_type)
+        params = {"summary_type": summary_type, "max_tokens": max_tokens, "source": "summary_tree"}
+        key = self.cache.make_key(self.model_name, engine.map_template, tree["document"]["hash"], params) \
+            if self.cache else None
+        cached = await asyncio.to_thread(self.cache.get, key) if key else None
+        if cached is not None:
+            yield {"event": "token", "data": cached}
+            return
+        
+        if len(nodes) == 1:
+            events = ({"event": "token", "data": token}
+                      async for token in engine.stream(engine.map_template, nodes[0], max_tokens=max_tokens))
+        else:
+            events = engine.reduce_events(nodes, max_tokens=max_tokens)
+        
+        pieces = []
+        start = time.perf_counter()
+        async for event in events:
+            if event["event"] == "token":
+                pieces.append(event["data"])
+            yield event
+        
+        if key:
+            await asyncio.to_thread(self.cache.record, key, "".join(pieces).strip(), time.perf_counter() - start,
+                                    engine.map_template, tree["document"]["hash"], document_id)
+        
+    def _tree_nodes(self, tree: Dict[str, Any], summary_type: str) -> List[str]:
+        """Tree nodes a summary of the given type is made from: the root for general summaries, else the sections"""
+        if summary_type == "general":
+            nodes = [tree["document"]["summary"]]
+        else:
+            nodes = [node["summary"] for node in tree["sections"]]
+        return [node for node in nodes if node]
+        
+    @timed("summarizer.split")
+    def _split_text(self, text: str, max_tokens: int = None) -> list:
+        """
+        Split text into the fewest chunks that fit the map prompt's token
+        budget, measured with the model's tokenizer and cut at sentence ends
+        """
+        return split_by_tokens(text, max_tokens or settings.SUMMARY_CHUNK_TOKENS, self.model_name)
+        
+    @timed("summarizer.key_points")
+    async def extract_key_points(self, summary: str, document_id: str = None) -> list:
+        """Extract key points from the summary"""
+        prompt = KEY_POINTS_TEMPLATE.format(summary=summary)
         
         try:
-            response = self.llm.predict(prompt)
+            response = await self._cached(KEY_POINTS_TEMPLATE, summary, {}, lambda: self.llm.apredict(prompt), document_id)
             # Split by newlines and clean up
             points = [p.strip().lstrip('•-*').strip() for p in response.split('\n') if p.strip()]
             return points[:5]  # Limit to 5 points
         except:
-            return []
\ No newline at end of file
+            return []
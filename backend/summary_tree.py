@@ -0,0 +1,145 @@
+import os
+import json
+import asyncio
+import datetime
+from typing import Dict, Any, List, Optional
+from config import settings
+from llm_cache import hash_text
+
+
+class SummaryTreeStore:
+    """
+    Persists per-document summary trees as JSON files.
+
+    A tree has three levels: one summary per chunk, one per section of
+    consecutive chunks, and one for the whole document. Each node keeps the
+    hash of its input so unchanged parts can be reused when the document is
+    re-ingested.
+    """
+
+    def __init__(self, directory: str = None):
+        self.directory = directory or settings.SUMMARY_TREE_DIRECTORY
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, document_id: str) -> str:
+        return os.path.join(self.directory, f"{document_id}.json")
+
+    def get(self, document_id: str) -> Optional[Dict[str, Any]]:
+        """Get the summary tree of a document, or None if it has not been built"""
+        try:
+            with open(self._path(document_id), "r", encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def save(self, document_id: str, tree: Dict[str, Any]):
+        """Write a summary tree, replacing any previous version atomically"""
+        path = self._path(document_id)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(tree, file)
+        os.replace(temp_path, path)
+
+    def delete(self, document_id: str):
+        """Delete the summary tree of a document"""
+        try:
+            os.remove(self._path(document_id))
+        except FileNotFoundError:
+            pass
+
+
+class SummaryTreeBuilder:
+    """
+    Builds and incrementally updates summary trees with the summarizer's
+    general map-reduce engine. Only chunks and sections whose input changed
+    since the previous build are sent to the LLM again.
+    """
+
+    def __init__(self, summarizer, store: SummaryTreeStore, section_size: int = None):
+        """
+        Args:
+            summarizer: DocumentSummarizer providing the engine and text splitting
+            store: Where trees are persisted
+            section_size: Number of chunk summaries combined into one section
+        """
+        self.summarizer = summarizer
+        self.store = store
+        self.section_size = section_size or settings.SUMMARY_SECTION_SIZE
+        # One lock per document being built, with the number of builds holding or awaiting it
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._lock_users: Dict[str, int] = {}
+
+    async def build(self, document_id: str, text: str) -> Dict[str, Any]:
+        """
+        Build or update the summary tree of a document.
+
+        Args:
+            document_id: The ID of the document
+            text: Full extracted text of the document
+
+        Returns:
+            The summary tree
+        """
+        lock = self._locks.setdefault(document_id, asyncio.Lock())
+        self._lock_users[document_id] = self._lock_users.get(document_id, 0) + 1
+        try:
+            async with lock:
+                tree = await self._build(document_id, text)
+                self.store.save(document_id, tree)
+                return tree
+        finally:
+            self._lock_users[document_id] -= 1
+            if not self._lock_users[document_id]:
+                del self._lock_users[document_id]
+                del self._locks[document_id]
+
+    async def _build(self, document_id: str, text: str) -> Dict[str, Any]:
+        engine = self.summarizer.general_engine
+        previous = self.store.get(document_id) or {}
+
+        # Level 0: chunk summaries, reused by content hash
+        chunk_texts = self.summarizer._split_text(text)
+        chunk_inputs = [(hash_text(chunk), chunk) for chunk in chunk_texts]
+        chunk_summaries = await self._summarize_changed(chunk_inputs, previous.get("chunks", []), engine.map)
+        chunks = [{"hash": h, "summary": s} for (h, _), s in zip(chunk_inputs, chunk_summaries)]
+
+        # Level 1: section summaries over runs of consecutive chunks
+        section_inputs = self._sections(chunks)
+        section_summaries = await self._summarize_changed(section_inputs, previous.get("sections", []), engine.reduce)
+        sections = [{"hash": h, "summary": s} for (h, _), s in zip(section_inputs, section_summaries)]
+
+        # Level 2: document summary over the sections
+        document_hash = hash_text("".join(node["hash"] for node in sections))
+        previous_document = previous.get("document") or {}
+        if previous_document.get("hash") == document_hash:
+            document_summary = previous_document["summary"]
+        else:
+            document_summary = await engine.reduce([node["summary"] for node in sections]) if sections else ""
+
+        return {
+            "document_id": document_id,
+            "content_hash": hash_text(text),
+            "chunks": chunks,
+            "sections": sections,
+            "document": {"hash": document_hash, "summary": document_summary},
+            "updated_at": datetime.datetime.now().isoformat()
+        }
+
+    def _sections(self, chunks: List[Dict[str, str]]) -> List[tuple]:
+        sections = []
+        for start in range(0, len(chunks), self.section_size):
+            group = chunks[start:start + self.section_size]
+            section_hash = hash_text("".join(node["hash"] for node in group))
+            sections.append((section_hash, [node["summary"] for node in group]))
+        return sections
+
+    @staticmethod
+    async def _summarize_changed(inputs: List[tuple], previous_nodes: List[Dict[str, str]], summarize) -> List[str]:
+        """Summarize the (hash, input) pairs not found among the previous nodes, concurrently"""
+        known = {node["hash"]: node["summary"] for node in previous_nodes}
+        summaries = [known.get(input_hash) for input_hash, _ in inputs]
+        missing = [i for i, summary in enumerate(summaries) if summary is None]
+        computed = await asyncio.gather(*(summarize(inputs[i][1]) for i in missing))
+        for i, summary in zip(missing, computed):
+            summaries[i] = summary
+        return summaries
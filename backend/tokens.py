@@ -0,0 +1,97 @@
+import re
+from functools import lru_cache
+from typing import List
+
+try:
+    import tiktoken
+except ImportError:  # Fall back to a character estimate without the tokenizer
+    tiktoken = None
+
+DEFAULT_MODEL = "gpt-3.5-turbo-16k"
+FALLBACK_ENCODING = "cl100k_base"
+
+# A sentence runs up to terminal punctuation followed by whitespace, or up to
+# a blank line; the trailing whitespace stays with the sentence so slicing
+# the original text between sentence ends loses nothing
+SENTENCE_END = re.compile(r"[.!?][\"')\]]*\s+|\n\s*\n")
+
+
+@lru_cache(maxsize=None)
+def get_encoder(model_name: str = DEFAULT_MODEL):
+    """Get the (cached) tokenizer for a model, or None if tiktoken is unavailable"""
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        return tiktoken.get_encoding(FALLBACK_ENCODING)
+
+
+def count_tokens(text: str, model_name: str = DEFAULT_MODEL) -> int:
+    """Count the tokens a model sees for a text"""
+    encoder = get_encoder(model_name)
+    if encoder is None:
+        return max(1, len(text) // 4)
+    return len(encoder.encode_ordinary(text))
+
+
+def split_by_tokens(text: str, max_tokens: int, model_name: str = DEFAULT_MODEL) -> List[str]:
+    """
+    Split text into as few chunks as possible with at most max_tokens each,
+    cutting only at sentence boundaries unless a single sentence is longer
+    than the budget.
+
+    Args:
+        text: Text to split
+        max_tokens: Token budget per chunk
+        model_name: Model whose tokenizer is used for counting
+
+    Returns:
+        Chunks, as stripped slices of the original text
+    """
+    chunks = []
+    chunk_start = 0
+    chunk_tokens = 0
+    position = 0
+
+    for sentence_end in _sentence_ends(text):
+        tokens = count_tokens(text[position:sentence_end], model_name)
+        if chunk_tokens and chunk_tokens + tokens > max_tokens:
+            _append(chunks, text[chunk_start:position])
+            chunk_start, chunk_tokens = position, 0
+        if tokens > max_tokens:
+            # A single oversized sentence is cut on token boundaries
+            chunks.extend(_split_sentence(text[position:sentence_end], max_tokens, model_name))
+            chunk_start, chunk_tokens = sentence_end, 0
+        else:
+            chunk_tokens += tokens
+        position = sentence_end
+
+    _append(chunks, text[chunk_start:position])
+    return chunks
+
+
+def _sentence_ends(text: str):
+    end = 0
+    for match in SENTENCE_END.finditer(text):
+        end = match.end()
+        yield end
+    if end < len(text):
+        yield len(text)
+
+
+def _append(chunks: List[str], chunk: str):
+    chunk = chunk.strip()
+    if chunk:
+        chunks.append(chunk)
+
+
+def _split_sentence(sentence: str, max_tokens: int, model_name: str) -> List[str]:
+    encoder = get_encoder(model_name)
+    if encoder is None:
+        size = max_tokens * 4
+        pieces = [sentence[i:i + size] for i in range(0, len(sentence), size)]
+    else:
+        ids = encoder.encode_ordinary(sentence)
+        pieces = [encoder.decode(ids[i:i + max_tokens]) for i in range(0, len(ids), max_tokens)]
+    return [piece.strip() for piece in pieces if piece.strip()]
@@ -0,0 +1,153 @@
+import os
+import hashlib
+from typing import BinaryIO, Optional
+from fastapi import HTTPException
+from config import settings
+
+READ_CHUNK_BYTES = 64 * 1024
+# Room for the multipart framing and the other form fields of an upload
+FORM_OVERHEAD_BYTES = 64 * 1024
+
+
+class UploadTooLarge(HTTPException):
+    """Raised while an upload is being received once it exceeds the size limit"""
+
+    def __init__(self, max_bytes: int):
+        super().__init__(status_code=413, detail=f"File too large. Maximum size is {max_bytes // (1024 * 1024)}MB")
+
+
+class UploadSizeLimitMiddleware:
+    """
+    ASGI middleware enforcing the upload size limit while the request body
+    is read, so oversized uploads are rejected after at most max_bytes
+    instead of being spooled in full first.
+
+    Requests declaring a larger Content-Length are rejected before any of
+    the body is read.
+    """
+
+    def __init__(self, app, max_bytes: int = None, paths: tuple = ("/upload",)):
+        self.app = app
+        self.max_bytes = (max_bytes or settings.MAX_FILE_SIZE) + FORM_OVERHEAD_BYTES
+        self.paths = paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        content_length = headers.get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_bytes:
+            await _send_too_large(send, self.max_bytes - FORM_OVERHEAD_BYTES)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # Raised inside form parsing; FastAPI passes HTTPExceptions through
+                    raise UploadTooLarge(self.max_bytes - FORM_OVERHEAD_BYTES)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+async def _send_too_large(send, max_bytes: int):
+    body = UploadTooLarge(max_bytes).detail.encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": 413,
+        "headers": [(b"content-type", b"text/plain; charset=utf-8"), (b"content-length", str(len(body)).encode())]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def sniff_file_type(head: bytes) -> Optional[str]:
+    """
+    Guess a supported file type from the first bytes of a file.
+
+    Returns:
+        "pdf", "docx" (any zip container), "txt", or None if unrecognized
+    """
+    if head.startswith(b"%PDF-"):
+        return "pdf"
+    if head.startswith(b"PK\x03\x04"):
+        return "docx"
+    if b"\x00" in head:
+        return None
+    try:
+        head.decode("utf-8")
+    except UnicodeDecodeError as e:
+        # A multi-byte character cut off at the end of the sample is fine
+        if e.start < len(head) - 3:
+            return None
+    return "txt"
+
+
+class ReceivedUpload:
+    """An uploaded file inspected in one pass: size, SHA-256 and sniffed type"""
+
+    def __init__(self, file: BinaryIO, filename: str, file_type: str, size: int, sha256: str):
+        self.file = file
+        self.filename = filename
+        self.file_type = file_type
+        self.size = size
+        self.sha256 = sha256
+
+
+def inspect_upload(file: BinaryIO, filename: str, max_bytes: int = None) -> ReceivedUpload:
+    """
+    Read an uploaded file once, enforcing the size limit, hashing it and
+    sniffing its type from the magic bytes, then rewind it for the parsers.
+
+    The file is the spooled buffer the multipart parser already wrote the
+    upload to: small files stay in memory and large ones are on disk once,
+    so nothing is copied again.
+
+    Args:
+        file: Seekable file object holding the upload
+        filename: Client-side file name, whose extension must match the content
+        max_bytes: Size limit, defaults to MAX_FILE_SIZE
+
+    Returns:
+        The inspected upload, with file positioned at the start
+
+    Raises:
+        UploadTooLarge: If the file exceeds the size limit
+        HTTPException: 400 if the type is unsupported or does not match the extension
+    """
+    max_bytes = max_bytes or settings.MAX_FILE_SIZE
+    extension = os.path.splitext(filename or "")[1].lower().lstrip(".")
+    if extension not in settings.ALLOWED_FILE_TYPES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported file type: .{extension}. Supported types are: .pdf, .docx, .txt"
+        )
+
+    digest = hashlib.sha256()
+    size = 0
+    head = b""
+    file.seek(0)
+    while True:
+        chunk = file.read(READ_CHUNK_BYTES)
+        if not chunk:
+            break
+        if not head:
+            head = chunk[:4096]
+        size += len(chunk)
+        if size > max_bytes:
+            raise UploadTooLarge(max_bytes)
+        digest.update(chunk)
+    file.seek(0)
+
+    if size == 0:
+        raise HTTPException(status_code=400, detail="The uploaded file is empty")
+    if sniff_file_type(head) != extension:
+        raise HTTPException(status_code=400, detail=f"File content does not match its .{extension} extension")
+
+    return ReceivedUpload(file, filename, extension, size, digest.hexdigest())
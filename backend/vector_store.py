@@ -1,75 +1,679 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+import os
+import json
+import time
+import shutil
+import sqlite3
+import datetime
+import threading
 import chromadb
 from chromadb.config import Settings
 from sentence_transformers import SentenceTransformer
 import numpy as np
 from config import settings
+from document_processor import DEFAULT_CHUNK_SIZE, DEFAULT_CHUNK_OVERLAP
+from instrumentation import stage, timed
+
+# Prefix for the per-tag boolean flags denormalized into chunk metadata.
+# Chroma metadata values must be scalars, so a document's tag list is stored
+# as one `tag:<id>` key per tag, which `where` clauses can match directly.
+TAG_KEY_PREFIX = "tag:"
+
+# The collection that existed before index versions, kept as the first version
+DEFAULT_VERSION = "v1"
+# Chunks assumed per deleted document of unknown size while no tombstone has a known count
+UNKNOWN_TOMBSTONE_CHUNKS = 10
+
+
+def _to_timestamp(value: Any) -> Optional[float]:
+    """Convert a datetime, ISO string or epoch number to an epoch timestamp"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    return value.timestamp()
+
+
+def build_chunk_metadata(document: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Denormalize the filterable fields of a document record into the flat
+    metadata stored with each of its chunks.
+    """
+    metadata = {
+        "title": document.get("title", ""),
+        "file_type": document.get("fileType", document.get("file_type", "unknown")),
+        "uploaded_by": document.get("uploadedBy", ""),
+    }
+    uploaded_at = _to_timestamp(document.get("uploadedAt"))
+    if uploaded_at is not None:
+        metadata["uploaded_at"] = uploaded_at
+    for tag_id in document.get("tags", []):
+        metadata[f"{TAG_KEY_PREFIX}{tag_id}"] = True
+    return metadata
+
+
+def build_where(filters: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Translate search filters into a Chroma `where` clause so they are applied
+    inside the index before ranking rather than to the returned top-k.
+
+    Supported filters: document_id, file_type (str or list), uploaded_by,
+    tags (chunks must carry every listed tag), uploaded_after and
+    uploaded_before (datetime, ISO string or epoch seconds).
+    """
+    if not filters:
+        return None
+
+    clauses = []
+    for field in ("document_id", "file_type", "uploaded_by"):
+        value = filters.get(field)
+        if not value:
+            continue
+        if isinstance(value, (list, tuple, set)):
+            clauses.append({field: {"$in": list(value)}})
+        else:
+            clauses.append({field: value})
+
+    for tag_id in filters.get("tags") or []:
+        clauses.append({f"{TAG_KEY_PREFIX}{tag_id}": True})
+
+    uploaded_after = _to_timestamp(filters.get("uploaded_after"))
+    if uploaded_after is not None:
+        clauses.append({"uploaded_at": {"$gte": uploaded_after}})
+    uploaded_before = _to_timestamp(filters.get("uploaded_before"))
+    if uploaded_before is not None:
+        clauses.append({"uploaded_at": {"$lte": uploaded_before}})
+
+    if not clauses:
+        return None
+    if len(clauses) == 1:
+        return clauses[0]
+    return {"$and": clauses}
+
+
+def add_chunks(collection, document_id: str, text_chunks: List[str], embeddings: np.ndarray,
+               metadata: Dict[str, Any] = None):
+    """Write a document's chunks and embeddings to a Chroma collection, replacing chunks with the same ids"""
+    # Every chunk carries its document id and the document's filterable
+    # fields so searches can be scoped inside the index
+    chunk_metadata = {**(metadata or {}), "document_id": document_id}
+    collection.upsert(
+        embeddings=np.asarray(embeddings).tolist(),
+        documents=text_chunks,
+        ids=[f"{document_id}_{i}" for i in range(len(text_chunks))],
+        metadatas=[{**chunk_metadata, "chunk_index": i} for i in range(len(text_chunks))]
+    )
+
+
+def similar_in_index(index, document_id: str, limit: int) -> List[Dict[str, Any]]:
+    """
+    Find documents similar to a given document in an in-memory index such
+    as a snapshot, by the nearest chunks to its first chunk.
+    """
+    _, embeddings = index.document_chunks(document_id)
+    if embeddings is None:
+        return []
+
+    formatted_results = []
+    seen_docs = set()
+    for chunk in index.search(embeddings[0], limit + 1):
+        doc_id = chunk["document_id"]
+        if doc_id != document_id and doc_id not in seen_docs:
+            seen_docs.add(doc_id)
+            formatted_results.append({
+                "document_id": doc_id,
+                "similarity_score": chunk["similarity_score"],
+                "metadata": chunk["metadata"]
+            })
+    return formatted_results[:limit]
+
+
+class IndexVersionRegistry:
+    """
+    Records the versions of the vector index and which one serves searches.
+
+    Each version is its own Chroma collection built with one embedding model
+    and chunking. The registry is a small JSON file replaced atomically, so
+    switching versions is a single write.
+    """
+
+    def __init__(self, path: str = None, default: Dict[str, Any] = None):
+        """
+        Args:
+            path: JSON file holding the registry
+            default: Settings of the first version, used when the file does not exist yet
+        """
+        self.path = path or settings.INDEX_VERSIONS_PATH
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                self._data = json.load(file)
+        except FileNotFoundError:
+            version = {
+                "name": DEFAULT_VERSION,
+                "collection": "documents",
+                "model_name": "all-MiniLM-L6-v2",
+                "chunk_size": DEFAULT_CHUNK_SIZE,
+                "chunk_overlap": DEFAULT_CHUNK_OVERLAP,
+                "span_name": "chunks",
+                **(default or {}),
+                "status": "active",
+                "created_at": datetime.datetime.now().isoformat()
+            }
+            self._data = {"active": DEFAULT_VERSION, "previous": None, "versions": {DEFAULT_VERSION: version}}
+
+    @property
+    def active(self) -> str:
+        return self._data["active"]
+
+    @property
+    def previous(self) -> Optional[str]:
+        return self._data["previous"]
+
+    def get(self, name: str) -> Optional[Dict[str, Any]]:
+        version = self._data["versions"].get(name)
+        return dict(version) if version else None
+
+    def versions(self) -> List[Dict[str, Any]]:
+        return [dict(version) for version in self._data["versions"].values()]
+
+    def create(self, model_name: str, chunk_size: int, chunk_overlap: int) -> Dict[str, Any]:
+        """Register a new version to be built"""
+        with self._lock:
+            number = 1 + max(int(name.lstrip("v")) for name in self._data["versions"])
+            name = f"v{number}"
+            version = {
+                "name": name,
+                "collection": f"documents_{name}",
+                "model_name": model_name,
+                "chunk_size": chunk_size,
+                "chunk_overlap": chunk_overlap,
+                "span_name": f"chunks@{name}",
+                "status": "building",
+                "created_at": datetime.datetime.now().isoformat(),
+                "documents": 0
+            }
+            self._data["versions"][name] = version
+            self._save()
+            return dict(version)
+
+    def update(self, name: str, **fields):
+        with self._lock:
+            self._data["versions"][name].update(fields)
+            self._save()
+
+    def activate(self, name: str):
+        """Make a version the one serving searches, keeping the current one for rollback"""
+        with self._lock:
+            current = self._data["active"]
+            if name == current:
+                return
+            self._data["versions"][current]["status"] = "standby"
+            self._data["versions"][name]["status"] = "active"
+            self._data["versions"][name]["activated_at"] = datetime.datetime.now().isoformat()
+            self._data["active"] = name
+            self._data["previous"] = current
+            self._save()
+
+    def remove(self, name: str):
+        with self._lock:
+            self._data["versions"].pop(name, None)
+            if self._data["previous"] == name:
+                self._data["previous"] = None
+            self._save()
+
+    def _save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(self._data, file, indent=2)
+        os.replace(temp_path, self.path)
+
+
+class TombstoneSet:
+    """
+    Documents deleted from the index whose chunks have not been removed yet.
+
+    Deleting only records a tombstone, which searches check in O(1) to drop
+    the document's hits; compaction later removes the chunks in batches.
+    Tombstones are kept in memory and persisted in SQLite.
+    """
+
+    def __init__(self, path: str = None):
+        """
+        Args:
+            path: SQLite file to persist tombstones in
+        """
+        self.path = path or settings.TOMBSTONE_PATH
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS tombstones (
+                document_id TEXT PRIMARY KEY,
+                chunk_count INTEGER NOT NULL,
+                deleted_at REAL NOT NULL
+            )
+        """)
+        # document id -> number of chunk ids to remove, 0 if unknown
+        self._chunk_counts: Dict[str, int] = dict(
+            self.conn.execute("SELECT document_id, chunk_count FROM tombstones ORDER BY deleted_at")
+        )
+        self.chunk_total = sum(self._chunk_counts.values())
+        self._unknown = sum(1 for count in self._chunk_counts.values() if not count)
+
+    @property
+    def estimated_chunks(self) -> int:
+        """Chunks still in the index for all tombstones, counting the mean known size for unknown ones"""
+        known = len(self._chunk_counts) - self._unknown
+        per_document = self.chunk_total / known if known else UNKNOWN_TOMBSTONE_CHUNKS
+        return self.chunk_total + round(self._unknown * per_document)
+
+    def __contains__(self, document_id: str) -> bool:
+        return document_id in self._chunk_counts
+
+    def __len__(self) -> int:
+        return len(self._chunk_counts)
+
+    def add(self, documents: Dict[str, int]):
+        """
+        Record deleted documents.
+
+        Args:
+            documents: Chunk count of each document id, 0 if unknown
+        """
+        now = time.time()
+        with self._lock:
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO tombstones (document_id, chunk_count, deleted_at) VALUES (?, ?, ?)",
+                    [(document_id, count, now) for document_id, count in documents.items()]
+                )
+            for document_id, count in documents.items():
+                if self._chunk_counts.get(document_id, -1) == 0:
+                    self._unknown -= 1
+                if count == 0:
+                    self._unknown += 1
+                self.chunk_total += count - self._chunk_counts.get(document_id, 0)
+                self._chunk_counts[document_id] = count
+
+    def oldest(self, limit: int) -> Dict[str, int]:
+        """Get up to limit of the oldest tombstones"""
+        with self._lock:
+            return dict(list(self._chunk_counts.items())[:limit])
+
+    def remove(self, document_ids: List[str]):
+        """Forget tombstones whose chunks have been removed"""
+        with self._lock:
+            with self.conn:
+                self.conn.executemany("DELETE FROM tombstones WHERE document_id = ?", [(i,) for i in document_ids])
+            for document_id in document_ids:
+                count = self._chunk_counts.pop(document_id, None)
+                if count == 0:
+                    self._unknown -= 1
+                elif count:
+                    self.chunk_total -= count
+
+
+class IndexHandle:
+    """The registry entry, embedding model, collection and snapshot index of one index version"""
+
+    def __init__(self, version: Dict[str, Any], model, collection, snapshot=None):
+        self.version = version
+        self.model = model
+        self.collection = collection
+        self.snapshot = snapshot
+
 
 class VectorStore:
-    def add_document(self, document_id: str, text_chunks: List[str], metadata: Dict[str, Any] = None):
-        """Add document chunks to the vector store"""
-        if self.use_mock:
+    def __init__(self, use_mock: bool = False, model_name: str = "all-MiniLM-L6-v2", collection_name: str = "documents",
+                 models: Dict[str, SentenceTransformer] = None):
+        """
+        Initialize the embedding model and the Chroma collection of the
+        active index version.
+
+        Args:
+            use_mock: If True, skip loading the model and the vector database
+            model_name: SentenceTransformer model of the first index version
+            collection_name: Chroma collection of the first index version
+            models: Embedding models already loaded, by name
+        """
+        self.use_mock = use_mock
+        default = {"collection": collection_name, "model_name": model_name}
+        if use_mock:
+            self.registry = None
+            self._handle = IndexHandle({**default, "name": DEFAULT_VERSION, "span_name": "chunks",
+                                        "chunk_size": DEFAULT_CHUNK_SIZE, "chunk_overlap": DEFAULT_CHUNK_OVERLAP}, None, None)
+            return
+
+        self.registry = IndexVersionRegistry(default=default)
+        self.tombstones = TombstoneSet()
+        self.client = chromadb.PersistentClient(
+            path=settings.CHROMA_PERSIST_DIRECTORY,
+            settings=Settings(anonymized_telemetry=False)
+        )
+        self._models: Dict[str, SentenceTransformer] = dict(models or {})
+        self._models_lock = threading.Lock()
+        version = self.registry.get(self.registry.active)
+        collection = self.open_collection(version)
+        self._handle = IndexHandle(version, self.get_model(version["model_name"]), collection,
+                                   self.open_snapshot(version, collection))
+        
+        # Versions being built or kept for rollback also receive tag updates and deletes
+        self._tracked = {
+            v["name"]: self.open_collection(v)
+            for v in self.registry.versions() if v["name"] != version["name"] and v["status"] in ("building", "ready", "standby")
+        }
+
+    @property
+    def version(self) -> Dict[str, Any]:
+        """Registry entry of the index version serving searches"""
+        return self._handle.version
+
+    @property
+    def model(self) -> SentenceTransformer:
+        return self._handle.model
+
+    @property
+    def collection(self):
+        return self._handle.collection
+
+    def get_model(self, model_name: str) -> SentenceTransformer:
+        """Get an embedding model, loading it once"""
+        with self._models_lock:
+            if model_name not in self._models:
+                self._models[model_name] = SentenceTransformer(model_name)
+            return self._models[model_name]
+
+    def open_collection(self, version: Dict[str, Any]):
+        return self.client.get_or_create_collection(name=version["collection"])
+
+    def open_snapshot(self, version: Dict[str, Any], collection, rebuild: bool = False):
+        """
+        Open the snapshot index of a version (index_snapshot.py), or return
+        None when snapshots are disabled.
+
+        An existing snapshot serves searches at once and is checked against
+        its checksum in the background. A missing or corrupt one is built
+        from the collection in the background; searches use the collection
+        until it is ready.
+
+        Args:
+            version: Registry entry of the version
+            collection: The version's Chroma collection
+            rebuild: Discard what is on disk, e.g. a snapshot that stopped
+                receiving changes when its version stopped serving
+        """
+        if not settings.SNAPSHOT_ENABLED:
+            return None
+        # Imported here because index_snapshot builds on this module
+        from index_snapshot import SnapshotIndex, export_collection
+
+        directory = os.path.join(settings.SNAPSHOT_DIRECTORY, version["name"])
+        if rebuild:
+            shutil.rmtree(directory, ignore_errors=True)
+        index = SnapshotIndex(directory, version)
+
+        def prepare():
+            try:
+                if index.ready:
+                    if index.snapshot.verify():
+                        return
+                    print(f"Vector index snapshot {index.path} failed its checksum, rebuilding it")
+                    index.discard()
+                with stage("vector_store.snapshot_build"):
+                    index.merge(export_collection(collection, exclude=self.tombstones.__contains__))
+            except Exception as e:
+                print(f"Building the vector index snapshot failed: {e}")
+
+        if not index.ready or settings.SNAPSHOT_VERIFY:
+            threading.Thread(target=prepare, name="snapshot-prepare", daemon=True).start()
+        return index
+
+    def track(self, name: str):
+        """Keep a non-active version's collection up to date with tag changes and deletes"""
+        self._tracked[name] = self.open_collection(self.registry.get(name))
+
+    def activate(self, name: str):
+        """
+        Serve searches from another index version. The model is loaded
+        first and the switch is a single assignment, so every search runs
+        against one consistent version.
+        """
+        version = self.registry.get(name)
+        if version is None:
+            raise ValueError(f"Unknown index version: {name}")
+        collection = self.open_collection(version)
+        handle = IndexHandle(version, self.get_model(version["model_name"]), collection,
+                             self.open_snapshot(version, collection, rebuild=True))
+        previous = self._handle
+        self.registry.activate(name)
+        handle.version = self.registry.get(name)
+        self._handle = handle
+        self._tracked.pop(name, None)
+        self._tracked[previous.version["name"]] = previous.collection
+        if previous.snapshot is not None:
+            previous.snapshot.close()
+
+    def drop_version(self, name: str):
+        """Delete the collection of a version that is not active"""
+        if name == self.version["name"]:
+            raise ValueError("The active index version cannot be dropped")
+        version = self.registry.get(name)
+        self._tracked.pop(name, None)
+        if version is not None:
+            try:
+                self.client.delete_collection(version["collection"])
+            except Exception:
+                pass  # Never created
+            self.registry.remove(name)
+            shutil.rmtree(os.path.join(settings.SNAPSHOT_DIRECTORY, name), ignore_errors=True)
+
+    def _collections(self) -> list:
+        return [self.collection, *self._tracked.values()]
+
+    def add_document(self, document_id: str, text_chunks: List[str], metadata: Dict[str, Any] = None,
+                     embeddings: Optional[np.ndarray] = None):
+        """
+        Add document chunks to the active index version. Embeddings are
+        computed unless given, e.g. when copied from a document with the
+        same content.
+        """
+        if self.use_mock or not text_chunks:
             return
         
+        handle = self._handle
+        
         # Generate embeddings for chunks
-        embeddings = self.model.encode(text_chunks)
+        if embeddings is None:
+            with stage("vector_store.encode"):
+                embeddings = handle.model.encode(text_chunks)
         
-        # Add to Chroma
-        self.collection.add(
-            embeddings=embeddings.tolist(),
-            documents=text_chunks,
-            ids=[f"{document_id}_{i}" for i in range(len(text_chunks))],
-            metadatas=[{**metadata, "chunk_index": i} for i in range(len(text_chunks))] if metadata else None
-        )
+        with stage("vector_store.chroma_write"):
+            add_chunks(handle.collection, document_id, text_chunks, embeddings, metadata)
+        if handle.snapshot is not None:
+            with stage("vector_store.snapshot_write"):
+                handle.snapshot.add_document(document_id, text_chunks, embeddings, metadata or {})
+
+    def update_document_tags(self, document_id: str, tag_ids: List[str], previous_tag_ids: List[str] = None):
+        """Rewrite the denormalized tag flags on every chunk of a document"""
+        if self.use_mock:
+            return
+
+        # Removed tags are flipped to False rather than dropped, because
+        # Chroma merges metadata on update
+        flags = {f"{TAG_KEY_PREFIX}{tag_id}": False for tag_id in previous_tag_ids or []}
+        flags.update({f"{TAG_KEY_PREFIX}{tag_id}": True for tag_id in tag_ids})
+        if not flags:
+            return
+        snapshot = self._handle.snapshot
+        if snapshot is not None:
+            snapshot.update_metadata(document_id, flags)
+        for collection in self._collections():
+            results = collection.get(where={"document_id": document_id}, include=[])
+            if results and results['ids']:
+                collection.update(
+                    ids=results['ids'],
+                    metadatas=[flags for _ in results['ids']]
+                )
         
-    def search(self, query: str, limit: int = 5) -> List[Dict[str, Any]]:
-        """Search for similar documents using the query"""
+    def search(self, query: str, limit: int = 5, filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """Search for similar documents using the query, optionally pre-filtered by metadata"""
         if self.use_mock:
             return []
             
+        # The query must be embedded by the model of the collection it searches
+        handle = self._handle
+        
         # Generate query embedding
-        query_embedding = self.model.encode(query)
+        with stage("vector_store.encode"):
+            query_embedding = handle.model.encode(query)
+
+        snapshot = handle.snapshot
+        if snapshot is not None and snapshot.ready:
+            with stage("vector_store.snapshot_query"):
+                return snapshot.search(query_embedding, limit, filters)
         
-        # Search in Chroma
-        results = self.collection.query(
-            query_embeddings=[query_embedding.tolist()],
-            n_results=limit
-        )
+        # Search in Chroma; the where clause restricts candidates before ranking.
+        # Extra hits are fetched to make up for chunks of deleted documents
+        # that compaction has not removed yet
+        overfetch = min(self.tombstones.estimated_chunks, settings.TOMBSTONE_MAX_OVERFETCH)
+        with stage("vector_store.chroma_query"):
+            results = handle.collection.query(
+                query_embeddings=[query_embedding.tolist()],
+                n_results=limit + overfetch,
+                where=build_where(filters)
+            )
         
         # Format results
         formatted_results = []
         for i in range(len(results['ids'][0])):
-            doc_id = results['ids'][0][i].split('_')[0]  # Get original document ID
+            metadata = results['metadatas'][0][i] if results['metadatas'] else {}
+            doc_id = metadata.get('document_id') or results['ids'][0][i].rsplit('_', 1)[0]
+            if doc_id in self.tombstones:
+                continue
+            if len(formatted_results) == limit:
+                break
             formatted_results.append({
                 'document_id': doc_id,
+                'chunk_id': results['ids'][0][i],
                 'chunk_text': results['documents'][0][i],
                 'similarity_score': float(results['distances'][0][i]) if 'distances' in results else 0.0,
-                'metadata': results['metadatas'][0][i] if results['metadatas'] else {}
+                'metadata': metadata
             })
         
         return formatted_results
 
-    def delete_document(self, document_id: str):
-        """Delete all chunks for a document"""
+    def count_chunks(self) -> int:
+        """Get the number of chunks in the index without loading them"""
         if self.use_mock:
+            return 0
+        snapshot = self._handle.snapshot
+        if snapshot is not None and snapshot.ready:
+            return snapshot.chunk_count
+        return self.collection.count() - self.tombstones.chunk_total
+
+    @timed("vector_store.chroma_read")
+    def get_document_embeddings(self, document_id: str) -> tuple:
+        """
+        Get a document's chunks and their stored embeddings in chunk order.
+
+        Returns:
+            (list of chunk texts, array of embeddings or None)
+        """
+        if self.use_mock or document_id in self.tombstones:
+            return [], None
+
+        snapshot = self._handle.snapshot
+        if snapshot is not None and snapshot.ready:
+            return snapshot.document_chunks(document_id)
+
+        results = self.collection.get(where={"document_id": document_id}, include=["documents", "metadatas", "embeddings"])
+        if not results or not results['ids']:
+            return [], None
+
+        order = sorted(range(len(results['ids'])), key=lambda i: results['metadatas'][i].get("chunk_index", 0))
+        embeddings = np.asarray(results['embeddings'], dtype=float)[order]
+        return [results['documents'][i] for i in order], embeddings
+
+    def delete_document(self, document_id: str, chunk_count: int = 0):
+        """
+        Delete a document from search. Its chunks are hidden at once and
+        removed from every index version kept by the next compaction.
+
+        Args:
+            document_id: The ID of the document
+            chunk_count: Number of chunks it has in the active index version,
+                so they can be removed by id; 0 if unknown
+        """
+        self.delete_documents({document_id: chunk_count})
+
+    def delete_documents(self, documents: Dict[str, int]):
+        """Delete several documents from search; see delete_document"""
+        if self.use_mock or not documents:
             return
+        self.tombstones.add(documents)
+        snapshot = self._handle.snapshot
+        if snapshot is not None:
+            snapshot.delete(list(documents))
+
+    @timed("vector_store.compact")
+    def compact(self, batch_size: int = None) -> int:
+        """
+        Remove the chunks of up to batch_size deleted documents.
+
+        Chunk ids are "<document id>_<chunk index>", so chunks of a known
+        count are removed from the active version by id without reading
+        them back. Other versions may be chunked differently and are
+        filtered by document id instead.
+
+        Returns:
+            Number of documents compacted
+        """
+        if self.use_mock:
+            return 0
+        batch = self.tombstones.oldest(batch_size or settings.COMPACTION_BATCH_SIZE)
+        if not batch:
+            return 0
+
+        handle = self._handle
+        chunk_ids = [f"{document_id}_{i}" for document_id, count in batch.items() for i in range(count)]
+        unknown = [document_id for document_id, count in batch.items() if not count]
+        if chunk_ids:
+            handle.collection.delete(ids=chunk_ids)
+        if unknown:
+            handle.collection.delete(where={"document_id": {"$in": unknown}})
+        for collection in self._tracked.values():
+            collection.delete(where={"document_id": {"$in": list(batch)}})
+
+        self.tombstones.remove(list(batch))
+        return len(batch)
             
-        # Get all chunk IDs for the document
-        results = self.collection.get(where={"document_id": document_id})
-        if results and results['ids']:
-            self.collection.delete(ids=results['ids'])
-            
+    @timed("vector_store.similar")
     def get_similar_documents(self, document_id: str, limit: int = 3) -> List[Dict[str, Any]]:
         """Find documents similar to a given document"""
         if self.use_mock:
             return []
             
-        # Get document embeddings
-        results = self.collection.get(where={"document_id": document_id})
-        if not results or not results['embeddings']:
+        if document_id in self.tombstones:
             return []
+
+        snapshot = self._handle.snapshot
+        if snapshot is not None and snapshot.ready:
+            return similar_in_index(snapshot, document_id, limit)
             
-        # Use first chunk as representative embedding
+        # Use first chunk as representative embedding, read by its id
+        results = self.collection.get(ids=[f"{document_id}_0"], include=["embeddings"])
+        if not results or results['embeddings'] is None or len(results['embeddings']) == 0:
+            return []
         doc_embedding = results['embeddings'][0]
         
         # Search for similar documents
@@ -78,12 +682,12 @@ class VectorStore:
             n_results=limit + 1  # Add 1 to account for the document itself
         )
         
-        # Filter out the original document and format results
+        # Filter out the original and deleted documents and format results
         formatted_results = []
         seen_docs = set()
         for i in range(len(similar['ids'][0])):
-            doc_id = similar['ids'][0][i].split('_')[0]
-            if doc_id != document_id and doc_id not in seen_docs:
+            doc_id = similar['ids'][0][i].rsplit('_', 1)[0]
+            if doc_id != document_id and doc_id not in seen_docs and doc_id not in self.tombstones:
                 seen_docs.add(doc_id)
                 formatted_results.append({
                     'document_id': doc_id,
@@ -91,4 +695,65 @@ class VectorStore:
                     'metadata': similar['metadatas'][0][i] if similar['metadatas'] else {}
                 })
                 
-        return formatted_results[:limit]
\ No newline at end of file
+        return formatted_results[:limit]
+
+    def merge_snapshot(self, force: bool = False) -> bool:
+        """
+        Merge the append log of the active version's snapshot into a new
+        snapshot once it has grown past SNAPSHOT_LOG_MAX_BYTES.
+
+        Returns:
+            Whether a snapshot was written
+        """
+        snapshot = None if self.use_mock else self._handle.snapshot
+        if snapshot is None or not snapshot.ready:
+            return False
+        if not force and snapshot.log_size < settings.SNAPSHOT_LOG_MAX_BYTES:
+            return False
+        with stage("vector_store.snapshot_merge"):
+            snapshot.merge()
+        return True
+
+    def write_snapshot(self, path: str) -> str:
+        """Write the active version, without deleted documents, to a snapshot file"""
+        # Imported here because index_snapshot builds on this module
+        from index_snapshot import write_snapshot, export_collection
+
+        handle = self._handle
+        if handle.snapshot is not None and handle.snapshot.ready:
+            return handle.snapshot.export(path)
+        shard_map, documents = export_collection(handle.collection, exclude=self.tombstones.__contains__)
+        return write_snapshot(path, handle.version, documents, shard_map)
+
+    def snapshot_changes(self, sequence: int) -> Optional[tuple]:
+        """
+        Get the active version's snapshot and the documents changed on top
+        of it after a change sequence number (see SnapshotIndex.changes_since).
+
+        Returns:
+            (snapshot, latest sequence, changed documents), or None while
+            there is no snapshot to apply changes to
+        """
+        snapshot = None if self.use_mock else self._handle.snapshot
+        if snapshot is None or not snapshot.ready:
+            return None
+        return snapshot.changes_since(sequence)
+
+    def snapshot_status(self) -> Dict[str, Any]:
+        """Describe the active version's snapshot and its append log"""
+        snapshot = None if self.use_mock else self._handle.snapshot
+        if snapshot is None:
+            return {"enabled": False}
+        status = {"enabled": True, "ready": snapshot.ready, "log_bytes": snapshot.log_size,
+                  "changed_documents": snapshot.changed_documents}
+        if snapshot.ready:
+            status.update({
+                "path": snapshot.snapshot.path,
+                "created_at": snapshot.snapshot.created_at,
+                "documents": snapshot.snapshot.document_count,
+                "chunks": snapshot.snapshot.chunk_count,
+                "tenants": len(snapshot.snapshot.tenants),
+                "shards": len(snapshot.snapshot.shards),
+                "split_tenants": snapshot.snapshot.shard_map.splits,
+            })
+        return status